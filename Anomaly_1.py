@@ -1,14 +1,50 @@
+import contextlib
+import hashlib
+import mmap
 import os
 import re
+import shutil
+import tempfile
+import time
+import zlib
+from collections import deque
 from pathlib import Path
 
-def transform_with_pattern(data, chunk_size=4, xor_value=0xFF):
-    """Apply XOR transformation per chunk."""
-    transformed = bytearray()
-    for i in range(0, len(data), chunk_size):
-        chunk = data[i:i + chunk_size]
-        transformed.extend([b ^ xor_value & 0xFF for b in chunk])
-    return transformed
+from byte_stats import (byte_histogram, count_units, file_counts, file_histogram, majority,
+                        ranked_xor_keys)
+from container import EXTENSION as CONTAINER_EXTENSION
+from container import ContainerWriter, file_crc32, is_container
+from container import decode_to_file as decode_container
+from container import read_header
+from discovery import CHECKSUM_FILE, iter_files, iter_variation_folders
+from metrics import METRICS, count, progress_reporter, stage
+from parallel import ordered_map
+from result_cache import cached_result
+from scorers import rank_keys
+from verify import (CONTENT_HASH, audit_file, crc_transform, expected_checksum,
+                    expected_content, file_checksums, file_digest, load_checksums,
+                    record_checksums)
+from xor_transform import (DEFAULT_BLOCK_SIZE, chunk_keys, keyed_blocks, stream_chunk_keys,
+                           transform_buffer, transform_file_cloned,
+                           transform_file_in_place, transform_with_keys, transformed_blocks)
+
+# How plain variation files are decoded: 'copy' reads and writes a new
+# file, 'clone' transforms a reflink/copy of the input in place, 'in-place'
+# transforms the variation file itself and moves it to the decoded name
+WRITE_MODES = ('copy', 'clone', 'in-place')
+# What a decode does with an output identical to one it already wrote:
+# 'skip' writes nothing, 'link' hard-links the first copy under the new name
+DEDUP_MODES = ('skip', 'link')
+
+def transform_with_pattern(data, chunk_size=4, xor_value=0xFF, out=None, keys=None):
+    """Apply XOR transformation per chunk.
+
+    With a per-chunk key table ``keys`` (see xor_transform.chunk_keys) each
+    chunk uses its own key and ``xor_value`` is ignored.
+    """
+    if keys is not None:
+        return transform_with_keys(data, chunk_size, keys, out)
+    return transform_buffer(data, chunk_size, xor_value, out)
 
 def extract_xor_info(filename):
     """Extract chunk size and XOR value from filename using a single regex."""
@@ -29,78 +65,301 @@ def extract_xor_info(filename):
         return chunk_size, xor_val
     return 4, 255
 
-def decode_variation_file(input_file, output_dir, file_counter):
-    """Decode a single variation file."""
+def _decode_to_path(input_file, out_path, block_size=None, write_mode='copy', digest=False,
+                    verify=False):
+    """Decode input_file into out_path; return ``(bytes_written, crc32, digest)``.
+
+    With a ``block_size`` the file is streamed in chunk-aligned blocks so
+    memory use does not depend on the file size. ``write_mode`` (see
+    WRITE_MODES) applies to plain variation files; 'in-place' consumes
+    input_file. Containers are always decoded into a new file. The CRC-32
+    of the output is computed as it is written. The clone and in-place
+    modes never hold the decoded bytes in Python, so they read the output
+    back for it when asked to ``verify`` (the CRC-32 is None otherwise).
+    With ``digest`` the output's hex CONTENT_HASH digest is returned as
+    well (computed in the same pass), else None.
+    """
+    if write_mode not in WRITE_MODES:
+        raise ValueError(f"Unknown write mode '{write_mode}'")
+    if is_container(input_file):
+        # Self-describing: transform, length and checksum come from the header
+        written = decode_container(input_file, out_path, 0, block_size or DEFAULT_BLOCK_SIZE)
+        return (written, read_header(input_file)['crc32'],
+                file_digest(out_path) if digest else None)
+
+    chunk_size, xor_val = extract_xor_info(os.path.basename(input_file))
+    if write_mode != 'copy':
+        if write_mode == 'clone':
+            written = transform_file_cloned(input_file, out_path, chunk_size, xor_val,
+                                            block_size or DEFAULT_BLOCK_SIZE)[0]
+        else:
+            written = transform_file_in_place(input_file, chunk_size, xor_val,
+                                              block_size or DEFAULT_BLOCK_SIZE)
+            shutil.move(input_file, out_path)
+        if not (verify or digest):
+            return written, None, None
+        crc, content = file_checksums(out_path, block_size or DEFAULT_BLOCK_SIZE, digest)
+        return written, crc if verify else None, content
+    content = hashlib.new(CONTENT_HASH) if digest else None
+    if block_size:
+        with open(input_file, 'rb') as src, open(out_path, 'wb') as dst:
+            written, _, crc = crc_transform(src, dst, chunk_size, xor_val, block_size,
+                                            dst_hash=content)
+        return written, crc, content.hexdigest() if digest else None
+
+    with open(input_file, 'rb') as f:
+        encoded = f.read()
+    decoded = transform_with_pattern(encoded, chunk_size, xor_val)
+
+    with open(out_path, 'wb') as out_f:
+        out_f.write(decoded)
+    if digest:
+        content.update(decoded)
+    return len(decoded), zlib.crc32(decoded), content.hexdigest() if digest else None
+
+def _checksum_error(input_file, written, crc, expected):
+    """Message for a decode that does not match its recorded original, or None."""
+    if expected is None or crc is None or (written, crc) == tuple(expected[:2]):
+        return None
+    return (f"  ✗ Checksum mismatch: {Path(input_file).name} "
+            f"(length {written}/{expected[0]}, crc {crc:08x}/{expected[1]:08x})")
+
+def _decode_error_message(input_file, error):
+    if isinstance(error, FileNotFoundError):
+        return f"  ✗ Error: File '{input_file}' not found."
+    if isinstance(error, (IOError, OSError)):
+        return f"  ✗ Error: An I/O error occurred while processing '{input_file}': {error}"
+    return f"  ✗ An unexpected error occurred: {error}"
+
+def _print_decoded(input_file, out_name, written):
+    print(f"  ✓ Decoded: {Path(input_file).name} → {out_name}")
+
+def decode_variation_file(input_file, output_dir, file_counter, block_size=None, progress=None,
+                          write_mode='copy'):
+    """Decode a single variation file (``write_mode`` as in WRITE_MODES).
+
+    On success ``progress(input_file, out_name, bytes_written)`` is called
+    instead of printing the decoded line, when given. A decode that does
+    not match the checksum recorded at encode time (see verify.py) is
+    reported and counts as a failure; the output is kept for inspection.
+    """
     try:
-        with open(input_file, 'rb') as f:
-            encoded = f.read()
-
-        chunk_size, xor_val = extract_xor_info(os.path.basename(input_file))
-        decoded = transform_with_pattern(encoded, chunk_size, xor_val)
-
         out_name = f"decoded_{Path(input_file).stem}_{file_counter:04d}.jpg"
-        out_path = os.path.join(output_dir, out_name)
-
-        with open(out_path, 'wb') as out_f:
-            out_f.write(decoded)
-
-        print(f"  ✓ Decoded: {Path(input_file).name} → {out_name}")
+        expected = expected_checksum(load_checksums(os.path.dirname(input_file)),
+                                     os.path.basename(input_file))
+        with stage('decode'):
+            written, crc, _ = _decode_to_path(input_file, os.path.join(output_dir, out_name),
+                                              block_size, write_mode,
+                                              verify=expected is not None)
+        mismatch = _checksum_error(input_file, written, crc, expected)
+        if mismatch:
+            count('files_failed')
+            print(mismatch)
+            return False
+        count('files')
+        count('bytes_read', written if write_mode == 'in-place' else os.path.getsize(input_file))
+        count('bytes_written', written)
+        (progress or _print_decoded)(input_file, out_name, written)
         return True
-
-    except FileNotFoundError:
-        print(f"  ✗ Error: File '{input_file}' not found.")
-        return False
-    except (IOError, OSError) as e:
-        print(f"  ✗ Error: An I/O error occurred while processing '{input_file}': {e}")
-        return False
     except Exception as e:
-        print(f"  ✗ An unexpected error occurred: {e}")
+        count('files_failed')
+        print(_decode_error_message(input_file, e))
         return False
 
-def encode_to_variations(input_file, output_dir, chunk_size=255):
-    """Encodes to XOR variations, saving only best zero and one variations."""
+def _decode_job(job):
+    """Process-pool worker: decode into a temporary path, never raise.
+
+    A job without a temporary path is a known duplicate and is not decoded.
+    """
+    input_file, tmp_path, block_size, write_mode, digest, verify = job
+    if tmp_path is None:
+        return None, None, None, None
+    try:
+        return _decode_to_path(input_file, tmp_path, block_size, write_mode, digest,
+                               verify) + (None,)
+    except Exception as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return None, None, None, _decode_error_message(input_file, e)
+
+def _rescore_keys(input_file, data, ranked, chunk_size, scorer, sample_size):
+    """Reorder (xor_val, count_difference) keys by a compression-aware scorer."""
+    if not ranked:
+        return ranked
+    differences = dict(ranked)
+    keys = [xor_val for xor_val, _ in ranked]
+    if data is not None:
+        ordered = rank_keys(data, keys, scorer, chunk_size, sample_size)
+    else:
+        with open(input_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            ordered = rank_keys(mm, keys, scorer, chunk_size, sample_size or DEFAULT_BLOCK_SIZE)
+    return [(xor_val, differences[xor_val]) for xor_val in ordered]
+
+def _write_container(input_file, original_data, xor_folder, chunk_size, block_size, variations,
+                     backend, level):
+    """Store (kind, xor_val, count_difference, keys) variations in one container file."""
+    if original_data is not None:
+        crc, length = zlib.crc32(original_data), len(original_data)
+    else:
+        crc, length = file_crc32(input_file, block_size)
+    out_name = f"{Path(input_file).stem}_chunk{chunk_size}{CONTAINER_EXTENSION}"
+    with ContainerWriter(os.path.join(xor_folder, out_name), input_file, length, crc,
+                         len(variations), backend, level) as writer:
+        for kind, xor_val, difference, keys in variations:
+            if original_data is not None:
+                blocks = [transform_with_pattern(original_data, chunk_size, xor_val,
+                                                 keys=keys or None)]
+                writer.add(kind, chunk_size, xor_val, difference, blocks, keys)
+            else:
+                with open(input_file, 'rb') as src:
+                    if keys:
+                        blocks = keyed_blocks(src, chunk_size, keys, block_size)
+                    else:
+                        blocks = transformed_blocks(src, chunk_size, xor_val, block_size)
+                    writer.add(kind, chunk_size, xor_val, difference, blocks, keys)
+    return out_name
+
+def encode_to_variations(input_file, output_dir, chunk_size=255, block_size=None,
+                         scorer='imbalance', shortlist=16, sample_size=None,
+                         container=False, top=1, backend='none', level=None, cache=None,
+                         adaptive=False):
+    """Encodes to XOR variations, saving only best zero and one variations.
+
+    With a ``block_size`` the input is never loaded whole: the histogram is
+    built block by block and the winners are streamed to their files.
+    ``scorer`` other than 'imbalance' reorders the ``shortlist`` best keys
+    of each kind by a compression-aware cost measured on a sample of
+    ``sample_size`` bytes (see scorers.py).
+
+    With ``container=True`` the ``top`` best variations of each kind go into
+    one self-describing container (see container.py) whose payloads are
+    compressed with ``backend``; the return value counts the variations.
+
+    With a result_cache.ResultCache as ``cache`` the ranked keys are looked
+    up by the input's content hash, so a repeat run only transforms and
+    writes.
+
+    ``adaptive=True`` adds a variation in which every chunk is XORed with
+    its own most frequent byte; its key table is stored in the container,
+    so it implies ``container=True``.
+
+    Plain variation files get their checksums, and their original's,
+    recorded in the folder's sidecar (see verify.py) for decode and audit.
+    """
     if not os.path.isfile(input_file):
         print("Error: Input must be a file")
         return 0
 
     try:
-        with open(input_file, 'rb') as f:
-            original_data = f.read()
+        original_data = None
+        if not block_size:
+            with stage('read'), open(input_file, 'rb') as f:
+                original_data = f.read()
+        count('bytes_read', os.path.getsize(input_file))
 
         xor_folder = os.path.join(output_dir, f"{Path(input_file).stem}_xor_variations")
         os.makedirs(xor_folder, exist_ok=True)
 
-        best_zeros = None
-        best_ones = None
-
-        for xor_val in range(256):
-            transformed = transform_with_pattern(original_data, chunk_size, xor_val)
-            most_frequent, count_difference = check_zeros_ones(transformed)
-
-            if most_frequent == 'zeros':
-                if best_zeros is None or count_difference > best_zeros[2]:
-                    best_zeros = (xor_val, transformed, count_difference)
-            elif most_frequent == 'ones':
-                if best_ones is None or count_difference > best_ones[2]:
-                    best_ones = (xor_val, transformed, count_difference)
+        # Score all 256 keys from one histogram, then transform only the winners
+        if chunk_size == 0:
+            raise ValueError("chunk_size must not be zero")
+
+        def rank():
+            count('candidates', 256)
+            if chunk_size < 0:
+                histogram = byte_histogram(b'')
+            elif block_size:
+                histogram = file_histogram(input_file, block_size)
+            else:
+                histogram = byte_histogram(original_data)
+            zeros_keys, ones_keys = ranked_xor_keys(histogram)
+            if scorer != 'imbalance':
+                zeros_keys = _rescore_keys(input_file, original_data, zeros_keys[:shortlist],
+                                           chunk_size, scorer, sample_size)
+                ones_keys = _rescore_keys(input_file, original_data, ones_keys[:shortlist],
+                                          chunk_size, scorer, sample_size)
+            return zeros_keys, ones_keys
+
+        with stage('rank'):
+            zeros_keys, ones_keys = cached_result(
+                cache, 'xor_keys', rank, original_data,
+                None if original_data is not None else input_file,
+                chunk_size=chunk_size, scorer=scorer, shortlist=shortlist,
+                sample_size=sample_size)
+        best_zeros = zeros_keys[0] if zeros_keys else None
+        best_ones = ones_keys[0] if ones_keys else None
+
+        if container or adaptive:
+            variations = [('zeros', xor_val, difference, b'')
+                          for xor_val, difference in zeros_keys[:top]]
+            variations += [('ones', xor_val, difference, b'')
+                           for xor_val, difference in ones_keys[:top]]
+            if adaptive and chunk_size > 0:
+                if original_data is not None:
+                    keys, zeros = chunk_keys(original_data, chunk_size)
+                    length = len(original_data)
+                else:
+                    with open(input_file, 'rb') as src:
+                        keys, zeros = stream_chunk_keys(src, chunk_size, block_size)
+                    length = os.path.getsize(input_file)
+                count('candidates', len(keys))
+                variations.append(('adaptive', 0, zeros - (length - zeros), keys))
+                print(f"Adaptive keys: {len(keys)} chunks, {zeros} zero bytes of {length}")
+            if not variations:
+                return 0
+            with stage('write'):
+                out_name = _write_container(input_file, original_data, xor_folder, chunk_size,
+                                            block_size or DEFAULT_BLOCK_SIZE, variations,
+                                            backend, level)
+            count('files')
+            count('bytes_written', os.path.getsize(os.path.join(xor_folder, out_name)))
+            print(f"Saved {len(variations)} variations in container: {out_name}")
+            return len(variations)
+
+        # The original and each variation are checksummed as they stream
+        # through the transform and recorded for decode/audit (verify.py)
+        # (the content hash only on the first pass over the original)
+        checksums = {}
+        original_crc = original_digest = None
+
+        def write_variation(out_name, xor_val):
+            nonlocal original_crc, original_digest
+            out_path = os.path.join(xor_folder, out_name)
+            digest = hashlib.new(CONTENT_HASH) if original_digest is None else None
+            with stage('write'):
+                if block_size:
+                    with open(input_file, 'rb') as src, open(out_path, 'wb') as dst:
+                        written, original_crc, checksums[out_name] = crc_transform(
+                            src, dst, chunk_size, xor_val, block_size, src_hash=digest)
+                else:
+                    variation = transform_with_pattern(original_data, chunk_size, xor_val)
+                    with open(out_path, 'wb') as f:
+                        written = f.write(variation)
+                    original_crc = zlib.crc32(original_data)
+                    checksums[out_name] = zlib.crc32(variation)
+                    if digest is not None:
+                        digest.update(original_data)
+            if digest is not None:
+                original_digest = digest.hexdigest()
+            count('files')
+            count('bytes_written', written)
 
         files_saved = 0
         if best_zeros:
             out_name = f"{Path(input_file).stem}_chunk{chunk_size}_xor_{best_zeros[0]:03d}.bin"
-            out_path = os.path.join(xor_folder, out_name)
-            with open(out_path, 'wb') as f:
-                f.write(best_zeros[1])
+            write_variation(out_name, best_zeros[0])
             print(f"Saved best zeros variation: {out_name}")
             files_saved += 1
 
         if best_ones:
             out_name = f"{Path(input_file).stem}_chunk{chunk_size}_xor_{best_ones[0]:03d}.bin"
-            out_path = os.path.join(xor_folder, out_name)
-            with open(out_path, 'wb') as f:
-                f.write(best_ones[1])
+            write_variation(out_name, best_ones[0])
             print(f"Saved best ones variation: {out_name}")
             files_saved += 1
 
+        if checksums:
+            record_checksums(xor_folder, Path(input_file).name, os.path.getsize(input_file),
+                             original_crc, checksums, original_digest)
         return files_saved
 
 
@@ -109,57 +368,306 @@ def encode_to_variations(input_file, output_dir, chunk_size=255):
         return 0
 
 
-def find_variation_folders(search_root):
-    folders = []
-    for root, dirs, _ in os.walk(search_root):
-        for dir_name in dirs:
-            if dir_name.endswith(('_variations', '_xor_variations')):
-                folders.append(os.path.join(root, dir_name))
-    return folders
-
-def process_all_variation_folders(input_dir, output_dir):
-    variation_folders = find_variation_folders(input_dir)
-
-    if not variation_folders:
-        print("No variation folders found!")
-        return 0
+def find_variation_folders(search_root, max_depth=None, exclude=(), descend_matched=True):
+    return list(iter_variation_folders(search_root, max_depth, exclude, descend_matched))
+
+def _decode_jobs(folders, decoded_dir, events, work_dirs, block_size, write_mode, dedup):
+    """Plan the decode jobs of process_all_variation_folders.
+
+    The generator runs ahead of the consumer by up to max_pending files;
+    it leaves ``('folder', path, sidecar)`` and ``('file', path,
+    (predicted, part_path))`` events in ``events`` so each in-order result
+    can be attributed to its folder. Files are decoded to ``part_path`` in
+    a private directory of decoded_dir (appended to ``work_dirs`` for the
+    consumer to remove), so runs sharing an output directory never touch
+    each other's temporary files. With ``dedup`` a file whose sidecar says
+    an earlier job already decodes its original (the best-zeros and
+    best-ones files of one original, or one original encoded into several
+    folders) gets a job without a temporary path, and ``predicted`` is
+    that original's ``(length, digest)``.
+    """
+    index = 0
+    claimed = set()
+    for folder in folders:
+        os.makedirs(decoded_dir, exist_ok=True)
+        sidecar = load_checksums(folder)
+        events.append(('folder', folder, sidecar))
+        for file_path in iter_files(folder):
+            if not work_dirs:
+                work_dirs.append(tempfile.mkdtemp(prefix='.decoding_', dir=decoded_dir))
+            part_path = os.path.join(work_dirs[0], f"{index:08d}.part")
+            index += 1
+            name = os.path.basename(file_path)
+            content = dedup and expected_content(sidecar, name)
+            if content and content in claimed:
+                events.append(('file', file_path, (content, part_path)))
+                yield file_path, None, block_size, write_mode, False, False
+            else:
+                if content:
+                    claimed.add(content)
+                events.append(('file', file_path, (None, part_path)))
+                yield (file_path, part_path, block_size, write_mode, bool(dedup),
+                       expected_checksum(sidecar, name) is not None)
+
+def _check_decode(file_path, written, crc, sidecar):
+    """Check a decode against its recorded original.
+
+    Returns ``('mismatch', message)``, ``('verified', None)``, or ``(None,
+    None)`` when there is no checksum to compare with.
+    """
+    expected = expected_checksum(sidecar, os.path.basename(file_path))
+    mismatch = _checksum_error(file_path, written, crc, expected)
+    if mismatch:
+        return 'mismatch', mismatch
+    if crc is not None and (expected is not None or is_container(file_path)):
+        # Containers were already checked against their header
+        return 'verified', None
+    return None, None
+
+class _OutputIndex:
+    """Decoded outputs by ``(length, digest)``, for dedup.
+
+    The reverse map drops an entry when a later file overwrites its output.
+    """
+
+    def __init__(self):
+        self.outputs = {}
+        self.owners = {}
+
+    def get(self, content):
+        return self.outputs.get(content)
+
+    def record(self, path, content):
+        previous = self.owners.pop(path, None)
+        if previous is not None and self.outputs.get(previous) == path:
+            del self.outputs[previous]
+        if content is not None and self.outputs.setdefault(content, path) == path:
+            self.owners[path] = content
+
+def _link_output(first_path, out_path):
+    """Hard-link out_path to first_path, copying where links are not supported."""
+    if os.path.exists(out_path) and os.path.samefile(first_path, out_path):
+        return
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(out_path)
+    try:
+        os.link(first_path, out_path)
+    except OSError:
+        shutil.copyfile(first_path, out_path)
+
+def _print_decode_summary(summary, decoded_dir):
+    print(f"\nTotal decoded files: {summary['decoded']} from {summary['folders']} folders")
+    if summary['failed']:
+        print(f"Failed files: {summary['failed']}")
+    if summary['verified'] or summary['mismatched']:
+        print(f"Verified against original: {summary['verified']}, "
+              f"checksum mismatches: {summary['mismatched']}")
+    if summary['duplicates']:
+        print(f"Duplicates: {summary['duplicates']} ({summary['decodes_skipped']} not decoded), "
+              f"{summary['bytes_saved']} bytes not written")
+    print(f"Throughput: {summary['bytes_per_sec'] / 1e6:.2f} MB/s")
+    print(f"Output directory: {decoded_dir}")
 
-    print("\nFound variation folders:")
-    for i, folder in enumerate(variation_folders, 1):
-        print(f"  {i}. {folder}")
+def process_all_variation_folders(input_dir, output_dir, workers=1, max_pending=None,
+                                  block_size=None, max_depth=None, exclude=(),
+                                  descend_matched=True, progress=None, write_mode='copy',
+                                  dedup=None):
+    """Decode every file of every variation folder under input_dir.
+
+    Folders and files are discovered lazily (see discovery.py for
+    ``max_depth``, ``exclude`` and ``descend_matched``) and decoded on a
+    bounded process pool with ``workers > 1``, each to a temporary name
+    renamed in serial order, so output names match a serial run.
+    ``block_size`` streams the decode, ``write_mode`` is one of WRITE_MODES
+    and ``dedup`` one of DEDUP_MODES (see _decode_jobs). Outputs are
+    checked against their folder's checksum sidecar (see verify.py); a
+    mismatched one is kept but not counted as decoded. Decoded files go to
+    ``progress(input_file, out_name, bytes_written)`` when given, else are
+    printed at most once per metrics.PROGRESS_INTERVAL. Returns a summary
+    dict of counts, bytes, elapsed seconds and throughput.
+    """
+    if dedup is not None and dedup not in DEDUP_MODES:
+        raise ValueError(f"Unknown dedup mode '{dedup}'")
+    start = time.perf_counter()
+    summary = {'folders': 0, 'decoded': 0, 'failed': 0, 'verified': 0, 'mismatched': 0,
+               'duplicates': 0, 'decodes_skipped': 0, 'bytes_saved': 0,
+               'bytes': 0, 'seconds': 0.0, 'bytes_per_sec': 0.0}
 
-    total_decoded = 0
     decoded_dir = os.path.join(output_dir, "decoded_results")
-    os.makedirs(decoded_dir, exist_ok=True)
-
-    for folder in variation_folders:
-        print(f"\nProcessing folder: {folder}")
-        file_counter = 0
-        for filename in os.listdir(folder):
-            file_path = os.path.join(folder, filename)
-            if os.path.isfile(file_path):
-                if decode_variation_file(file_path, decoded_dir, file_counter):
-                    file_counter += 1
-        total_decoded += file_counter
-        print(f"Decoded {file_counter} files from this folder")
-
-    print(f"\nTotal decoded files: {total_decoded}")
-    print(f"Output directory: {decoded_dir}")
-    return total_decoded
+    events = deque()
+    work_dirs = []
+    jobs = _decode_jobs(iter_variation_folders(input_dir, max_depth, exclude, descend_matched),
+                        decoded_dir, events, work_dirs, block_size, write_mode, dedup)
+    outputs = _OutputIndex()
+    report = progress_reporter(progress, _print_decoded)
+    file_counter = 0
+    sidecar = None
+
+    def next_file():
+        """Consume events up to the next file's ``(path, (predicted, part_path))``."""
+        nonlocal file_counter, sidecar
+        while events:
+            kind, value, extra = events.popleft()
+            if kind == 'file':
+                return value, extra
+            sidecar = extra
+            report.flush()
+            if summary['folders']:
+                print(f"Decoded {file_counter} files from this folder")
+            summary['folders'] += 1
+            file_counter = 0
+            # Folders are listed as they are reached, not all up front, so
+            # the decode never waits for the whole tree to be walked
+            print(f"\nFound variation folder {summary['folders']}: {value}")
+            print(f"Processing folder: {value}")
+        return None, (None, None)
+
+    def duplicate(file_path, out_name, content):
+        first_path = outputs.get(content)
+        if dedup == 'link':
+            out_path = os.path.join(decoded_dir, out_name)
+            _link_output(first_path, out_path)
+            outputs.record(out_path, content)
+        else:
+            out_name = os.path.basename(first_path)
+        report(file_path, out_name, content[0])
+        count('files_deduplicated')
+        count('bytes_deduplicated', content[0])
+        summary['duplicates'] += 1
+        summary['bytes_saved'] += content[0]
 
-def check_zeros_ones(data):
+    try:
+        for written, crc, digest, error in ordered_map(_decode_job, jobs, workers, max_pending):
+            file_path, (predicted, part_path) = next_file()
+            out_name = f"decoded_{Path(file_path).stem}_{file_counter:04d}.jpg"
+            out_path = os.path.join(decoded_dir, out_name)
+            if predicted is not None:
+                if outputs.get(predicted) is not None:
+                    duplicate(file_path, out_name, predicted)
+                    summary['decodes_skipped'] += 1
+                    file_counter += 1
+                    continue
+                # The first copy failed, mismatched or was overwritten: decode this one
+                written, crc, digest, error = _decode_job(
+                    (file_path, part_path, block_size, write_mode, True,
+                     expected_checksum(sidecar, os.path.basename(file_path)) is not None))
+            if error is not None:
+                report.flush()
+                print(error)
+                summary['failed'] += 1
+                count('files_failed')
+                continue
+            status, mismatch = _check_decode(file_path, written, crc, sidecar)
+            if status == 'mismatch':
+                # Kept for inspection, but neither decoded nor a dedup source
+                report.flush()
+                print(mismatch)
+                os.replace(part_path, out_path)
+                outputs.record(out_path, None)
+                summary['mismatched'] += 1
+                count('files_failed')
+                file_counter += 1
+                continue
+            if status == 'verified':
+                summary['verified'] += 1
+            count('bytes_read', written if write_mode == 'in-place' else os.path.getsize(file_path))
+            content = (written, digest) if digest is not None else None
+            if outputs.get(content) is not None:
+                os.remove(part_path)
+                duplicate(file_path, out_name, content)
+                file_counter += 1
+                continue
+            os.replace(part_path, out_path)
+            outputs.record(out_path, content)
+            report(file_path, out_name, written)
+            count('files')
+            count('bytes_written', written)
+            file_counter += 1
+            summary['decoded'] += 1
+            summary['bytes'] += written
+    finally:
+        for work_dir in work_dirs:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    next_file()
+    report.flush()
+    METRICS.add_time('decode', time.perf_counter() - start)
+
+    if not summary['folders']:
+        print("No variation folders found!")
+        return summary
+    print(f"Decoded {file_counter} files from this folder")
+
+    summary['seconds'] = time.perf_counter() - start
+    if summary['seconds'] > 0:
+        summary['bytes_per_sec'] = summary['bytes'] / summary['seconds']
+    _print_decode_summary(summary, decoded_dir)
+    return summary
+
+def _audit_job(job):
+    """Process-pool worker: audit one file without writing, never raise."""
+    file_path, expected, block_size = job
+    try:
+        chunk_size, xor_val = extract_xor_info(os.path.basename(file_path))
+        return audit_file(file_path, chunk_size, xor_val, expected, block_size) + (None,)
+    except Exception as e:
+        return 'error', 0, _decode_error_message(file_path, e)
+
+def audit_variation_folders(input_dir, workers=1, max_pending=None, block_size=DEFAULT_BLOCK_SIZE,
+                            max_depth=None, exclude=(), descend_matched=True):
+    """Check that every variation file under input_dir decodes to its original.
+
+    Files are decoded in memory, block by block, and only checksummed, so
+    nothing is written. Plain files are checked against their folder's
+    checksum sidecar and containers against their header (see
+    verify.audit_file for the statuses). Folders are discovered as in
+    process_all_variation_folders and files are audited on a bounded
+    process pool with ``workers > 1``. Returns a summary dict with a count
+    per status, the bytes decoded, elapsed seconds, throughput and the
+    ``(path, status)`` of every file that is not 'ok'.
+    """
+    start = time.perf_counter()
+    summary = {'folders': 0, 'files': 0, 'ok': 0, 'mismatch': 0, 'damaged': 0, 'unknown': 0,
+               'error': 0, 'bytes': 0, 'seconds': 0.0, 'bytes_per_sec': 0.0, 'problems': []}
+    paths = deque()
+
+    def jobs():
+        for folder in iter_variation_folders(input_dir, max_depth, exclude, descend_matched):
+            summary['folders'] += 1
+            sidecar = load_checksums(folder)
+            for file_path in iter_files(folder):
+                paths.append(file_path)
+                yield file_path, expected_checksum(sidecar, os.path.basename(file_path)), block_size
+
+    for status, length, error in ordered_map(_audit_job, jobs(), workers, max_pending):
+        file_path = paths.popleft()
+        summary['files'] += 1
+        summary[status] += 1
+        summary['bytes'] += length
+        count('bytes_read', length)
+        if status != 'ok':
+            summary['problems'].append((file_path, status))
+            print(error or f"  ✗ {status.capitalize()}: {file_path}")
+
+    summary['seconds'] = time.perf_counter() - start
+    METRICS.add_time('audit', summary['seconds'])
+    if summary['seconds'] > 0:
+        summary['bytes_per_sec'] = summary['bytes'] / summary['seconds']
+    print(f"Audited {summary['files']} files in {summary['folders']} folders: "
+          f"{summary['ok']} ok, {summary['mismatch']} mismatched, {summary['damaged']} damaged, "
+          f"{summary['unknown']} without checksum, {summary['error']} errors")
+    print(f"Throughput: {summary['bytes_per_sec'] / 1e6:.2f} MB/s")
+    return summary
+
+def check_zeros_ones(data, unit='byte'):
+    """Return ('zeros' | 'ones' | 'equal', difference) for a buffer or a file path.
+
+    ``unit='byte'`` compares zero bytes with non-zero bytes, ``'bit'`` zero
+    bits with set bits (see byte_stats.py). Files are read through an mmap.
+    """
     try:
         if isinstance(data, str):
-            with open(data, 'rb') as f:
-                data = f.read()
-        zeros = data.count(b'\x00')
-        ones = len(data) - zeros
-        if zeros > ones:
-            return 'zeros', zeros - ones
-        elif ones > zeros:
-            return 'ones', ones - zeros
-        else:
-            return 'equal', 0
+            return majority(*file_counts(data, unit))
+        return majority(*count_units(data, unit))
     except FileNotFoundError:
         print(f"Error: File '{data}' not found.")
         return None, None
@@ -167,23 +675,25 @@ def check_zeros_ones(data):
         print(f"An error occurred: {e}")
         return None, None
 
-def check_variations(variations_folder):
+def check_variations(variations_folder, unit='byte'):
+    """Score every file of a folder with check_zeros_ones (mmap, block by block)."""
     results = {}
     best_zeros = None
     best_ones = None
 
-    for filename in os.listdir(variations_folder):
-        filepath = os.path.join(variations_folder, filename)
-        if os.path.isfile(filepath):
-            most_frequent, count_difference = check_zeros_ones(filepath)
-            if most_frequent is not None:
-                results[filename] = (most_frequent, count_difference)
-                if most_frequent == 'zeros':
-                    if best_zeros is None or count_difference > best_zeros[1]:
-                        best_zeros = (filename, count_difference)
-                else:
-                    if best_ones is None or count_difference > best_ones[1]:
-                        best_ones = (filename, count_difference)
+    with os.scandir(variations_folder) as entries:
+        files = [(entry.name, entry.path) for entry in entries
+                 if entry.is_file() and entry.name != CHECKSUM_FILE]
+    for filename, filepath in files:
+        most_frequent, count_difference = check_zeros_ones(filepath, unit)
+        if most_frequent is not None:
+            results[filename] = (most_frequent, count_difference)
+            if most_frequent == 'zeros':
+                if best_zeros is None or count_difference > best_zeros[1]:
+                    best_zeros = (filename, count_difference)
+            else:
+                if best_ones is None or count_difference > best_ones[1]:
+                    best_ones = (filename, count_difference)
 
     return results, best_zeros, best_ones
 
@@ -204,7 +714,7 @@ def main():
             print("File not found!")
             return
         output_dir = input(f"Output directory [{base_dir}]: ").strip() or base_dir
-        files_saved = encode_to_variations(input_file, output_dir)
+        files_saved = encode_to_variations(input_file, output_dir, block_size=DEFAULT_BLOCK_SIZE)
         print(f"\nDone. Saved {files_saved} variation files.")
 
     elif choice == '2':
@@ -213,13 +723,13 @@ def main():
             print("Folder not found!")
             return
         output_dir = input(f"Output directory [{base_dir}]: ").strip() or base_dir
-        process_all_variation_folders(input_dir, output_dir)
+        process_all_variation_folders(input_dir, output_dir, block_size=DEFAULT_BLOCK_SIZE)
         print("\nDone.")
 
     elif choice == '3':
         search_root = input(f"Search root directory [{base_dir}]: ").strip() or base_dir
         output_dir = input(f"Output directory [{base_dir}]: ").strip() or base_dir
-        process_all_variation_folders(search_root, output_dir)
+        process_all_variation_folders(search_root, output_dir, block_size=DEFAULT_BLOCK_SIZE)
         print("\nDone.")
 
     elif choice == '4':
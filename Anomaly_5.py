@@ -1,79 +1,66 @@
 import os
-from pathlib import Path
 
-def count_zeros_ones(data):
-    ones = sum(byte.bit_count() for byte in data)
-    zeros = len(data) * 8 - ones
-    return zeros, ones
-
-def create_best_two_byte_variation(input_file, output_dir):
-    with open(input_file, 'rb') as f:
-        original_data = f.read()
-
-    base_name = Path(input_file).stem
-    save_dir = os.path.join(output_dir, f"{base_name}_best_2byte_variation")
-
-    if os.path.isfile(save_dir):
-        print(f"Error: '{save_dir}' is a file, not a directory.")
-        return 0
-    os.makedirs(save_dir, exist_ok=True)
-
-    best_score = -1
-    best_data = None
-    best_file_name = ""
-    total_bytes = len(original_data)
-
-    print("Evaluating 2-byte XOR variations (0 to 65535)...")
-
-    for i in range(0, total_bytes - 1):  # Avoid last byte for 2-byte pair
-        orig_pair = original_data[i:i+2]
-        if len(orig_pair) < 2:
-            continue
-        orig_value = int.from_bytes(orig_pair, byteorder='big')
-
-        for xor_val in range(65536):  # 0 to 65535
-            modified_data = bytearray(original_data)
-            new_val = orig_value ^ xor_val
-            modified_data[i:i+2] = new_val.to_bytes(2, byteorder='big')
-
-            zeros, ones = count_zeros_ones(modified_data)
-            score = abs(zeros - ones)
-
-            if score > best_score:
-                best_score = score
-                best_data = bytes(modified_data)
-                best_file_name = f"{base_name}_pos{i:04d}_xor{xor_val:05d}.bin"
-                print(f"Improved at pos {i}, xor {xor_val}: 0s={zeros}, 1s={ones}, score={score}")
-
-    if best_data:
-        out_path = os.path.join(save_dir, best_file_name)
-        with open(out_path, 'wb') as f:
-            f.write((best_data))
-        print(f"\nBest variation saved (compressed): {out_path}")
-        return 1
+from byte_stats import count_units
+from compressors import available_backends, unpack
+from framed import is_framed, read_range, unpack_to_file
+from variation_search import create_best_variation
 
-    print("No improvement found.")
-    return 0
+# Backend assumed for compressed files written before backends were recorded
+DEFAULT_BACKEND = 'none'
 
-def extract_paq_compressed_file(input_file, output_dir):
+def count_zeros_ones(data):
+    """Count 0 and 1 bits of data (byte_stats.count_units with bit semantics)."""
+    return count_units(data, 'bit')
+
+def create_best_two_byte_variation(input_file, output_dir, workers=1, backend=DEFAULT_BACKEND,
+                                   level=None, scorer='imbalance', shortlist=16, sample_size=None,
+                                   cache=None, deadline=None, checkpoint=None, top=1,
+                                   frame_size=None):
+    """Two-byte variant of variation_search.create_best_variation, uncompressed by default."""
+    return create_best_variation(input_file, output_dir, 2, workers=workers, backend=backend,
+                                 level=level, scorer=scorer, shortlist=shortlist,
+                                 sample_size=sample_size, cache=cache, deadline=deadline,
+                                 checkpoint=checkpoint, top=top, frame_size=frame_size)
+
+def extract_paq_compressed_file(input_file, output_dir, default_backend=DEFAULT_BACKEND,
+                                output_name=None, workers=1, byte_range=None):
+    """Decompress with the backend recorded in the file (legacy files: default_backend).
+
+    The output file name is prompted for unless ``output_name`` is given.
+    Framed files (see framed.py) are decompressed on ``workers`` processes;
+    with ``byte_range=(start, length)`` only that range is extracted, and
+    for framed files only the frames holding it are decompressed.
+    """
     try:
         if os.path.isfile(output_dir):
             print(f"Error: '{output_dir}' is a file, not a directory.")
             return 0
         os.makedirs(output_dir, exist_ok=True)
 
-        with open(input_file, 'rb') as f:
-            compressed_data = f.read()
-        decompressed_data = (compressed_data)
-
-        output_name = input("Enter exact output file name (with .bin extension): ").strip()
+        framed = is_framed(input_file)
+        if framed and byte_range is not None:
+            decompressed_data = read_range(input_file, *byte_range, workers=workers)
+            framed = False
+        elif not framed:
+            with open(input_file, 'rb') as f:
+                compressed_data = f.read()
+            decompressed_data, _ = unpack(compressed_data, default_backend)
+            if byte_range is not None:
+                start, length = byte_range
+                decompressed_data = decompressed_data[start:start + length]
+
+        if output_name is None:
+            output_name = input("Enter exact output file name (with .bin extension): ").strip()
         if not output_name:
             print("No output name provided. Extraction cancelled.")
             return 0
 
         output_path = os.path.join(output_dir, output_name)
-        with open(output_path, 'wb') as f:
-            f.write(decompressed_data)
+        if framed:
+            unpack_to_file(input_file, output_path, workers)
+        else:
+            with open(output_path, 'wb') as f:
+                f.write(decompressed_data)
 
         print(f"\nExtracted file saved as: {output_path}")
         return 1
@@ -101,7 +88,9 @@ def main():
     output_dir = input("Enter output directory [default: current]: ").strip() or "."
 
     if choice == '1':
-        result = create_best_two_byte_variation(input_file, output_dir)
+        backend = input(f"Compression backend ({', '.join(available_backends())}) "
+                        f"[{DEFAULT_BACKEND}]: ").strip() or DEFAULT_BACKEND
+        result = create_best_two_byte_variation(input_file, output_dir, backend=backend)
     elif choice == '2':
         result = extract_paq_compressed_file(input_file, output_dir)
 
@@ -1,41 +1,101 @@
 import os
 
-def transform_with_pattern(data, chunk_size=4):
+import primes
+from compressors import (HEADER_SIZE, available_backends, get_backend, iter_decompressed,
+                         load_backend, make_header, pack, parse_header, unpack)
+from xor_transform import DEFAULT_BLOCK_SIZE, aligned_block_size, iter_blocks, transform_buffer
+
+# Backend for new .enc files, and assumed for files written before backends
+# were recorded
+DEFAULT_BACKEND = 'none'
+
+def transform_with_pattern(data, chunk_size=4, out=None):
     """Apply XOR 0xFF transformation per chunk."""
-    transformed = bytearray()
-    for i in range(0, len(data), chunk_size):
-        chunk = data[i:i + chunk_size]
-        transformed.extend([b ^ 0xFF for b in chunk])
-    return transformed
+    return transform_buffer(data, chunk_size, 0xFF, out)
 
 def is_prime(n):
-    """Simple primality test."""
-    if n < 2:
-        return False
-    if n == 2:
-        return True
-    if n % 2 == 0:
-        return False
-    for i in range(3, int(n ** 0.5) + 1, 2):
-        if n % i == 0:
-            return False
-    return True
+    """Deterministic Miller-Rabin primality test (see primes.py)."""
+    return primes.is_prime(n)
 
 def find_nearest_prime_around(n):
-    """Finds the closest prime near n (searches up and down)."""
-    offset = 0
-    while True:
-        if is_prime(n - offset):
-            return n - offset
-        if is_prime(n + offset):
-            return n + offset
-        offset += 1
+    """Finds the closest prime near n (n - offset is tried before n + offset)."""
+    return primes.nearest_prime(n)
+
+def encode_file(input_file, output_enc, block_size=None, backend=DEFAULT_BACKEND, level=None):
+    """Transform and compress input_file into output_enc; return the output size.
+
+    With a ``block_size`` the file is streamed in chunk-aligned blocks
+    instead of being loaded whole. The backend is recorded in the output.
+    """
+    if block_size:
+        # Checks the level before the compressor or the output is created
+        header = make_header(backend, level)
+        compressor = load_backend(backend).compressobj(level)
+        with open(input_file, 'rb') as src, open(output_enc, 'wb') as dst:
+            dst.write(header)
+            for block in iter_blocks(src, aligned_block_size(block_size, 4)):
+                dst.write(compressor.compress(bytes(transform_with_pattern(block))))
+            dst.write(compressor.flush())
+            return dst.tell()
+
+    with open(input_file, 'rb') as f:
+        original_data = f.read()
+
+    # Apply XOR transformation
+    transformed_data = transform_with_pattern(original_data)
+
+    # Convert bytearray to bytes before compression
+    transformed_data_bytes = bytes(transformed_data)
+
+    # Apply the selected compression backend
+    compressed_data = pack(transformed_data_bytes, backend, level)
+
+    # Save to output file
+    with open(output_enc, 'wb') as f:
+        f.write(compressed_data)
+    return len(compressed_data)
+
+def decode_file(input_enc, output_file, block_size=None, default_backend=DEFAULT_BACKEND):
+    """Recover output_file from input_enc and return the recovered size.
+
+    The backend recorded in the file is used; legacy files without one are
+    read with ``default_backend``.
+    """
+    if block_size:
+        written = 0
+        with open(input_enc, 'rb') as src, open(output_file, 'wb') as dst:
+            backend, offset = parse_header(src.read(HEADER_SIZE), default_backend)
+            src.seek(offset)
+            decompressor = get_backend(backend).decompressobj()
+            # The key is the same for every chunk, so pieces of any length
+            # coming out of the decompressor can be transformed as they are;
+            # none is larger than block_size, however well the input packed.
+            for block in iter_blocks(src, block_size):
+                for piece in iter_decompressed(decompressor, bytes(block), block_size):
+                    written += dst.write(transform_with_pattern(piece))
+            written += dst.write(transform_with_pattern(decompressor.flush()))
+        return written
+
+    with open(input_enc, 'rb') as f:
+        encoded_data = f.read()
+
+    # Apply decompression with the recorded backend
+    decompressed_data, _ = unpack(encoded_data, default_backend)
+
+    # Apply XOR transformation (reverse)
+    recovered_data = transform_with_pattern(decompressed_data)
+
+    with open(output_file, 'wb') as f:
+        f.write(recovered_data)
+    return len(recovered_data)
 
 def encode_no_compression():
     print("\nSimple Encoder (XOR transformation + Zlib compression)")
     try:
         input_file = input("Enter input file: ").strip()
         output_base = input("Enter output base name (without .enc): ").strip()
+        backend = input(f"Compression backend ({', '.join(available_backends())}) "
+                        f"[{DEFAULT_BACKEND}]: ").strip() or DEFAULT_BACKEND
     except EOFError:
         print("No input detected. Exiting encode mode.")
         return
@@ -47,24 +107,9 @@ def encode_no_compression():
         return
 
     try:
-        with open(input_file, 'rb') as f:
-            original_data = f.read()
-
-        # Apply XOR transformation
-        transformed_data = transform_with_pattern(original_data)
-
-        # Convert bytearray to bytes before compression
-        transformed_data_bytes = bytes(transformed_data)
-
-        # Apply Zlib compression
-        compressed_data = (transformed_data_bytes)
-
-        # Save to output file
-        with open(output_enc, 'wb') as f:
-            f.write(compressed_data)
+        size = encode_file(input_file, output_enc, block_size=DEFAULT_BLOCK_SIZE, backend=backend)
 
         # Analyze file size
-        size = len(compressed_data)
         half_size = size // 2
         nearby_prime = find_nearest_prime_around(half_size)
         print(f"Transformed and compressed file size: {size} bytes")
@@ -89,17 +134,7 @@ def decode_no_compression():
         return
 
     try:
-        with open(input_enc, 'rb') as f:
-            encoded_data = f.read()
-
-        # Apply Zlib decompression
-        decompressed_data = (encoded_data)
-
-        # Apply XOR transformation (reverse)
-        recovered_data = transform_with_pattern(decompressed_data)
-
-        with open(output_file, 'wb') as f:
-            f.write(recovered_data)
+        decode_file(input_enc, output_file, block_size=DEFAULT_BLOCK_SIZE)
 
         print(f"Decoding complete. Output saved to {output_file}")
     except Exception as e:
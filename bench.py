@@ -0,0 +1,408 @@
+"""Benchmark harness for the hot functions of the Anomaly scripts.
+
+Generates a synthetic corpus (random, JPEG-like and low-entropy data in
+sizes from 1KB to 1GB), times every hot function on it and reports MB/s,
+candidates/s and peak RSS. Each case runs in a freshly spawned process so
+its peak RSS is its own. Results can be saved as a JSON baseline and a
+later run compared against it to flag regressions.
+
+    python bench.py --sizes 1KB,64KB,1MB --save baseline.json
+    python bench.py --sizes 1KB,64KB,1MB --baseline baseline.json
+
+``--frame-sizes`` adds a table of the framed compression mode (framed.py)
+for each corpus file: ratio, compression and full/range extraction speed
+per frame size, showing what smaller frames cost in ratio.
+
+    python bench.py --sizes 16MB --only '' --frame-sizes 64KB,256KB,1MB,4MB --frame-workers 4
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+KINDS = ('random', 'jpeg', 'lowentropy')
+BENCHMARKS = (
+    'transform_with_pattern',
+    'check_zeros_ones',
+    'count_zeros_ones',
+    'encode_to_variations',
+    'create_best_zero_one_variation',
+    'create_best_two_byte_variation',
+    'find_nearest_prime_around',
+    'folder_decode',
+)
+# Searches are skipped above this size unless --max-search-size says otherwise
+DEFAULT_MAX_SEARCH_SIZE = 1 << 20
+_UNITS = {'B': 1, 'KB': 1 << 10, 'MB': 1 << 20, 'GB': 1 << 30}
+_BLOCK = 1 << 20
+
+
+def parse_size(text):
+    """Parse sizes like '64KB' or '1GB' into a byte count."""
+    text = text.strip().upper()
+    for unit in ('GB', 'MB', 'KB', 'B'):
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * _UNITS[unit])
+    return int(text)
+
+
+def format_size(size):
+    for unit in ('GB', 'MB', 'KB'):
+        if size >= _UNITS[unit] and size % _UNITS[unit] == 0:
+            return f"{size // _UNITS[unit]}{unit}"
+    return f"{size}B"
+
+
+def _jpeg_blocks(rng, size):
+    """JPEG-like stream: SOI, JFIF/DQT/SOF/DHT/SOS headers, stuffed scan data, EOI."""
+    header = (b'\xff\xd8'
+              + b'\xff\xe0\x00\x10JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00'
+              + b'\xff\xdb\x00\x43\x00' + bytes(rng.randrange(1, 64) for _ in range(64))
+              + b'\xff\xc0\x00\x11\x08\x04\x00\x04\x00\x03\x01\x22\x00\x02\x11\x01\x03\x11\x01'
+              + b'\xff\xc4\x00\x1f\x00' + bytes(rng.randrange(256) for _ in range(28))
+              + b'\xff\xda\x00\x0c\x03\x01\x00\x02\x11\x03\x11\x00\x3f\x00')
+    yield header[:size]
+    remaining = size - len(header) - 2
+    while remaining > 0:
+        # Entropy-coded data: random bytes with every 0xFF followed by a stuffed 0x00
+        block = rng.randbytes(min(_BLOCK, remaining)).replace(b'\xff', b'\xff\x00')
+        block = block[:remaining]
+        remaining -= len(block)
+        yield block
+    if size >= len(header) + 2:
+        yield b'\xff\xd9'
+
+
+def _lowentropy_blocks(rng, size):
+    alphabet = b'\x00\x00\x00\x00\x01\x02\xff'
+    remaining = size
+    while remaining > 0:
+        n = min(_BLOCK, remaining)
+        runs = []
+        total = 0
+        while total < n:
+            run = bytes((rng.choice(alphabet),)) * rng.randrange(1, 64)
+            runs.append(run)
+            total += len(run)
+        yield b''.join(runs)[:n]
+        remaining -= n
+
+
+def generate_corpus(kind, size, path, seed=0):
+    """Write ``size`` bytes of synthetic ``kind`` data to path, block by block."""
+    rng = random.Random(f"{kind}-{size}-{seed}")
+    if kind == 'random':
+        blocks = (rng.randbytes(min(_BLOCK, size - offset)) for offset in range(0, size, _BLOCK))
+    elif kind == 'jpeg':
+        blocks = _jpeg_blocks(rng, size)
+    elif kind == 'lowentropy':
+        blocks = _lowentropy_blocks(rng, size)
+    else:
+        raise ValueError(f"Unknown corpus kind '{kind}'")
+    with open(path, 'wb') as f:
+        for block in blocks:
+            f.write(block)
+    return path
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _bench_transform_with_pattern(path, workdir):
+    import Anomaly_1
+    data = _read(path)
+    start = time.perf_counter()
+    Anomaly_1.transform_with_pattern(data, 255, 0xA5)
+    return time.perf_counter() - start, len(data), None
+
+
+def _bench_check_zeros_ones(path, workdir):
+    import Anomaly_1
+    data = _read(path)
+    start = time.perf_counter()
+    Anomaly_1.check_zeros_ones(data)
+    return time.perf_counter() - start, len(data), None
+
+
+def _bench_count_zeros_ones(path, workdir):
+    import Anomaly_4
+    data = _read(path)
+    start = time.perf_counter()
+    Anomaly_4.count_zeros_ones(data)
+    return time.perf_counter() - start, len(data), None
+
+
+def _bench_encode_to_variations(path, workdir):
+    import Anomaly_1
+    from metrics import METRICS
+    size = os.path.getsize(path)
+    before = METRICS.value('candidates')
+    start = time.perf_counter()
+    Anomaly_1.encode_to_variations(path, workdir)
+    return time.perf_counter() - start, size, METRICS.value('candidates') - before
+
+
+def _bench_create_best_zero_one_variation(path, workdir):
+    import Anomaly_4
+    from metrics import METRICS
+    size = os.path.getsize(path)
+    before = METRICS.value('candidates')
+    start = time.perf_counter()
+    Anomaly_4.create_best_zero_one_variation(path, workdir, backend='none')
+    return time.perf_counter() - start, size, METRICS.value('candidates') - before
+
+
+def _bench_create_best_two_byte_variation(path, workdir):
+    import Anomaly_5
+    from metrics import METRICS
+    size = os.path.getsize(path)
+    before = METRICS.value('candidates')
+    start = time.perf_counter()
+    Anomaly_5.create_best_two_byte_variation(path, workdir, backend='none')
+    return time.perf_counter() - start, size, METRICS.value('candidates') - before
+
+
+def _bench_find_nearest_prime_around(path, workdir):
+    import Anomaly_6
+    import primes
+    size = os.path.getsize(path)
+    # Repeats would otherwise only time lru_cache hits
+    for cached in (primes.nearest_prime, primes.is_prime, primes._base_primes):
+        cached.cache_clear()
+    start = time.perf_counter()
+    Anomaly_6.find_nearest_prime_around(size // 2)
+    return time.perf_counter() - start, None, None
+
+
+def _bench_folder_decode(path, workdir):
+    import Anomaly_1
+    Anomaly_1.encode_to_variations(path, workdir, block_size=_BLOCK)
+    start = time.perf_counter()
+    summary = Anomaly_1.process_all_variation_folders(workdir, workdir)
+    return time.perf_counter() - start, summary['bytes'], None
+
+
+def _run_case(name, path, min_time=0.2, max_runs=200):
+    """Child-process entry point: run one benchmark and measure it.
+
+    Fast cases are repeated until ``min_time`` has been spent (at most
+    ``max_runs`` times) and the best run is kept, to damp timer noise.
+    """
+    bench = globals()[f"_bench_{name}"]
+    seconds = None
+    spent = 0.0
+    runs = 0
+    while runs < max_runs and (runs == 0 or spent < min_time):
+        workdir = tempfile.mkdtemp(prefix='bench_')
+        with contextlib.redirect_stdout(io.StringIO()):
+            elapsed, nbytes, candidates = bench(path, workdir)
+        shutil.rmtree(workdir, ignore_errors=True)
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+        spent += elapsed
+        runs += 1
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if platform.system() == 'Darwin':
+        peak_kb //= 1024
+    return {
+        'seconds': seconds,
+        'mb_per_sec': nbytes / seconds / 1e6 if nbytes and seconds > 0 else None,
+        'candidates_per_sec': candidates / seconds if candidates and seconds > 0 else None,
+        'peak_rss_kb': peak_kb,
+        'runs': runs,
+    }
+
+
+def run_benchmarks(kinds=KINDS, sizes=(1 << 10, 64 << 10, 1 << 20), benchmarks=BENCHMARKS,
+                   max_search_size=DEFAULT_MAX_SEARCH_SIZE, corpus_dir=None):
+    """Run every benchmark on every corpus file and return the result rows."""
+    context = multiprocessing.get_context('spawn')
+    rows = []
+    with tempfile.TemporaryDirectory(prefix='bench_corpus_') as tmp:
+        corpus_dir = corpus_dir or tmp
+        for kind in kinds:
+            for size in sizes:
+                path = os.path.join(corpus_dir, f"{kind}_{format_size(size)}.jpg")
+                if not os.path.isfile(path) or os.path.getsize(path) != size:
+                    generate_corpus(kind, size, path)
+                for name in benchmarks:
+                    if name.startswith('create_best_') and size > max_search_size:
+                        continue
+                    with context.Pool(1) as pool:
+                        result = pool.apply(_run_case, (name, path))
+                    rows.append({'benchmark': name, 'kind': kind, 'size': size, **result})
+    return rows
+
+
+def _frame_case(path, frame_size, backend, workers):
+    """Compress path framed, then extract it whole and one 4KB range."""
+    import framed
+    size = os.path.getsize(path)
+    data = _read(path)
+    with tempfile.TemporaryDirectory(prefix='bench_') as workdir:
+        packed = os.path.join(workdir, 'framed.bin')
+        start = time.perf_counter()
+        with open(packed, 'wb') as f:
+            written = framed.pack_framed_to_file(f, [data], backend, None, frame_size, workers)
+        compress_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        framed.unpack_to_file(packed, os.path.join(workdir, 'out.bin'), workers)
+        extract_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        framed.read_range(packed, size // 2, 4096)
+        range_seconds = time.perf_counter() - start
+    return {
+        'ratio': written / size if size else None,
+        'compress_mb_per_sec': size / compress_seconds / 1e6 if compress_seconds > 0 else None,
+        'extract_mb_per_sec': size / extract_seconds / 1e6 if extract_seconds > 0 else None,
+        'range_ms': range_seconds * 1e3,
+    }
+
+
+def run_frame_benchmarks(kinds=KINDS, sizes=(1 << 20,), frame_sizes=(64 << 10, 1 << 20),
+                         backend='zlib', workers=1, corpus_dir=None):
+    """Measure framed compression at every frame size on every corpus file.
+
+    The cases run in this process (they start their own worker pool), so
+    no peak RSS is reported for them.
+    """
+    rows = []
+    with tempfile.TemporaryDirectory(prefix='bench_corpus_') as tmp:
+        corpus_dir = corpus_dir or tmp
+        for kind in kinds:
+            for size in sizes:
+                path = os.path.join(corpus_dir, f"{kind}_{format_size(size)}.jpg")
+                if not os.path.isfile(path) or os.path.getsize(path) != size:
+                    generate_corpus(kind, size, path)
+                for frame_size in frame_sizes:
+                    result = _frame_case(path, frame_size or max(size, 1), backend, workers)
+                    rows.append({'kind': kind, 'size': size, 'frame_size': frame_size,
+                                 'backend': backend, 'workers': workers, **result})
+    return rows
+
+
+def print_frame_rows(rows):
+    def fmt(value, width, spec):
+        return f"{'-':>{width}}" if value is None else format(value, f">{width}{spec}")
+
+    print(f"{'Corpus':<12}{'Size':>7}{'Frame':>8}{'Ratio':>9}{'Pack MB/s':>11}"
+          f"{'Unpack MB/s':>13}{'Range ms':>10}")
+    for row in rows:
+        frame = format_size(row['frame_size']) if row['frame_size'] else 'whole'
+        print(f"{row['kind']:<12}{format_size(row['size']):>7}{frame:>8}"
+              f"{fmt(row['ratio'], 9, '.4f')}{fmt(row['compress_mb_per_sec'], 11, '.2f')}"
+              f"{fmt(row['extract_mb_per_sec'], 13, '.2f')}{row['range_ms']:>10.3f}")
+
+
+def _key(row):
+    return f"{row['benchmark']}/{row['kind']}/{format_size(row['size'])}"
+
+
+def compare_to_baseline(rows, baseline_rows, tolerance=0.10):
+    """Return (row, baseline_row, slowdown) for cases slower than tolerance."""
+    baseline = {_key(row): row for row in baseline_rows}
+    regressions = []
+    for row in rows:
+        old = baseline.get(_key(row))
+        if old is None or not old['seconds'] or not row['seconds']:
+            continue
+        slowdown = row['seconds'] / old['seconds'] - 1
+        if slowdown > tolerance:
+            regressions.append((row, old, slowdown))
+    return regressions
+
+
+def print_rows(rows):
+    def fmt(value, width, spec):
+        return f"{'-':>{width}}" if value is None else format(value, f">{width}{spec}")
+
+    print(f"{'Benchmark':<32}{'Corpus':<12}{'Size':>7}{'Seconds':>11}"
+          f"{'MB/s':>11}{'Cand/s':>12}{'Peak RSS':>11}")
+    for row in rows:
+        print(f"{row['benchmark']:<32}{row['kind']:<12}{format_size(row['size']):>7}"
+              f"{row['seconds']:>11.6f}{fmt(row['mb_per_sec'], 11, '.2f')}"
+              f"{fmt(row['candidates_per_sec'], 12, '.3g')}{row['peak_rss_kb'] // 1024:>8} MB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Anomaly hot functions.")
+    parser.add_argument('--kinds', default=','.join(KINDS),
+                        help="comma-separated corpus kinds (random, jpeg, lowentropy)")
+    parser.add_argument('--sizes', default='1KB,64KB,1MB',
+                        help="comma-separated corpus sizes, e.g. 1KB,1MB,1GB")
+    parser.add_argument('--only', default=','.join(BENCHMARKS),
+                        help="comma-separated benchmark names")
+    parser.add_argument('--max-search-size', default=format_size(DEFAULT_MAX_SEARCH_SIZE),
+                        help="skip create_best_* searches above this size")
+    parser.add_argument('--corpus-dir', help="keep generated corpus files here for reuse")
+    parser.add_argument('--save', help="write results as a JSON baseline")
+    parser.add_argument('--baseline', help="compare against a saved JSON baseline")
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help="allowed slowdown before a case counts as a regression")
+    parser.add_argument('--frame-sizes',
+                        help="comma-separated frame sizes for the framed compression table "
+                             "(0 = one frame)")
+    parser.add_argument('--frame-backend', default='zlib', help="backend for the frame table")
+    parser.add_argument('--frame-workers', type=int, default=1,
+                        help="worker processes for framed compression/extraction")
+    args = parser.parse_args(argv)
+
+    benchmarks = [name for name in args.only.split(',') if name]
+    unknown = set(benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+    if args.corpus_dir:
+        os.makedirs(args.corpus_dir, exist_ok=True)
+
+    kinds = [kind for kind in args.kinds.split(',') if kind]
+    sizes = [parse_size(size) for size in args.sizes.split(',') if size]
+    rows = run_benchmarks(
+        kinds=kinds,
+        sizes=sizes,
+        benchmarks=benchmarks,
+        max_search_size=parse_size(args.max_search_size),
+        corpus_dir=args.corpus_dir,
+    )
+    if rows:
+        print_rows(rows)
+
+    frame_rows = []
+    if args.frame_sizes:
+        frame_rows = run_frame_benchmarks(
+            kinds, sizes, [parse_size(size) for size in args.frame_sizes.split(',') if size],
+            args.frame_backend, args.frame_workers, args.corpus_dir)
+        print()
+        print_frame_rows(frame_rows)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'python': platform.python_version(), 'machine': platform.machine(),
+                       'results': rows, 'frames': frame_rows}, f, indent=2)
+        print(f"\nBaseline saved to {args.save}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(rows, json.load(f)['results'], args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {args.tolerance:.0%}:")
+            for row, old, slowdown in regressions:
+                print(f"  {_key(row)}: {old['seconds']:.4f}s → {row['seconds']:.4f}s "
+                      f"(+{slowdown:.0%})")
+            return 1
+        print("\nNo regressions against baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
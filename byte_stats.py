@@ -0,0 +1,192 @@
+"""Bit and byte statistics used to score XOR variations without transforming.
+
+The statistics are derived from byte histograms, counted in a single
+pass with collections.Counter (a C loop, a few tens of MB/s), so one pass
+over a buffer (or over an mmap, block by block) gives the popcount, the
+zero-byte count and the order-0 entropy together. Callers that only need
+the zero/one counts use count_units, which needs no histogram and runs at
+hundreds of MB/s (bytes.count and a big-integer popcount).
+
+The two counting conventions of the scripts are both available and must
+be chosen explicitly with ``unit``:
+
+* ``'bit'``  - zero bits against set bits (Anomaly_2-5's count_zeros_ones)
+* ``'byte'`` - zero bytes against non-zero bytes (Anomaly_1's
+  check_zeros_ones)
+"""
+
+import math
+import mmap
+import os
+from collections import Counter
+
+UNITS = ('bit', 'byte')
+# Block size for per-block statistics of files and mmaps
+DEFAULT_STATS_BLOCK = 1 << 20
+
+# Bytes read as one big integer at a time by popcount
+POPCOUNT_BLOCK = 1 << 16
+# Number of set bits in every byte value
+POPCOUNT = bytes(b.bit_count() for b in range(256))
+
+
+def byte_histogram(data):
+    """Return a 256-entry list with the count of every byte value in data."""
+    counts = Counter(memoryview(data).cast('B'))
+    return [counts[b] for b in range(256)]
+
+
+def ranked_xor_keys(histogram):
+    """Rank single-byte XOR keys by the zero/one balance they produce.
+
+    XOR with key ``k`` turns every byte equal to ``k`` into a zero byte, so
+    the zero-byte count of the transformed data is ``histogram[k]``, exactly
+    as check_zeros_ones would count it. Returns two lists of
+    ``(xor_val, count_difference)`` for the keys giving more zeros and more
+    ones, best first, ties in key order.
+    """
+    total = sum(histogram)
+    zeros_keys = []
+    ones_keys = []
+    for xor_val, zeros in enumerate(histogram):
+        ones = total - zeros
+        if zeros > ones:
+            zeros_keys.append((xor_val, zeros - ones))
+        elif ones > zeros:
+            ones_keys.append((xor_val, ones - zeros))
+    zeros_keys.sort(key=lambda item: -item[1])
+    ones_keys.sort(key=lambda item: -item[1])
+    return zeros_keys, ones_keys
+
+
+def best_xor_keys(histogram):
+    """Pick the best 'zeros' and 'ones' single-byte XOR keys from a histogram.
+
+    The result mirrors scoring all 256 transformed copies with
+    check_zeros_ones: each entry is ``(xor_val, count_difference)`` or None,
+    and the first key with the strictly largest difference wins.
+    """
+    zeros_keys, ones_keys = ranked_xor_keys(histogram)
+    return (zeros_keys[0] if zeros_keys else None), (ones_keys[0] if ones_keys else None)
+
+
+def popcount(data, histogram=None, block_size=POPCOUNT_BLOCK):
+    """Return the number of set bits in data, optionally from its histogram.
+
+    Without a histogram the bytes are read as big integers one block at a
+    time, so no integer larger than ``block_size`` bytes is ever built.
+    """
+    if histogram is None:
+        view = memoryview(data).cast('B')
+        return sum(int.from_bytes(view[start:start + block_size], 'big').bit_count()
+                   for start in range(0, len(view), block_size))
+    return sum(count * POPCOUNT[b] for b, count in enumerate(histogram))
+
+
+def file_histogram(path, block_size=1 << 20):
+    """Byte histogram of a file, read in fixed-size blocks."""
+    histogram = [0] * 256
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            for b, count in enumerate(byte_histogram(block)):
+                histogram[b] += count
+    return histogram
+
+
+def zeros_ones(histogram, unit):
+    """Return ``(zeros, ones)`` of a byte histogram in ``unit`` ('bit' or 'byte')."""
+    total = sum(histogram)
+    if unit == 'bit':
+        ones = popcount(None, histogram)
+        return total * 8 - ones, ones
+    if unit == 'byte':
+        return histogram[0], total - histogram[0]
+    raise ValueError(f"Unknown unit '{unit}' (choose from {', '.join(UNITS)})")
+
+
+def majority(zeros, ones):
+    """Return ``('zeros' | 'ones' | 'equal', difference)``."""
+    if zeros > ones:
+        return 'zeros', zeros - ones
+    if ones > zeros:
+        return 'ones', ones - zeros
+    return 'equal', 0
+
+
+def count_units(data, unit):
+    """Return ``(zeros, ones)`` of a buffer in ``unit`` without a histogram.
+
+    The fast path for callers that need only the counts: one C-level pass
+    (bytes.count for 'byte', a big-integer popcount for 'bit').
+    """
+    if unit == 'bit':
+        ones = popcount(data)
+        return len(data) * 8 - ones, ones
+    if unit == 'byte':
+        if not isinstance(data, (bytes, bytearray)):
+            data = bytes(data)
+        zeros = data.count(0)
+        return zeros, len(data) - zeros
+    raise ValueError(f"Unknown unit '{unit}' (choose from {', '.join(UNITS)})")
+
+
+def file_counts(path, unit, block_size=DEFAULT_STATS_BLOCK):
+    """count_units of a file, read through an mmap one block at a time."""
+    zeros = ones = 0
+    if os.path.getsize(path) == 0:
+        return zeros, ones
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for start in range(0, len(mm), block_size):
+            block_zeros, block_ones = count_units(mm[start:start + block_size], unit)
+            zeros += block_zeros
+            ones += block_ones
+    return zeros, ones
+
+
+def histogram_entropy(histogram):
+    """Order-0 entropy of a byte histogram in bits per byte."""
+    total = sum(histogram)
+    if not total:
+        return 0.0
+    return -sum(c * math.log2(c / total) for c in histogram if c) / total
+
+
+def buffer_stats(data, unit='bit', block_size=None):
+    """Statistics of a buffer (bytes, bytearray, memoryview or mmap) from its histogram.
+
+    Returns a dict with the byte ``histogram``, ``length``, ``zero_bytes``,
+    ``set_bits``, the ``zeros``/``ones`` counts in ``unit`` with their
+    ``imbalance`` (absolute difference) and the ``entropy`` in bits per
+    byte. With a ``block_size`` the buffer is read that many bytes at a
+    time and ``blocks`` lists ``(offset, imbalance, entropy)`` per block.
+    """
+    length = len(data)
+    step = block_size or max(length, 1)
+    histogram = [0] * 256
+    blocks = [] if block_size else None
+    for offset in range(0, length, step):
+        block_histogram = byte_histogram(data[offset:offset + step])
+        for b, count in enumerate(block_histogram):
+            histogram[b] += count
+        if blocks is not None:
+            zeros, ones = zeros_ones(block_histogram, unit)
+            blocks.append((offset, abs(zeros - ones), histogram_entropy(block_histogram)))
+    zeros, ones = zeros_ones(histogram, unit)
+    stats = {'unit': unit, 'length': length, 'histogram': histogram,
+             'zero_bytes': histogram[0], 'set_bits': popcount(None, histogram),
+             'zeros': zeros, 'ones': ones, 'imbalance': abs(zeros - ones),
+             'entropy': histogram_entropy(histogram)}
+    if blocks is not None:
+        stats['blocks'] = blocks
+    return stats
+
+
+def file_stats(path, unit='bit', block_size=DEFAULT_STATS_BLOCK):
+    """buffer_stats of a file, read through an mmap one block at a time."""
+    if os.path.getsize(path) == 0:
+        return buffer_stats(b'', unit, block_size)
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return buffer_stats(mm, unit, block_size)
@@ -0,0 +1,525 @@
+"""Non-interactive command line and batch-manifest runner for the Anomaly tools.
+
+Every interactive menu of Anomaly_1-6 has a subcommand here:
+
+    python cli.py encode photo.jpg -o out/
+    python cli.py decode out/ -o restored/ --workers 4
+    python cli.py decode out/ -o restored/ --write-mode clone
+    python cli.py decode out/ -o restored/ --dedup link
+    python cli.py audit out/ --workers 4
+    python cli.py scan out/photo_xor_variations
+    python cli.py check photo.jpg
+    python cli.py stats photo.jpg --unit bit --block-size 65536
+    python cli.py report photo.jpg --width 2 --backend lzma
+    python cli.py search1 photo.jpg -o out/ --backend zlib
+    python cli.py search2 photo.jpg -o out/ --workers 4
+    python cli.py search photo.jpg -o out/ --width 8 --edits 4 --beam 8
+    python cli.py extract out/photo_most_zeros_ones/x.bin -o restored/ --name x.bin
+    python cli.py search1 photo.jpg --frame-size 262144 --workers 4
+    python cli.py extract x.bin -o restored/ --name part.bin --range 4096 1024
+    python cli.py simple-encode photo.jpg photo
+    python cli.py simple-decode photo.enc photo.jpg
+    python cli.py primes encoded/
+    python cli.py search2 photo.jpg --metrics run.prom --metrics-format prometheus
+
+Every command also takes ``--metrics FILE`` (counters and stage timings of
+the run, see metrics.py), ``--profile FILE`` (cProfile statistics),
+``--trace-memory`` (peak traced allocation) and ``--progress-interval``
+(seconds between progress lines, 0 for every line).
+
+``run-manifest`` executes a JSON-lines file of jobs in one warm process.
+Each line is an object with a ``command`` plus that command's options
+under their long names (``{"command": "encode", "input": "a.jpg",
+"output_dir": "out"}``), and one JSON result line is written per job.
+A job is ``"ok": false`` when it raises or when its command reports a
+failure (nothing saved, files that failed to decode or verify), and the
+runner exits non-zero if any job failed.
+
+``serve`` keeps a pool of warm worker processes behind a Unix socket
+(see job_server.py); ``submit`` sends it one job in the same JSON form
+and streams the job's output back, ``jobs`` lists the server's jobs and
+``cancel`` stops one:
+
+    python cli.py serve --workers 4 --limit search2=1
+    python cli.py submit '{"command": "encode", "input": "a.jpg"}' --priority 5
+    python cli.py cancel 3
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+
+import metrics
+from compressors import available_backends
+from result_cache import ResultCache
+from scorers import SCORERS
+from xor_transform import DEFAULT_BLOCK_SIZE
+
+
+class CommandFailed(RuntimeError):
+    """A command whose library function reported failure instead of raising.
+
+    The Anomaly functions print their errors and return 0, None or a
+    summary of failed files; ``result`` keeps what the command returned.
+    """
+
+    def __init__(self, message, result=None):
+        super().__init__(message)
+        self.result = result
+
+
+def _cache(opts):
+    return ResultCache(opts['cache_dir']) if opts['cache_dir'] else None
+
+
+def _with_cache_stats(result, cache):
+    if cache is not None:
+        result['cache'] = cache.stats()
+    return result
+
+
+def _encode(opts):
+    import Anomaly_1
+    cache = _cache(opts)
+    files_saved = Anomaly_1.encode_to_variations(
+        opts['input'], opts['output_dir'], opts['chunk_size'], opts['block_size'],
+        opts['scorer'], opts['shortlist'], opts['sample_size'], opts['container'], opts['top'],
+        opts['backend'] or 'none', opts['level'], cache, opts['adaptive'])
+    result = _with_cache_stats({'files_saved': files_saved}, cache)
+    if not files_saved:
+        raise CommandFailed(f"No variations saved for '{opts['input']}'", result)
+    return result
+
+
+def _decode(opts):
+    import Anomaly_1
+    summary = Anomaly_1.process_all_variation_folders(
+        opts['input'], opts['output_dir'], opts['workers'], block_size=opts['block_size'],
+        max_depth=opts['max_depth'], exclude=opts['exclude'] or (),
+        descend_matched=not opts['no_descend_matched'], write_mode=opts['write_mode'],
+        dedup=opts['dedup'])
+    if not summary['folders']:
+        raise CommandFailed(f"No variation folders found under '{opts['input']}'", summary)
+    if summary['failed'] or summary['mismatched']:
+        raise CommandFailed(f"{summary['failed']} files failed to decode, "
+                            f"{summary['mismatched']} checksum mismatches", summary)
+    return summary
+
+
+def _audit(opts):
+    import Anomaly_1
+    summary = Anomaly_1.audit_variation_folders(
+        opts['input'], opts['workers'], block_size=opts['block_size'] or DEFAULT_BLOCK_SIZE,
+        max_depth=opts['max_depth'], exclude=opts['exclude'] or (),
+        descend_matched=not opts['no_descend_matched'])
+    summary['problems'] = [{'path': path, 'status': status}
+                           for path, status in summary['problems']]
+    bad = summary['mismatch'] + summary['damaged'] + summary['error']
+    if bad:
+        raise CommandFailed(f"{bad} of {summary['files']} files failed the audit", summary)
+    return summary
+
+
+def _scan(opts):
+    import Anomaly_1
+    results, best_zeros, best_ones = Anomaly_1.check_variations(opts['input'], opts['unit'])
+    if not results:
+        raise CommandFailed(f"No file of '{opts['input']}' could be scored")
+    return {'results': results, 'best_zeros': best_zeros, 'best_ones': best_ones}
+
+
+def _check(opts):
+    import Anomaly_1
+    most_frequent, count_difference = Anomaly_1.check_zeros_ones(opts['input'], opts['unit'])
+    if most_frequent is None:
+        raise CommandFailed(f"Could not count '{opts['input']}'")
+    return {'most_frequent': most_frequent, 'difference': count_difference}
+
+
+def _stats(opts):
+    import byte_stats
+    stats = byte_stats.file_stats(opts['input'], opts['unit'], opts['block_size'])
+    del stats['histogram']
+    return stats
+
+
+def _saved_result(opts, saved, cache=None):
+    result = _with_cache_stats({'saved': saved}, cache)
+    if not saved:
+        raise CommandFailed(f"Nothing saved for '{opts['input']}'", result)
+    return result
+
+
+def _report(opts):
+    import scorers
+    with open(opts['input'], 'rb') as f:
+        data = f.read()
+    backend = scorers.scoring_backend(opts['backend'] or 'zlib')
+    rows = scorers.scorer_report(data, opts['width'], opts['scorers'], opts['shortlist'],
+                                 opts['sample_size'], backend, opts['level'])
+    scorers.print_scorer_report(rows, backend)
+    return {'backend': backend, 'rows': rows}
+
+
+def _search1(opts):
+    import Anomaly_2
+    cache = _cache(opts)
+    saved = Anomaly_2.create_best_zero_one_variation(
+        opts['input'], opts['output_dir'], opts['backend'] or Anomaly_2.DEFAULT_BACKEND,
+        opts['level'], opts['scorer'], opts['shortlist'], opts['sample_size'], cache,
+        opts['deadline'], opts['checkpoint'], opts['top'], opts['frame_size'], opts['workers'])
+    return _saved_result(opts, saved, cache)
+
+
+def _search2(opts):
+    import Anomaly_3
+    cache = _cache(opts)
+    saved = Anomaly_3.create_best_two_byte_variation(
+        opts['input'], opts['output_dir'], opts['workers'],
+        opts['backend'] or Anomaly_3.DEFAULT_BACKEND, opts['level'], opts['scorer'],
+        opts['shortlist'], opts['sample_size'], cache, opts['deadline'], opts['checkpoint'],
+        opts['top'], opts['frame_size'])
+    return _saved_result(opts, saved, cache)
+
+
+def _search(opts):
+    import variation_search
+    cache = _cache(opts)
+    saved = variation_search.create_best_variation(
+        opts['input'], opts['output_dir'], opts['width'], opts['edits'], opts['beam'],
+        opts['workers'], opts['backend'] or 'none', opts['level'], cache=cache,
+        frame_size=opts['frame_size'])
+    return _saved_result(opts, saved, cache)
+
+
+def _extract(opts):
+    import Anomaly_2
+    saved = Anomaly_2.extract_paq_compressed_file(
+        opts['input'], opts['output_dir'], opts['default_backend'] or Anomaly_2.DEFAULT_BACKEND,
+        output_name=opts['name'], workers=opts['workers'],
+        byte_range=tuple(opts['range']) if opts['range'] else None)
+    return _saved_result(opts, saved)
+
+
+def _simple_encode(opts):
+    import Anomaly_6
+    output_enc = opts['output_base'] + ".enc"
+    size = Anomaly_6.encode_file(opts['input'], output_enc, opts['block_size'],
+                                 opts['backend'] or Anomaly_6.DEFAULT_BACKEND, opts['level'])
+    half_size = size // 2
+    return {'output': output_enc, 'size': size, 'half_size': half_size,
+            'nearest_prime': Anomaly_6.find_nearest_prime_around(half_size)}
+
+
+def _simple_decode(opts):
+    import Anomaly_6
+    size = Anomaly_6.decode_file(opts['input'], opts['output'], opts['block_size'],
+                                 opts['default_backend'] or Anomaly_6.DEFAULT_BACKEND)
+    return {'output': opts['output'], 'size': size}
+
+
+def _primes(opts):
+    import primes
+    paths = []
+    for path in opts['input']:
+        paths += primes.enc_files(path, opts['pattern']) if os.path.isdir(path) else [path]
+    return {'files': primes.half_size_report(paths)}
+
+
+# Shared option specs: (flags, argparse keyword arguments)
+_OUTPUT_DIR = (('-o', '--output-dir'), {'default': '.', 'help': "output directory"})
+_BLOCK_SIZE = (('--block-size',), {'type': int, 'default': DEFAULT_BLOCK_SIZE,
+                                   'help': "streaming block size in bytes (0 loads whole files)"})
+_WORKERS = (('--workers',), {'type': int, 'default': 1, 'help': "worker processes"})
+_BACKEND = (('--backend',), {'choices': available_backends(),
+                             'help': "compression backend (default: the script's own)"})
+_DEFAULT_BACKEND = (('--default-backend',), {'choices': available_backends(),
+                                             'help': "backend for files without a header"})
+_LEVEL = (('--level',), {'type': int, 'help': "compression level/preset"})
+_SCORER = (('--scorer',), {'choices': SCORERS, 'default': 'imbalance',
+                           'help': "candidate scorer"})
+_SHORTLIST = (('--shortlist',), {'type': int, 'default': 16,
+                                 'help': "candidates rescored by non-imbalance scorers"})
+_SAMPLE_SIZE = (('--sample-size',), {'type': int, 'help': "scorer sample size in bytes"})
+_CACHE_DIR = (('--cache-dir',), {'help': "reuse search results cached in this directory"})
+_DEADLINE = (('--deadline',), {'type': float,
+                               'help': "stop the search after this many seconds (partial result)"})
+_CHECKPOINT = (('--checkpoint',), {'help': "save search progress here and resume from it"})
+_MAX_DEPTH = (('--max-depth',), {'type': int, 'help': "deepest folder level searched"})
+_EXCLUDE = (('--exclude',), {'action': 'append', 'help': "glob of folder names to skip"})
+_NO_DESCEND_MATCHED = (('--no-descend-matched',),
+                       {'action': 'store_true', 'default': False,
+                        'help': "do not search inside variation folders"})
+_UNIT = (('--unit',), {'choices': ('byte', 'bit'), 'default': 'byte',
+                       'help': "count zero bytes or zero bits"})
+_FRAME_SIZE = (('--frame-size',), {'type': int,
+                                 'help': "write independent compressed frames of this many bytes"})
+_TOP_EDITS = (('--top',), {'type': int, 'default': 1, 'help': "save the K best edits"})
+
+COMMANDS = {
+    'encode': (_encode, "encode a file to its best zero/one XOR variations (Anomaly_1)",
+               [(('input',), {}), _OUTPUT_DIR,
+                (('--chunk-size',), {'type': int, 'default': 255}),
+                _BLOCK_SIZE, _SCORER, _SHORTLIST, _SAMPLE_SIZE,
+                (('--container',), {'action': 'store_true', 'default': False,
+                                    'help': "write one self-describing container file"}),
+                (('--top',), {'type': int, 'default': 1,
+                              'help': "variations of each kind stored in the container"}),
+                (('--adaptive',), {'action': 'store_true', 'default': False,
+                                   'help': "also store a per-chunk key variation "
+                                           "(implies --container)"}),
+                _BACKEND, _LEVEL, _CACHE_DIR]),
+    'decode': (_decode, "decode every variation folder under a directory (Anomaly_1)",
+               [(('input',), {}), _OUTPUT_DIR, _WORKERS, _BLOCK_SIZE,
+                _MAX_DEPTH, _EXCLUDE, _NO_DESCEND_MATCHED,
+                (('--write-mode',), {'choices': ('copy', 'clone', 'in-place'), 'default': 'copy',
+                                     'help': "decode into a new file, a reflink/copy transformed "
+                                             "in place, or the variation file itself (consumed)"}),
+                (('--dedup',), {'choices': ('skip', 'link'),
+                                'help': "write each distinct output once: skip repeats or "
+                                        "hard-link them to the first copy"})]),
+    'audit': (_audit, "check every variation decodes to its recorded original, writing nothing",
+              [(('input',), {}), _WORKERS, _BLOCK_SIZE, _MAX_DEPTH, _EXCLUDE,
+               _NO_DESCEND_MATCHED]),
+    'scan': (_scan, "score every file of a variations folder (Anomaly_1)",
+             [(('input',), {}), _UNIT]),
+    'check': (_check, "check whether a file has more zero or non-zero bytes (Anomaly_1)",
+              [(('input',), {}), _UNIT]),
+    'stats': (_stats, "bit/byte counts, imbalance and entropy of a file, overall and per block",
+              [(('input',), {}), _UNIT,
+               (('--block-size',), {'type': int, 'default': 1 << 20,
+                                    'help': "bytes per reported block"})]),
+    'report': (_report, "compare the edit each scorer picks with its real compressed size",
+               [(('input',), {}),
+                (('--width',), {'type': int, 'choices': (1, 2), 'default': 1,
+                                'help': "edit window in bytes"}),
+                (('--scorers',), {'nargs': '+', 'choices': SCORERS, 'default': list(SCORERS),
+                                  'help': "scorers to compare (default: all)"}),
+                _SHORTLIST, _SAMPLE_SIZE, _BACKEND, _LEVEL]),
+    'search1': (_search1, "save the best single-byte XOR edit, compressed (Anomaly_2)",
+                [(('input',), {}), _OUTPUT_DIR, _WORKERS, _BACKEND, _LEVEL, _SCORER, _SHORTLIST,
+                 _SAMPLE_SIZE, _CACHE_DIR, _DEADLINE, _CHECKPOINT,
+                 _TOP_EDITS, _FRAME_SIZE]),
+    'search2': (_search2, "save the best two-byte XOR edit, compressed (Anomaly_3)",
+                [(('input',), {}), _OUTPUT_DIR, _WORKERS, _BACKEND, _LEVEL, _SCORER,
+                 _SHORTLIST, _SAMPLE_SIZE, _CACHE_DIR, _DEADLINE, _CHECKPOINT,
+                 _TOP_EDITS, _FRAME_SIZE]),
+    'search': (_search, "save the best variation with several k-byte XOR edits",
+               [(('input',), {}), _OUTPUT_DIR,
+                (('--width',), {'type': int, 'choices': (1, 2, 4, 8), 'default': 4,
+                                'help': "edit window in bytes"}),
+                (('--edits',), {'type': int, 'default': 1, 'help': "non-overlapping edits"}),
+                (('--beam',), {'type': int, 'default': 1, 'help': "beam width (1 = greedy)"}),
+                _WORKERS, _BACKEND, _LEVEL, _CACHE_DIR, _FRAME_SIZE]),
+    'extract': (_extract, "decompress a file saved by search1/search2 (Anomaly_2-5)",
+                [(('input',), {}), _OUTPUT_DIR, _DEFAULT_BACKEND, _WORKERS,
+                 (('--name',), {'required': True, 'help': "output file name"}),
+                 (('--range',), {'type': int, 'nargs': 2, 'metavar': ('START', 'LENGTH'),
+                                 'help': "extract only this byte range"})]),
+    'simple-encode': (_simple_encode, "XOR 0xFF transform and compress to BASE.enc (Anomaly_6)",
+                      [(('input',), {}), (('output_base',), {}), _BLOCK_SIZE, _BACKEND, _LEVEL]),
+    'simple-decode': (_simple_decode, "decompress and reverse an .enc file (Anomaly_6)",
+                      [(('input',), {}), (('output',), {}), _BLOCK_SIZE, _DEFAULT_BACKEND]),
+    'primes': (_primes, "nearest prime to half the size of each file or .enc in a directory "
+                        "(Anomaly_6)",
+               [(('input',), {'nargs': '+'}),
+                (('--pattern',), {'default': '*.enc', 'help': "file pattern inside directories"})]),
+}
+
+
+def _dest(flags):
+    return flags[-1].lstrip('-').replace('-', '_')
+
+
+def _options(command, values):
+    """Complete a manifest job's options with the command's defaults."""
+    if command not in COMMANDS:
+        raise ValueError(f"Unknown command '{command}'")
+    _, _, specs = COMMANDS[command]
+    opts = {}
+    for flags, kwargs in specs:
+        dest = _dest(flags)
+        if dest in values:
+            opts[dest] = values[dest]
+        elif not flags[0].startswith('-') or kwargs.get('required'):
+            raise ValueError(f"Missing required option '{dest}' for '{command}'")
+        else:
+            opts[dest] = kwargs.get('default')
+    unknown = set(values) - set(opts)
+    if unknown:
+        raise ValueError(f"Unknown option(s) for '{command}': {', '.join(sorted(unknown))}")
+    return opts
+
+
+def run_command(command, opts):
+    """Run one command with complete options and return its JSON-able result.
+
+    Raises CommandFailed when the command ran but reported failure.
+    """
+    if command not in COMMANDS:
+        raise ValueError(f"Unknown command '{command}'")
+    return COMMANDS[command][0](opts)
+
+
+def run_manifest(lines, out, log=sys.stderr):
+    """Run JSON-lines jobs and write one JSON result line per job to out.
+
+    Progress printed by the jobs themselves goes to ``log`` so that ``out``
+    stays machine-readable. Returns the number of failed jobs.
+    """
+    failed = 0
+    for line_no, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        start = time.perf_counter()
+        record = {'line': line_no}
+        try:
+            job = json.loads(line)
+            command = job.pop('command')
+            record['command'] = command
+            if 'id' in job:
+                record['id'] = job.pop('id')
+            opts = _options(command, job)
+            with contextlib.redirect_stdout(log):
+                record['result'] = run_command(command, opts)
+            record['ok'] = True
+        except Exception as e:
+            if getattr(e, 'result', None) is not None:
+                record['result'] = e.result
+            record['ok'] = False
+            record['error'] = f"{type(e).__name__}: {e}"
+            failed += 1
+        record['seconds'] = round(time.perf_counter() - start, 6)
+        out.write(json.dumps(record, default=str) + "\n")
+        out.flush()
+    return failed
+
+
+def _add_instrumentation(parser):
+    parser.add_argument('--metrics', help="write run metrics to this file")
+    parser.add_argument('--metrics-format', choices=('json', 'prometheus'), default='json',
+                        help="metrics file format")
+    parser.add_argument('--profile', help="write cProfile statistics of the run here")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="record the peak traced allocation (slow)")
+    parser.add_argument('--progress-interval', type=float, default=metrics.PROGRESS_INTERVAL,
+                        help="seconds between progress lines (0 prints every line)")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Non-interactive front end for the Anomaly tools.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for name, (_, help_text, specs) in COMMANDS.items():
+        sub = subparsers.add_parser(name, help=help_text, description=help_text)
+        for flags, kwargs in specs:
+            sub.add_argument(*flags, **kwargs)
+        sub.add_argument('--json', action='store_true', help="print the result as JSON")
+        _add_instrumentation(sub)
+    manifest = subparsers.add_parser('run-manifest', help="run a JSON-lines job manifest")
+    manifest.add_argument('manifest', help="manifest file ('-' for stdin)")
+    manifest.add_argument('--results', help="write result lines here instead of stdout")
+    _add_instrumentation(manifest)
+    serve = subparsers.add_parser('serve', help="run a local job server with warm workers")
+    serve.add_argument('--workers', type=int, help="worker processes (default: CPU count)")
+    serve.add_argument('--limit', action='append', default=[], metavar='COMMAND=N',
+                       help="run at most N jobs of COMMAND at once (repeatable)")
+    submit = subparsers.add_parser('submit', help="send a JSON job to the job server")
+    submit.add_argument('job', help="job object, e.g. "
+                                    "'{\"command\": \"check\", \"input\": \"a.jpg\"}'")
+    submit.add_argument('--priority', type=int, default=0, help="higher runs first")
+    submit.add_argument('--no-wait', action='store_true',
+                        help="print the job id and return instead of streaming the job")
+    subparsers.add_parser('jobs', help="list the job server's jobs")
+    cancel = subparsers.add_parser('cancel', help="cancel a queued or running server job")
+    cancel.add_argument('job_id', type=int)
+    for sub in (serve, submit, subparsers.choices['jobs'], cancel):
+        sub.add_argument('--socket', help="server socket (default: $ANOMALY_SOCKET or a "
+                                          "per-user path in the temp directory)")
+        _add_instrumentation(sub)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    metrics.PROGRESS_INTERVAL = args.progress_interval
+    with metrics.profiled(args.profile, args.trace_memory):
+        status = _run(args)
+    if args.metrics:
+        metrics.write_metrics(args.metrics, args.metrics_format)
+    return status
+
+
+def _run(args):
+    if args.command == 'run-manifest':
+        src = sys.stdin if args.manifest == '-' else open(args.manifest)
+        out = open(args.results, 'w') if args.results else sys.stdout
+        try:
+            return 1 if run_manifest(src, out) else 0
+        finally:
+            if src is not sys.stdin:
+                src.close()
+            if out is not sys.stdout:
+                out.close()
+    if args.command in ('serve', 'submit', 'jobs', 'cancel'):
+        return _run_server_command(args)
+
+    opts = dict(vars(args))
+    command = opts.pop('command')
+    as_json = opts.pop('json')
+    for name in ('metrics', 'metrics_format', 'profile', 'trace_memory', 'progress_interval'):
+        del opts[name]
+    try:
+        if as_json:
+            with contextlib.redirect_stdout(sys.stderr):
+                result = run_command(command, opts)
+            print(json.dumps(result, default=str))
+        else:
+            run_command(command, opts)
+    except CommandFailed as e:
+        if as_json and e.result is not None:
+            print(json.dumps(e.result, default=str))
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def _run_server_command(args):
+    import job_server
+    if args.command == 'serve':
+        limits = {}
+        for item in args.limit:
+            command, _, number = item.partition('=')
+            if command not in COMMANDS or not number.isdigit():
+                print(f"Invalid --limit '{item}' (expected COMMAND=N)", file=sys.stderr)
+                return 2
+            limits[command] = int(number)
+        job_server.JobServer(args.socket, args.workers, limits).serve_forever()
+        return 0
+    try:
+        if args.command == 'submit':
+            events = job_server.submit(json.loads(args.job), args.priority, not args.no_wait,
+                                       args.socket)
+        elif args.command == 'jobs':
+            events = job_server.request({'op': 'jobs'}, args.socket)
+        else:
+            events = job_server.request({'op': 'cancel', 'job': args.job_id}, args.socket)
+        status = 0
+        for event in events:
+            if event.get('event') == 'output':
+                print(event['line'], file=sys.stderr)
+                continue
+            print(json.dumps(event, default=str))
+            if event.get('error') or event.get('event') in ('failed', 'cancelled'):
+                status = 1
+        return status
+    except (OSError, ValueError) as e:
+        print(f"Job server error: {e}", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
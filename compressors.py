@@ -0,0 +1,282 @@
+"""Pluggable compression backends for the PAQ/"Zlib" stages.
+
+Backends are looked up by name and their modules are imported only on
+first use, so a missing optional module (such as ``paq``) only matters to
+the jobs that actually ask for it. Every compressed payload written by the
+Anomaly scripts starts with a small header naming its backend, so
+extraction picks the right one automatically; payloads without the header
+are treated as legacy output of the caller's default backend.
+"""
+
+import importlib
+
+MAGIC = b'ANMC'
+VERSION = 1
+HEADER_SIZE = len(MAGIC) + 3
+# Level byte written when the backend's default level is used (or it takes
+# none); no backend accepts 255 as a level, so it never means a real one
+DEFAULT_LEVEL = 0xFF
+
+
+class _Passthrough:
+    """Incremental (de)compressor object for backends without one."""
+
+    def __init__(self, finish=None):
+        self._finish = finish
+        self._parts = [] if finish else None
+
+    unconsumed_tail = b''
+
+    def _feed(self, data, max_length=-1):
+        if self._parts is None:
+            data = bytes(data)
+            if max_length > 0:
+                data, self.unconsumed_tail = data[:max_length], data[max_length:]
+            return data
+        self._parts.append(bytes(data))
+        return b''
+
+    def _flush(self):
+        if self._parts is None:
+            return b''
+        data, self._parts = b''.join(self._parts), []
+        return self._finish(data)
+
+    compress = decompress = _feed
+    flush = _flush
+
+
+class Backend:
+    """A named compressor whose module is imported on first use.
+
+    ``levels`` is the range of compression levels the backend accepts, or
+    None when it has no levels and ignores the one it is given.
+    """
+
+    def __init__(self, name, backend_id, module_name, default_level=None,
+                 compress=None, decompress=None, compressobj=None, decompressobj=None,
+                 levels=None):
+        self.name = name
+        self.backend_id = backend_id
+        self.module_name = module_name
+        self.default_level = default_level
+        self.levels = levels
+        self._compress = compress
+        self._decompress = decompress
+        self._compressobj = compressobj
+        self._decompressobj = decompressobj
+        self._module = None
+
+    @property
+    def module(self):
+        if self._module is None and self.module_name:
+            self._module = importlib.import_module(self.module_name)
+        return self._module
+
+    def _level(self, level):
+        return self.default_level if level is None else level
+
+    def compress(self, data, level=None):
+        if self._compress is None:
+            return bytes(data)
+        return self._compress(self.module, data, self._level(level))
+
+    def decompress(self, data):
+        if self._decompress is None:
+            return bytes(data)
+        return self._decompress(self.module, data)
+
+    def compressobj(self, level=None):
+        """Return an object with compress()/flush() for streaming use.
+
+        Backends without an incremental API buffer their input and compress
+        it whole on flush().
+        """
+        if self._compressobj is not None:
+            return self._compressobj(self.module, self._level(level))
+        if self._compress is None:
+            return _Passthrough()
+        return _Passthrough(lambda data: self.compress(data, level))
+
+    def decompressobj(self):
+        """Return an object with decompress()/flush() for streaming use."""
+        if self._decompressobj is not None:
+            return self._decompressobj(self.module)
+        if self._decompress is None:
+            return _Passthrough()
+        return _Passthrough(self.decompress)
+
+
+class _DecompressorFlush:
+    """Give lzma/bz2 decompressors the flush() method zlib's has."""
+
+    def __init__(self, decompressor):
+        self._decompressor = decompressor
+
+    def decompress(self, data, max_length=-1):
+        return self._decompressor.decompress(data, max_length)
+
+    @property
+    def needs_input(self):
+        return self._decompressor.needs_input
+
+    @property
+    def eof(self):
+        return self._decompressor.eof
+
+    def flush(self):
+        return b''
+
+
+def iter_decompressed(decompressor, data, max_length):
+    """Yield decompressor's output for data in pieces of at most max_length bytes.
+
+    Input that expands a lot never comes out in one piece: zlib-style
+    objects keep the rest of the input in ``unconsumed_tail``, lzma/bz2 ones
+    buffer it until they report ``needs_input``. Only backends without an
+    incremental API (paq) still decompress everything on flush().
+    """
+    piece = decompressor.decompress(data, max_length)
+    while True:
+        if piece:
+            yield piece
+        tail = getattr(decompressor, 'unconsumed_tail', None)
+        if tail:
+            piece = decompressor.decompress(tail, max_length)
+        elif tail is None and not (decompressor.eof or decompressor.needs_input):
+            piece = decompressor.decompress(b'', max_length)
+        else:
+            return
+
+
+_REGISTRY = {}
+
+
+def register_backend(backend):
+    """Add a backend to the registry (replacing one with the same name)."""
+    for other in _REGISTRY.values():
+        if other.backend_id == backend.backend_id and other.name != backend.name:
+            raise ValueError(f"Backend id {backend.backend_id} already used by '{other.name}'")
+    _REGISTRY[backend.name] = backend
+    return backend
+
+
+register_backend(Backend('none', 0, None))
+register_backend(Backend(
+    'zlib', 1, 'zlib', 9,
+    compress=lambda m, data, level: m.compress(data, level),
+    decompress=lambda m, data: m.decompress(data),
+    compressobj=lambda m, level: m.compressobj(level),
+    decompressobj=lambda m: m.decompressobj(),
+    levels=range(0, 10)))
+register_backend(Backend(
+    'lzma', 2, 'lzma', 6,
+    compress=lambda m, data, level: m.compress(data, preset=level),
+    decompress=lambda m, data: m.decompress(data),
+    compressobj=lambda m, level: m.LZMACompressor(preset=level),
+    decompressobj=lambda m: _DecompressorFlush(m.LZMADecompressor()),
+    levels=range(0, 10)))
+register_backend(Backend(
+    'bz2', 3, 'bz2', 9,
+    compress=lambda m, data, level: m.compress(data, level),
+    decompress=lambda m, data: m.decompress(data),
+    compressobj=lambda m, level: m.BZ2Compressor(level),
+    decompressobj=lambda m: _DecompressorFlush(m.BZ2Decompressor()),
+    levels=range(1, 10)))
+# paq has no compression levels: any level given is ignored
+register_backend(Backend(
+    'paq', 4, 'paq', None,
+    compress=lambda m, data, level: m.compress(bytes(data)),
+    decompress=lambda m, data: m.decompress(bytes(data))))
+
+
+def available_backends():
+    """Names of all registered backends."""
+    return sorted(_REGISTRY)
+
+
+def get_backend(name):
+    try:
+        return _REGISTRY[name]
+    except KeyError:
+        raise ValueError(f"Unknown compression backend '{name}' "
+                         f"(choose from {', '.join(available_backends())})") from None
+
+
+def load_backend(name):
+    """get_backend, importing the backend's module now rather than on first use.
+
+    Writers call this before searching or opening their output, so a
+    missing optional module fails the job before any file is created.
+    """
+    backend = get_backend(name)
+    backend.module
+    return backend
+
+
+def backend_by_id(backend_id):
+    """Look a backend up by the id recorded in file headers."""
+    for backend in _REGISTRY.values():
+        if backend.backend_id == backend_id:
+            return backend
+    raise ValueError(f"Unknown compression backend id {backend_id}")
+
+
+def make_header(backend_name, level=None):
+    """Header naming the backend and level of a payload.
+
+    Raises ValueError for a level outside the backend's range; backends
+    without levels (none, paq) ignore it and record DEFAULT_LEVEL.
+    """
+    backend = get_backend(backend_name)
+    level_byte = DEFAULT_LEVEL
+    if level is not None and backend.levels is not None:
+        if level not in backend.levels:
+            raise ValueError(f"Compression level {level} is out of range for backend "
+                             f"'{backend_name}' ({backend.levels[0]}-{backend.levels[-1]})")
+        level_byte = level
+    return MAGIC + bytes((VERSION, backend.backend_id, level_byte))
+
+
+def parse_header(header, default_backend):
+    """Return (backend_name, header_length) for the start of a payload.
+
+    Payloads that do not start with the header are legacy output of
+    ``default_backend`` and have a header length of 0.
+    """
+    header = bytes(header[:HEADER_SIZE])
+    if len(header) < HEADER_SIZE or not header.startswith(MAGIC):
+        return default_backend, 0
+    if header[len(MAGIC)] != VERSION:
+        raise ValueError(f"Unsupported compressed payload version {header[len(MAGIC)]}")
+    return backend_by_id(header[len(MAGIC) + 1]).name, HEADER_SIZE
+
+
+def pack(data, backend_name, level=None):
+    """Compress data and prefix it with the header recording the backend."""
+    return make_header(backend_name, level) + get_backend(backend_name).compress(data, level)
+
+
+def pack_to_file(f, pieces, backend_name, level=None, block_size=1 << 20):
+    """Stream the concatenation of pieces into f as a pack() payload.
+
+    Pieces are fed to the compressor ``block_size`` bytes at a time, so a
+    large memoryview is never copied whole. Returns the number of bytes
+    written.
+    """
+    compressor = get_backend(backend_name).compressobj(level)
+    written = f.write(make_header(backend_name, level))
+    for piece in pieces:
+        view = memoryview(piece)
+        for start in range(0, len(view), block_size):
+            written += f.write(compressor.compress(view[start:start + block_size]))
+    return written + f.write(compressor.flush())
+
+
+def unpack(payload, default_backend):
+    """Decompress a payload written by pack() (or a legacy headerless one).
+
+    Returns ``(data, backend_name)``.
+    """
+    backend_name, offset = parse_header(payload, default_backend)
+    return get_backend(backend_name).decompress(memoryview(payload)[offset:]), backend_name
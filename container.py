@@ -0,0 +1,269 @@
+"""Self-describing container for XOR variations.
+
+A container holds one or more variations of the same original file, so
+decoding never has to guess the transform from the file name. Layout
+(little-endian):
+
+    fixed header   magic 'AXVC', version, flags, entry count, original
+                   length, CRC-32 of the original, backend id, name length
+    name           original file name, UTF-8
+    index          one fixed-size record per variation: kind, chunk size,
+                   xor key, score, payload offset/length, key-table
+                   offset/length
+    payloads       the variations, each compressed with the backend and,
+                   for adaptive variations, followed by their per-chunk key
+                   table (one byte per chunk, zlib-compressed)
+
+The header and index are read with ``os.pread``, so listing a container or
+fetching one variation never reads the others.
+"""
+
+import os
+import struct
+import zlib
+
+from compressors import backend_by_id, get_backend
+from xor_transform import (DEFAULT_BLOCK_SIZE, aligned_block_size, iter_blocks, transform_buffer,
+                           transform_with_keys)
+
+MAGIC = b'AXVC'
+VERSION = 1
+EXTENSION = '.axv'
+_HEADER = struct.Struct('<4sBBHQIBH')
+_ENTRY = struct.Struct('<BIBqQQQQ')
+KINDS = ('zeros', 'ones', 'adaptive')
+
+
+def is_container(path):
+    """True when path starts with the container magic."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return False
+    try:
+        return os.pread(fd, len(MAGIC), 0) == MAGIC
+    finally:
+        os.close(fd)
+
+
+def file_crc32(path, block_size=DEFAULT_BLOCK_SIZE):
+    """CRC-32 and length of a file, read in blocks."""
+    crc = 0
+    length = 0
+    with open(path, 'rb') as f:
+        for block in iter_blocks(f, block_size):
+            crc = zlib.crc32(block, crc)
+            length += len(block)
+    return crc, length
+
+
+class ContainerWriter:
+    """Write a container entry by entry, streaming each payload.
+
+    The header and a placeholder index are written first; each add() streams
+    its payload after them and close() fills in the index.
+    """
+
+    def __init__(self, path, original_name, original_length, crc, entry_count,
+                 backend='none', level=None):
+        self.path = path
+        self.backend = get_backend(backend)
+        self.level = level
+        self.entry_count = entry_count
+        self.entries = []
+        name = os.path.basename(original_name).encode('utf-8')
+        self._f = open(path, 'wb')
+        self._f.write(_HEADER.pack(MAGIC, VERSION, 0, entry_count, original_length, crc,
+                                   self.backend.backend_id, len(name)))
+        self._f.write(name)
+        self._index_offset = self._f.tell()
+        self._f.write(b'\0' * (_ENTRY.size * entry_count))
+
+    def add(self, kind, chunk_size, xor_val, score, blocks, keys=b''):
+        """Append a variation given as an iterable of byte blocks.
+
+        ``keys`` is the per-chunk key table of an adaptive variation; it is
+        stored compressed after the payload.
+        """
+        if len(self.entries) >= self.entry_count:
+            raise ValueError("Container already holds the declared number of entries")
+        compressor = self.backend.compressobj(self.level)
+        offset = self._f.tell()
+        for block in blocks:
+            self._f.write(compressor.compress(bytes(block)))
+        self._f.write(compressor.flush())
+        length = self._f.tell() - offset
+        keys_offset = self._f.tell() if keys else 0
+        if keys:
+            keys = zlib.compress(bytes(keys), 9)
+            self._f.write(keys)
+        self.entries.append((KINDS.index(kind), chunk_size, xor_val & 0xFF, score,
+                             offset, length, keys_offset, len(keys)))
+
+    def close(self):
+        if len(self.entries) != self.entry_count:
+            self._f.close()
+            raise ValueError(f"Container declared {self.entry_count} entries "
+                             f"but {len(self.entries)} were added")
+        self._f.seek(self._index_offset)
+        for entry in self.entries:
+            self._f.write(_ENTRY.pack(*entry))
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._f.close()
+
+
+def read_header(path):
+    """Read a container's header and index with positioned reads only."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        fixed = os.pread(fd, _HEADER.size, 0)
+        if len(fixed) < _HEADER.size or not fixed.startswith(MAGIC):
+            raise ValueError(f"'{path}' is not a variation container")
+        magic, version, flags, count, length, crc, backend_id, name_len = _HEADER.unpack(fixed)
+        if version != VERSION:
+            raise ValueError(f"Unsupported container version {version}")
+        name = os.pread(fd, name_len, _HEADER.size).decode('utf-8')
+        raw_index = os.pread(fd, _ENTRY.size * count, _HEADER.size + name_len)
+    finally:
+        os.close(fd)
+    entries = []
+    for i in range(count):
+        kind, chunk_size, xor_val, score, offset, size, keys_offset, keys_size = \
+            _ENTRY.unpack_from(raw_index, i * _ENTRY.size)
+        entries.append({'kind': KINDS[kind], 'chunk_size': chunk_size, 'xor': xor_val,
+                        'score': score, 'offset': offset, 'length': size,
+                        'keys_offset': keys_offset, 'keys_length': keys_size})
+    return {'original_name': name, 'original_length': length, 'crc32': crc,
+            'backend': backend_by_id(backend_id).name, 'entries': entries}
+
+
+def _entry_payload_blocks(path, header, index, block_size):
+    """Yield the decompressed payload of one entry in blocks."""
+    entry = header['entries'][index]
+    decompressor = get_backend(header['backend']).decompressobj()
+    with open(path, 'rb') as f:
+        f.seek(entry['offset'])
+        remaining = entry['length']
+        while remaining > 0:
+            block = f.read(min(block_size, remaining))
+            if not block:
+                raise ValueError(f"'{path}' is truncated")
+            remaining -= len(block)
+            out = decompressor.decompress(block)
+            if out:
+                yield out
+    tail = decompressor.flush()
+    if tail:
+        yield tail
+
+
+def read_variation(path, index=0, header=None):
+    """Return the stored (still transformed) bytes of one variation."""
+    header = header or read_header(path)
+    return b''.join(_entry_payload_blocks(path, header, index, DEFAULT_BLOCK_SIZE))
+
+
+def read_keys(path, index=0, header=None):
+    """Return the per-chunk key table of an adaptive variation (b'' for others)."""
+    header = header or read_header(path)
+    entry = header['entries'][index]
+    if not entry['keys_length']:
+        return b''
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        raw = os.pread(fd, entry['keys_length'], entry['keys_offset'])
+    finally:
+        os.close(fd)
+    return zlib.decompress(raw)
+
+
+def _untransform(data, entry, keys, first_chunk=0):
+    if keys:
+        chunk_size = entry['chunk_size']
+        count = -(-len(data) // chunk_size)
+        return transform_with_keys(data, chunk_size, keys[first_chunk:first_chunk + count])
+    return transform_buffer(data, entry['chunk_size'], entry['xor'])
+
+
+def _decoded_blocks(path, header, index, block_size):
+    """Yield the original bytes of one entry, re-blocked on chunk boundaries."""
+    entry = header['entries'][index]
+    chunk_size = entry['chunk_size']
+    keys = read_keys(path, index, header)
+    aligned = aligned_block_size(block_size, chunk_size)
+    pending = b''
+    first_chunk = 0
+    for piece in _entry_payload_blocks(path, header, index, block_size):
+        pending += piece
+        usable = len(pending) - len(pending) % aligned
+        if usable:
+            yield _untransform(pending[:usable], entry, keys, first_chunk)
+            pending = pending[usable:]
+            first_chunk += usable // max(chunk_size, 1)
+    if pending:
+        yield _untransform(pending, entry, keys, first_chunk)
+
+
+def decode_to_file(path, out_path, index=0, block_size=DEFAULT_BLOCK_SIZE):
+    """Decode one variation of a container into out_path, verifying it.
+
+    The decoded length and CRC-32 must match the header, otherwise
+    ValueError is raised (the partial output is left for inspection).
+    Returns the number of bytes written.
+    """
+    header = read_header(path)
+    if not header['entries']:
+        raise ValueError(f"'{path}' holds no variations")
+    crc = 0
+    written = 0
+    with open(out_path, 'wb') as out:
+        for block in _decoded_blocks(path, header, index, block_size):
+            crc = zlib.crc32(block, crc)
+            written += out.write(block)
+    if written != header['original_length'] or crc != header['crc32']:
+        raise ValueError(_mismatch_message(path, header, index, written, crc))
+    return written
+
+
+def _mismatch_message(path, header, index, length, crc):
+    return (f"'{path}' variation {index} failed verification "
+            f"(length {length}/{header['original_length']}, "
+            f"crc {crc:08x}/{header['crc32']:08x})")
+
+
+def verify(path, block_size=DEFAULT_BLOCK_SIZE, header=None):
+    """Decode every variation of a container without writing it and check it.
+
+    Returns one ``(index, length, crc, ok)`` tuple per variation, where
+    length and crc are those of the decoded bytes and ok tells whether they
+    match the header.
+    """
+    header = header or read_header(path)
+    results = []
+    for index in range(len(header['entries'])):
+        crc = 0
+        length = 0
+        for block in _decoded_blocks(path, header, index, block_size):
+            crc = zlib.crc32(block, crc)
+            length += len(block)
+        ok = length == header['original_length'] and crc == header['crc32']
+        results.append((index, length, crc, ok))
+    return results
+
+
+def decode(path, index=0):
+    """Return the verified original bytes of one variation."""
+    header = read_header(path)
+    entry = header['entries'][index]
+    data = _untransform(read_variation(path, index, header), entry, read_keys(path, index, header))
+    if len(data) != header['original_length'] or zlib.crc32(data) != header['crc32']:
+        raise ValueError(f"'{path}' variation {index} failed verification")
+    return data
@@ -0,0 +1,523 @@
+"""Incremental delta-scoring search engines for the XOR variation scripts.
+
+The searches in Anomaly_2-5 change one byte (or one byte pair) of the
+input and score the result by ``abs(zeros - ones)`` over all bits. Only the
+edited bytes change, so every candidate is scored from the base popcount
+and the popcount delta of the edit instead of copying and recounting the
+whole file.
+
+search_edits generalises this to any window width and several
+non-overlapping edits: the best key of a window follows in closed form from
+its popcount, so no key is ever enumerated.
+"""
+
+import hashlib
+import heapq
+import json
+import os
+import re
+import time
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+
+from byte_stats import POPCOUNT, popcount
+from metrics import METRICS, count
+from result_cache import atomic_write_json
+
+# Popcount of every 16-bit value, for the two-byte search
+POPCOUNT16 = bytes(POPCOUNT[v >> 8] + POPCOUNT[v & 0xFF] for v in range(65536))
+# Window positions whose popcounts are computed at a time, so a search only
+# counts the range it scans and never holds a second copy of its input
+SCAN_BLOCK = 1 << 20
+
+
+def _imbalance(total_bits, ones):
+    return abs(total_bits - 2 * ones)
+
+
+def _window_pattern(width, good_sums):
+    """Regex matching (as a lookahead) a window whose popcount is in good_sums.
+
+    The pattern runs over the per-byte popcounts of the data, so positions
+    that cannot beat the current best are skipped at C speed.
+    """
+    def byte_class(values):
+        return b'[' + b''.join(re.escape(bytes((v,))) for v in sorted(values)) + b']'
+
+    if width == 1:
+        body = byte_class(good_sums)
+    else:
+        alternatives = []
+        for first in range(9):
+            rest = {s - first for s in good_sums if 0 <= s - first <= 8}
+            if rest:
+                alternatives.append(re.escape(bytes((first,))) + byte_class(rest))
+        body = b'(?:' + b'|'.join(alternatives) + b')'
+    return re.compile(b'(?=' + body + b')')
+
+
+def _popcount_blocks(data, width, start, stop, block_size=SCAN_BLOCK):
+    """Yield ``(block_start, block_stop, byte_popcounts)`` for positions start..stop.
+
+    The popcounts run ``width - 1`` bytes past block_stop, so every window
+    starting in the block can be matched.
+    """
+    for block_start in range(start, stop, block_size):
+        block_stop = min(block_start + block_size, stop)
+        yield (block_start, block_stop,
+               bytes(data[block_start:block_stop + width - 1]).translate(POPCOUNT))
+
+
+def resume_window(data, width, start=0, stop=None, best=None, on_improve=None,
+                  deadline=None, on_checkpoint=None, checkpoint_interval=30.0, base_ones=None):
+    """search_window that can stop early and pick up where it stopped.
+
+    ``best`` is the best ``(pos, xor_val, score)`` of the positions before
+    ``start`` (None for a fresh search). The search stops once
+    ``time.monotonic()`` passes ``deadline``, and calls
+    ``on_checkpoint(next_pos, best)`` at most every ``checkpoint_interval``
+    seconds. Returns ``(best, next_pos)``; ``next_pos`` is ``stop`` when the
+    range was searched completely, otherwise the position to resume from
+    with the same ``best``, which gives exactly the uninterrupted result.
+    ``base_ones`` is popcount(data) when the caller already has it; only
+    the positions start..stop are read otherwise.
+    """
+    if width not in (1, 2):
+        raise ValueError("width must be 1 or 2")
+    total_bytes = len(data)
+    last = total_bytes - width + 1
+    stop = last if stop is None else min(stop, last)
+    if start >= stop:
+        return best, max(start, stop)
+    if deadline is not None and time.monotonic() >= deadline:
+        return best, start
+    table = POPCOUNT if width == 1 else POPCOUNT16
+    total_bits = total_bytes * 8
+    if base_ones is None:
+        base_ones = popcount(data)
+    # Best score reachable at a window depends only on its popcount
+    max_score = [max(_imbalance(total_bits, base_ones - s),
+                     _imbalance(total_bits, base_ones - s + 8 * width))
+                 for s in range(8 * width + 1)]
+    levels = sorted(set(max_score))
+
+    best_score = -1 if best is None else best[2]
+    evaluated = 0
+    next_checkpoint = None
+    if on_checkpoint is not None:
+        next_checkpoint = time.monotonic() + checkpoint_interval
+    pos = start
+    for block_start, block_stop, bit_counts in _popcount_blocks(data, width, start, stop):
+        while pos < block_stop:
+            if deadline is not None or next_checkpoint is not None:
+                now = time.monotonic()
+                if deadline is not None and now >= deadline:
+                    count('candidates', evaluated)
+                    return best, pos
+                if next_checkpoint is not None and now >= next_checkpoint:
+                    on_checkpoint(pos, best)
+                    next_checkpoint = now + checkpoint_interval
+            level = bisect_right(levels, best_score)
+            if level == len(levels):
+                count('candidates', evaluated)
+                return best, stop
+            good_sums = [s for s, score in enumerate(max_score) if score >= levels[level]]
+            match = _window_pattern(width, good_sums).search(
+                bit_counts, pos - block_start, block_stop - block_start + width - 1)
+            if match is None:
+                break
+            pos = block_start + match.start()
+            value = int.from_bytes(data[pos:pos + width], byteorder='big')
+            others = base_ones - table[value]
+            # Nothing at this position can beat its own maximum, so the key
+            # scan stops there; the improvements seen are the same as a full scan.
+            position_max = max_score[table[value]]
+            for xor_val in range(1 << (8 * width)):
+                ones = others + table[value ^ xor_val]
+                score = _imbalance(total_bits, ones)
+                if score > best_score:
+                    best_score = score
+                    best = (pos, xor_val, score)
+                    if on_improve is not None:
+                        on_improve(pos, xor_val, total_bits - ones, ones, score)
+                    if score >= position_max:
+                        break
+            evaluated += xor_val + 1
+            pos += 1
+        pos = block_stop
+    count('candidates', evaluated)
+    return best, stop
+
+
+def search_window(data, width, start=0, stop=None, on_improve=None):
+    """Find the best XOR edit of a ``width``-byte window (1 or 2 bytes).
+
+    Window positions ``start <= pos < stop`` are visited in order, each with
+    every xor value in ascending order, and the first strictly better score
+    wins, exactly like the original nested loops. Window values are read
+    big-endian. ``on_improve(pos, xor_val, zeros, ones, score)`` is called
+    for every improvement. Returns ``(pos, xor_val, score)`` or None when
+    there is no candidate.
+    """
+    return resume_window(data, width, start, stop, on_improve=on_improve)[0]
+
+
+def search_single_byte(data, on_improve=None):
+    """Find the best single-byte XOR edit of data (see search_window)."""
+    return search_window(data, 1, on_improve=on_improve)
+
+
+_shard_data = None
+
+
+def _init_shard_worker(data):
+    global _shard_data
+    _shard_data = data
+
+
+def _search_shard(args):
+    width, start, stop, best, deadline, base_ones = args
+    before = METRICS.value('candidates')
+    best, next_pos = resume_window(_shard_data, width, start, stop, best, deadline=deadline,
+                                   base_ones=base_ones)
+    return best, next_pos, METRICS.value('candidates') - before
+
+
+def _report_winner(data, width, best, on_improve, base_ones=None):
+    pos, xor_val, score = best
+    table = POPCOUNT if width == 1 else POPCOUNT16
+    value = int.from_bytes(data[pos:pos + width], byteorder='big')
+    if base_ones is None:
+        base_ones = popcount(data)
+    ones = base_ones - table[value] + table[value ^ xor_val]
+    on_improve(pos, xor_val, len(data) * 8 - ones, ones, score)
+
+
+def run_search(data, width, workers=1, on_improve=None, deadline=None, checkpoint=None,
+               checkpoint_interval=30.0, base_ones=None):
+    """Best ``width``-byte XOR edit of data, with time budget and checkpointing.
+
+    The position range is split into shards (one for a serial run, several
+    for ``workers > 1``) which are merged in position order keeping only
+    strictly better scores, so a complete run gives exactly search_window's
+    result. ``on_improve`` sees every improvement of a single-shard run and
+    only the merged winner otherwise.
+
+    ``deadline`` is a ``time.monotonic()`` value after which the shards stop
+    and the best candidate so far is returned. With a ``checkpoint`` path
+    the shard progress is saved there every ``checkpoint_interval`` seconds
+    (serial) or as shards finish (parallel), and a later call on the same
+    data resumes from it; the file is removed once the search completes.
+    ``base_ones`` is popcount(data) when the caller already has it.
+    Returns ``(best, partial)``.
+    """
+    last = max(len(data) - width + 1, 0)
+    shards = None
+    digest = None
+    if checkpoint is not None:
+        # Hashed once; every save records the same digest
+        digest = _data_digest(data)
+        shards = load_checkpoint(checkpoint, digest, len(data), width)
+    if shards is None:
+        if not workers or workers <= 1 or last < 2:
+            shard_count = 1
+        else:
+            shard_count = min(last, workers * 4)
+        bounds = [last * i // shard_count for i in range(shard_count + 1)]
+        shards = [[bounds[i], bounds[i + 1], bounds[i], None] for i in range(shard_count)]
+
+    def save():
+        if checkpoint is not None:
+            save_checkpoint(checkpoint, digest, len(data), width, shards)
+
+    # One pass for the base popcount; each shard then reads only its range
+    if base_ones is None and (deadline is None or time.monotonic() < deadline):
+        base_ones = popcount(data)
+
+    def run_shard(shard, report):
+        def on_checkpoint(next_pos, best):
+            shard[2:] = [next_pos, best]
+            save()
+        shard[3], shard[2] = resume_window(
+            data, width, shard[2], shard[1], shard[3], report, deadline,
+            on_checkpoint if checkpoint is not None else None, checkpoint_interval, base_ones)
+
+    try:
+        if len(shards) == 1:
+            run_shard(shards[0], on_improve)
+        elif not workers or workers <= 1:
+            for shard in shards:
+                run_shard(shard, None)
+                save()
+        else:
+            todo = [shard for shard in shards if shard[2] < shard[1]]
+            jobs = [(width, next_pos, stop, best, deadline, base_ones)
+                    for _, stop, next_pos, best in todo]
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_shard_worker,
+                                     initargs=(bytes(data),)) as pool:
+                for shard, (best, next_pos, evaluated) in zip(todo, pool.map(_search_shard, jobs)):
+                    shard[2:] = [next_pos, best]
+                    count('candidates', evaluated)
+                    save()
+    except KeyboardInterrupt:
+        save()
+        raise
+
+    best = None
+    for _, _, _, local_best in shards:
+        if local_best is not None and (best is None or local_best[2] > best[2]):
+            best = tuple(local_best)
+    partial = any(next_pos < stop for _, stop, next_pos, _ in shards)
+    if partial:
+        save()
+    elif checkpoint is not None and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    if best is not None and on_improve is not None and len(shards) > 1:
+        _report_winner(data, width, best, on_improve, base_ones)
+    return best, partial
+
+
+def search_two_byte(data, workers=1, on_improve=None):
+    """Find the best two-byte XOR edit of data, optionally on a process pool.
+
+    With ``workers > 1`` the position range is split into contiguous shards
+    that are searched in parallel. Each shard returns its local best and the
+    shards are merged in position order keeping only strictly better scores,
+    so the result is the same as a serial run. ``on_improve`` is called for
+    every improvement in a serial run, and once for the merged winner
+    otherwise.
+    """
+    return run_search(data, 2, workers, on_improve)[0]
+
+
+def _data_digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def save_checkpoint(path, digest, length, width, shards):
+    """Atomically record the shard progress of a search.
+
+    ``digest`` and ``length`` identify the searched data (digest as
+    returned by _data_digest), so saving never rereads it.
+    """
+    atomic_write_json(path, {'version': 1, 'width': width, 'length': length,
+                             'sha256': digest, 'shards': shards})
+
+
+def load_checkpoint(path, digest, length, width):
+    """Shard progress saved for data with this digest and length, or None."""
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable checkpoint '{path}': {e}")
+        return None
+    if (state.get('version') != 1 or state.get('width') != width
+            or state.get('length') != length or state.get('sha256') != digest):
+        print(f"Ignoring checkpoint '{path}': it belongs to a different search")
+        return None
+    print(f"Resuming search from checkpoint '{path}'")
+    return [[start, stop, next_pos, None if best is None else tuple(best)]
+            for start, stop, next_pos, best in state['shards']]
+
+
+def apply_edit(data, pos, xor_val, width=1):
+    """Return a bytearray copy of data with ``width`` bytes at pos XORed."""
+    modified = bytearray(data)
+    value = int.from_bytes(modified[pos:pos + width], byteorder='big') ^ xor_val
+    modified[pos:pos + width] = value.to_bytes(width, byteorder='big')
+    return modified
+
+
+def edit_pieces(data, pos, xor_val, width=1):
+    """data with one edit applied, as (prefix, edited bytes, suffix) without copying data.
+
+    Writing the pieces in order produces apply_edit's result while only the
+    ``width`` edited bytes are ever copied.
+    """
+    return edits_pieces(data, [(pos, xor_val)], width)
+
+
+def edits_pieces(data, edits, width=1):
+    """edit_pieces for several non-overlapping ``(pos, xor_val)`` edits."""
+    view = memoryview(data).cast('B')
+    pieces = []
+    done = 0
+    for pos, xor_val in sorted(edits):
+        value = int.from_bytes(view[pos:pos + width], byteorder='big') ^ xor_val
+        pieces += [view[done:pos], value.to_bytes(width, byteorder='big')]
+        done = pos + width
+    pieces.append(view[done:])
+    return pieces
+
+
+def window_popcounts(data, width):
+    """Popcount of every ``width``-byte window of data, one byte per position.
+
+    Built block by block, so apart from the result only one block of
+    intermediate popcounts is held.
+    """
+    counts = bytearray()
+    last = len(data) - width + 1
+    for block_start, block_stop, bit_counts in _popcount_blocks(data, width, 0, last):
+        if width == 1:
+            counts += bit_counts
+        else:
+            size = block_stop - block_start
+            counts += bytes(map(sum, zip(*(bit_counts[j:j + size] for j in range(width)))))
+    return counts
+
+
+def _edit_options(value, width, ones, window_ones, total_bits):
+    """Best key for a window and its score: clear it or fill it, ties to the smaller key.
+
+    The imbalance of ``|zeros - ones|`` is largest at an extreme, so the
+    best edit of a window always turns it all zeros (key = the window value)
+    or all ones (key = its complement); no key has to be tried.
+    """
+    clear = (_imbalance(total_bits, ones - window_ones), value, -window_ones)
+    fill = (_imbalance(total_bits, ones - window_ones + 8 * width),
+            value ^ ((1 << (8 * width)) - 1), 8 * width - window_ones)
+    if clear[0] != fill[0]:
+        return max(clear, fill)
+    return min(clear, fill, key=lambda option: option[1])
+
+
+def best_windows(data, width, counts, ones, limit=1, taken=()):
+    """The ``limit`` best single edits given the current ``ones``, best first.
+
+    ``counts`` is window_popcounts(data, width). Windows overlapping a
+    position in ``taken`` are skipped. Each result is ``(score, pos,
+    xor_val, delta)`` where delta is the change in set bits; ties go to the
+    earlier position, exactly like the exhaustive search order.
+    """
+    total_bits = len(data) * 8
+    by_score = {}
+    for s in range(8 * width + 1):
+        score = max(_imbalance(total_bits, ones - s), _imbalance(total_bits, ones - s + 8 * width))
+        by_score.setdefault(score, []).append(s)
+    taken = sorted(taken)
+    found = []
+    for score in sorted(by_score, reverse=True):
+        pattern = _window_pattern(1, by_score[score])
+        for match in pattern.finditer(counts):
+            pos = match.start()
+            i = bisect_right(taken, pos)
+            if (i and pos - taken[i - 1] < width) or (i < len(taken) and taken[i] - pos < width):
+                continue
+            value = int.from_bytes(data[pos:pos + width], byteorder='big')
+            best_score, xor_val, delta = _edit_options(value, width, ones, counts[pos], total_bits)
+            found.append((best_score, pos, xor_val, delta))
+            if len(found) == limit:
+                return found
+    return found
+
+
+def search_edits(data, width, edits=1, beam=1, base_ones=None):
+    """Best set of up to ``edits`` non-overlapping ``width``-byte XOR edits.
+
+    Any window width works (1, 2, 4, 8, ...) because each window is scored
+    in closed form from its popcount. Several edits are chosen greedily
+    (``beam=1``) or by a beam search keeping the ``beam`` best partial sets;
+    an extra edit is only added when it strictly improves the score. For a
+    single edit of width 1 or 2 the result is exactly search_window's.
+    Returns ``(edits, score)`` with edits as ``(pos, xor_val)`` sorted by
+    position, or None when data has no window. The window popcounts are
+    reused for every edit and beam state, so they are kept: one byte per
+    position besides the input. ``base_ones`` is popcount(data) when the
+    caller already has it.
+    """
+    if width <= 0 or edits <= 0 or beam <= 0:
+        raise ValueError("width, edits and beam must be positive")
+    counts = window_popcounts(data, width)
+    if not counts:
+        return None
+    total_bits = len(data) * 8
+    if base_ones is None:
+        base_ones = popcount(data)
+    # States: (score, chosen (pos, xor_val) edits, ones)
+    states = [(None, (), base_ones)]
+    for _ in range(edits):
+        expanded = {}
+        any_grown = False
+        for score, chosen, ones in states:
+            taken = [pos for pos, _ in chosen]
+            grown = False
+            count('candidates', len(counts))
+            for new_score, pos, xor_val, delta in best_windows(data, width, counts, ones,
+                                                                beam, taken):
+                if score is not None and new_score <= score:
+                    break
+                edits_set = tuple(sorted(chosen + ((pos, xor_val),)))
+                expanded.setdefault(edits_set, (new_score, edits_set, ones + delta))
+                grown = True
+            if grown:
+                any_grown = True
+            else:
+                expanded.setdefault(chosen, (score, chosen, ones))
+        if not any_grown:
+            break
+        states = sorted(expanded.values(), key=lambda state: (-state[0], state[1]))[:beam]
+    score, chosen, _ = states[0]
+    return list(chosen), score
+
+
+def apply_edits(data, edits, width=1):
+    """Return a bytearray copy of data with every ``(pos, xor_val)`` edit applied."""
+    return bytearray(b''.join(edits_pieces(data, edits, width)))
+
+
+def top_candidates(data, width, k, base_ones=None):
+    """Return the ``k`` best XOR edits of a ``width``-byte window.
+
+    Candidates are ranked by imbalance score, ties broken by visiting order
+    (position, then xor value), so the first entry is what search_window
+    returns. Only small ``(pos, xor_val, score)`` tuples are kept, in a
+    bounded heap, and positions that cannot beat the current k-th best are
+    skipped the same way search_window skips them. ``base_ones`` is
+    popcount(data) when the caller already has it.
+    """
+    if width not in (1, 2):
+        raise ValueError("width must be 1 or 2")
+    total_bytes = len(data)
+    stop = total_bytes - width + 1
+    if k <= 0 or stop <= 0:
+        return []
+    table = POPCOUNT if width == 1 else POPCOUNT16
+    total_bits = total_bytes * 8
+    if base_ones is None:
+        base_ones = popcount(data)
+    max_score = [max(_imbalance(total_bits, base_ones - s),
+                     _imbalance(total_bits, base_ones - s + 8 * width))
+                 for s in range(8 * width + 1)]
+
+    # Heap entries sort worst-first: lower score, then later position/xor
+    heap = []
+    pos = 0
+    for block_start, block_stop, bit_counts in _popcount_blocks(data, width, 0, stop):
+        while pos < block_stop:
+            threshold = heap[0][0] if len(heap) == k else -1
+            good_sums = [s for s, score in enumerate(max_score) if score > threshold]
+            if not good_sums:
+                break
+            match = _window_pattern(width, good_sums).search(
+                bit_counts, pos - block_start, block_stop - block_start + width - 1)
+            if match is None:
+                break
+            pos = block_start + match.start()
+            value = int.from_bytes(data[pos:pos + width], byteorder='big')
+            others = base_ones - table[value]
+            count('candidates', 1 << (8 * width))
+            for xor_val in range(1 << (8 * width)):
+                score = _imbalance(total_bits, others + table[value ^ xor_val])
+                entry = (score, -pos, -xor_val)
+                if len(heap) < k:
+                    heapq.heappush(heap, entry)
+                elif entry > heap[0]:
+                    heapq.heapreplace(heap, entry)
+            pos += 1
+        pos = block_stop
+    return [(-neg_pos, -neg_xor, score)
+            for score, neg_pos, neg_xor in sorted(heap, reverse=True)]
@@ -0,0 +1,74 @@
+"""Lazy discovery of variation folders and their files with os.scandir.
+
+The generators yield as they go, so decoding can start on the first folder
+while the rest of a large tree is still unexplored, and they use the type
+information cached in each DirEntry instead of an extra stat per entry.
+
+Without options the folders come out in exactly the order
+``os.walk(search_root)`` would report them: every match among a
+directory's children first, then the walk descends into those children.
+Like os.walk, symlinked directories are reported but never entered, and
+unreadable directories are skipped.
+"""
+
+import fnmatch
+import os
+
+VARIATION_SUFFIXES = ('_variations', '_xor_variations')
+# Checksum sidecar kept in variation folders by verify.py; never a variation
+CHECKSUM_FILE = '.anomaly_checksums.json'
+
+
+def _subdirs(path):
+    try:
+        with os.scandir(path) as it:
+            return [entry for entry in it if _is_dir(entry)]
+    except OSError:
+        return []
+
+
+def _is_dir(entry):
+    try:
+        return entry.is_dir()
+    except OSError:
+        return False
+
+
+def iter_variation_folders(search_root, max_depth=None, exclude=(), descend_matched=True,
+                           suffixes=VARIATION_SUFFIXES):
+    """Yield the paths of variation folders under search_root, lazily.
+
+    ``max_depth`` limits how deep folders are looked for (1 = children of
+    search_root only). Directories whose name matches one of the
+    ``exclude`` glob patterns are neither reported nor entered. With
+    ``descend_matched=False`` the search does not look inside the
+    variation folders it reports.
+    """
+    pending = [(search_root, 1)]
+    while pending:
+        path, depth = pending.pop()
+        children = []
+        for entry in _subdirs(path):
+            if any(fnmatch.fnmatch(entry.name, pattern) for pattern in exclude):
+                continue
+            matched = entry.name.endswith(suffixes)
+            if matched:
+                yield entry.path
+            if entry.is_symlink() or (matched and not descend_matched):
+                continue
+            if max_depth is None or depth < max_depth:
+                children.append((entry.path, depth + 1))
+        pending.extend(reversed(children))
+
+
+def iter_files(folder):
+    """Yield the paths of the variation files (regular files or links to them) in folder."""
+    with os.scandir(folder) as it:
+        for entry in it:
+            if entry.name == CHECKSUM_FILE:
+                continue
+            try:
+                if entry.is_file():
+                    yield entry.path
+            except OSError:
+                continue
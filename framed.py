@@ -0,0 +1,163 @@
+"""Framed, block-parallel compression with random-access extraction.
+
+A plain pack() payload is one compressed stream: it is compressed on one
+core and any byte of it needs the whole stream decompressed. A framed file
+splits the data into independent frames of ``frame_size`` bytes, each
+compressed on its own (on a process pool with ``workers > 1``), and
+records where every frame starts. Extraction can then decompress frames in
+parallel, or only the frames covering a byte range. Smaller frames give
+more parallelism and finer random access at some cost in ratio. Layout
+(little-endian):
+
+    header   magic 'ANMF', version, backend id, level byte, frame size,
+             original length, frame count
+    index    per frame: payload offset, compressed length, CRC-32 of the
+             uncompressed frame
+    frames   the compressed frames, in order
+
+The frame count follows from the length, so the index space is reserved
+up front and filled in once the frames are written.
+"""
+
+import os
+import struct
+import zlib
+
+from compressors import DEFAULT_LEVEL, backend_by_id, get_backend
+from parallel import ordered_map
+
+MAGIC = b'ANMF'
+VERSION = 1
+DEFAULT_FRAME_SIZE = 1 << 20
+_HEADER = struct.Struct('<4sBBBIQI')
+_FRAME = struct.Struct('<QII')
+
+
+def is_framed(path):
+    """True when path starts with the framed magic."""
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def _frames(pieces, frame_size):
+    """Re-block the concatenation of pieces into frame_size-byte frames."""
+    pending = bytearray()
+    for piece in pieces:
+        view = memoryview(piece)
+        while len(view):
+            take = frame_size - len(pending)
+            pending += view[:take]
+            view = view[take:]
+            if len(pending) == frame_size:
+                yield bytes(pending)
+                pending.clear()
+    if pending:
+        yield bytes(pending)
+
+
+def _compress_frame(job):
+    backend_name, level, data = job
+    return get_backend(backend_name).compress(data, level), zlib.crc32(data)
+
+
+def pack_framed_to_file(f, pieces, backend_name, level=None, frame_size=DEFAULT_FRAME_SIZE,
+                        workers=1, max_pending=None):
+    """Write the concatenation of pieces to the seekable file f as framed frames.
+
+    Frames are compressed in order on up to ``workers`` processes with at
+    most ``max_pending`` frames in flight. Returns the number of bytes
+    written.
+    """
+    if frame_size <= 0:
+        raise ValueError("frame_size must be positive")
+    pieces = list(pieces)
+    length = sum(len(piece) for piece in pieces)
+    count = -(-length // frame_size)
+    backend = get_backend(backend_name)
+    level_byte = DEFAULT_LEVEL if level is None else level
+    start = f.tell()
+    f.write(_HEADER.pack(MAGIC, VERSION, backend.backend_id, level_byte, frame_size, length,
+                         count))
+    index_pos = f.tell()
+    f.write(bytes(_FRAME.size * count))
+    offset = index_pos + _FRAME.size * count - start
+    index = []
+    jobs = ((backend_name, level, frame) for frame in _frames(pieces, frame_size))
+    for compressed, crc in ordered_map(_compress_frame, jobs, workers, max_pending):
+        index.append(_FRAME.pack(offset, len(compressed), crc))
+        offset += f.write(compressed)
+    end = f.tell()
+    f.seek(index_pos)
+    f.write(b''.join(index))
+    f.seek(end)
+    return end - start
+
+
+def read_index(path):
+    """Read a framed file's header and frame index."""
+    with open(path, 'rb') as f:
+        fixed = f.read(_HEADER.size)
+        if len(fixed) < _HEADER.size or not fixed.startswith(MAGIC):
+            raise ValueError(f"'{path}' is not a framed file")
+        _, version, backend_id, level, frame_size, length, count = _HEADER.unpack(fixed)
+        if version != VERSION:
+            raise ValueError(f"Unsupported framed file version {version}")
+        raw = f.read(_FRAME.size * count)
+    if len(raw) < _FRAME.size * count:
+        raise ValueError(f"'{path}' is truncated")
+    return {'backend': backend_by_id(backend_id).name,
+            'level': None if level == DEFAULT_LEVEL else level,
+            'frame_size': frame_size, 'length': length,
+            'frames': [_FRAME.unpack_from(raw, i * _FRAME.size) for i in range(count)]}
+
+
+def _decompress_frame(job):
+    path, backend_name, number, (offset, size, crc) = job
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        compressed = os.pread(fd, size, offset)
+    finally:
+        os.close(fd)
+    data = get_backend(backend_name).decompress(compressed)
+    if zlib.crc32(data) != crc:
+        raise ValueError(f"'{path}' frame {number} failed its CRC check")
+    return data
+
+
+def iter_frames(path, first=0, last=None, workers=1, header=None):
+    """Yield the decompressed frames ``first..last`` (inclusive) in order."""
+    header = header or read_index(path)
+    frames = header['frames']
+    last = len(frames) - 1 if last is None else last
+    jobs = ((path, header['backend'], number, frames[number])
+            for number in range(first, last + 1))
+    return ordered_map(_decompress_frame, jobs, workers)
+
+
+def unpack_to_file(path, out_path, workers=1):
+    """Decompress a whole framed file into out_path; return the bytes written."""
+    header = read_index(path)
+    written = 0
+    with open(out_path, 'wb') as out:
+        for data in iter_frames(path, workers=workers, header=header):
+            written += out.write(data)
+    if written != header['length']:
+        raise ValueError(f"'{path}' decoded to {written} bytes, expected {header['length']}")
+    return written
+
+
+def read_range(path, start, length, workers=1):
+    """Return ``length`` bytes from offset ``start``, decompressing only their frames."""
+    header = read_index(path)
+    start = max(0, start)
+    stop = min(header['length'], start + max(0, length))
+    if start >= stop:
+        return b''
+    frame_size = header['frame_size']
+    first = start // frame_size
+    data = b''.join(iter_frames(path, first, (stop - 1) // frame_size, workers, header))
+    offset = start - first * frame_size
+    return data[offset:offset + stop - start]
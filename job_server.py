@@ -0,0 +1,413 @@
+"""Local job server: a warm worker pool behind a Unix domain socket.
+
+Starting Python and importing the tools for every file is a large share
+of a short job. The server keeps ``workers`` processes alive with the
+tools already imported and runs jobs from other local processes on them.
+A job is any cli.py command with its options, as in a run-manifest line
+(``{"command": "encode", "input": "a.jpg", "output_dir": "out"}``).
+
+Jobs wait in a priority queue (higher ``priority`` first, then in
+submission order) and start when a worker is free and the command is
+under its concurrency limit. Everything a job prints is streamed back to
+the submitting client line by line. A queued job is cancelled by removing
+it; a running one by terminating its worker, which is replaced with a
+fresh one.
+
+The protocol is one JSON request line per connection, answered by JSON
+lines: ``submit`` (with ``stream`` the job's events follow until it ends),
+``status``, ``jobs``, ``cancel`` and ``shutdown``.
+"""
+
+import contextlib
+import heapq
+import importlib
+import itertools
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import socketserver
+import tempfile
+import threading
+import time
+from multiprocessing.connection import wait
+
+# Modules imported by every worker before it takes its first job
+_WARM_MODULES = ('cli', 'Anomaly_1', 'variation_search', 'delta_search', 'scorers',
+                 'container', 'framed', 'compressors', 'verify')
+# Events kept per job for clients that attach late; older ones are dropped
+MAX_EVENTS = 1000
+# Finished jobs kept for status queries; the oldest are forgotten first
+MAX_FINISHED = 1000
+_FINAL = ('done', 'failed', 'cancelled')
+
+
+def default_socket_path():
+    """Socket path from ANOMALY_SOCKET, or a per-user path in the temp directory."""
+    return os.environ.get('ANOMALY_SOCKET') or os.path.join(
+        tempfile.gettempdir(), f"anomaly-{os.getuid()}.sock")
+
+
+class _EventWriter:
+    """stdout replacement in a worker: sends every printed line as an event."""
+
+    def __init__(self, conn, job_id):
+        self._conn = conn
+        self._job_id = job_id
+        self._partial = ''
+
+    def write(self, text):
+        lines = (self._partial + text).split('\n')
+        self._partial = lines.pop()
+        for line in lines:
+            self._conn.send((self._job_id, 'output', {'line': line}))
+        return len(text)
+
+    def flush(self):
+        if self._partial:
+            self._conn.send((self._job_id, 'output', {'line': self._partial}))
+            self._partial = ''
+
+
+def _worker_main(conn):
+    # Own process group, so cancelling a job also stops the pools it started
+    os.setpgid(0, 0)
+    for name in _WARM_MODULES:
+        importlib.import_module(name)
+    import cli
+    from metrics import METRICS
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        job_id, command, opts, cwd = message
+        writer = _EventWriter(conn, job_id)
+        METRICS.reset()
+        start = time.perf_counter()
+        try:
+            if cwd:
+                os.chdir(cwd)
+            with contextlib.redirect_stdout(writer):
+                result = cli.run_command(command, opts)
+            writer.flush()
+            conn.send((job_id, 'done', {'result': json.loads(json.dumps(result, default=str)),
+                                        'seconds': round(time.perf_counter() - start, 6),
+                                        'metrics': METRICS.to_dict()}))
+        except Exception as e:
+            writer.flush()
+            fields = {'error': f"{type(e).__name__}: {e}",
+                      'seconds': round(time.perf_counter() - start, 6)}
+            if getattr(e, 'result', None) is not None:
+                fields['result'] = json.loads(json.dumps(e.result, default=str))
+            conn.send((job_id, 'failed', fields))
+
+
+class _Worker:
+    def __init__(self, context, number):
+        self.number = number
+        self.conn, child = context.Pipe()
+        # Not daemonic, so jobs can start their own process pools (--workers);
+        # a worker still exits when the server dies, as its pipe reads EOF
+        self.process = context.Process(target=_worker_main, args=(child,),
+                                       name=f"anomaly-worker-{number}")
+        self.process.start()
+        child.close()
+        self.job = None
+
+    def stop(self, terminate=False):
+        if terminate:
+            with contextlib.suppress(ProcessLookupError):
+                os.killpg(self.process.pid, signal.SIGTERM)
+        else:
+            with contextlib.suppress(OSError):
+                self.conn.send(None)
+        self.process.join(5)
+        if self.process.is_alive():
+            with contextlib.suppress(ProcessLookupError):
+                os.killpg(self.process.pid, signal.SIGKILL)
+            self.process.join()
+        self.conn.close()
+
+
+class JobServer:
+    """Priority job queue and warm worker pool (see the module docstring).
+
+    ``limits`` maps command names to the most jobs of that command allowed
+    to run at once, e.g. ``{'search2': 1}`` for a command that uses every
+    core itself.
+    """
+
+    def __init__(self, socket_path=None, workers=None, limits=None):
+        self.socket_path = socket_path or default_socket_path()
+        self.workers = workers or os.cpu_count() or 1
+        self.limits = dict(limits or {})
+        self._context = multiprocessing.get_context('spawn')
+        self._cond = threading.Condition()
+        self._jobs = {}
+        self._queue = []
+        self._ids = itertools.count(1)
+        self._pool = []
+        self._wake_recv, self._wake_send = self._context.Pipe(duplex=False)
+        self._stopping = False
+        self._server = None
+
+    # Job bookkeeping (callers hold self._cond)
+
+    def _event(self, job, event, **fields):
+        job['events'].append(dict({'job': job['id'], 'event': event}, **fields))
+        if len(job['events']) > MAX_EVENTS:
+            drop = len(job['events']) - MAX_EVENTS // 2
+            del job['events'][:drop]
+            job['dropped'] += drop
+        if event in _FINAL:
+            job['state'] = event
+            job['finished'] = time.time()
+            finished = [job_id for job_id, other in self._jobs.items() if other['state'] in _FINAL]
+            for job_id in finished[:-MAX_FINISHED]:
+                del self._jobs[job_id]
+        self._cond.notify_all()
+
+    def _wake(self):
+        with contextlib.suppress(OSError):
+            self._wake_send.send(None)
+
+    @staticmethod
+    def summary(job):
+        return {key: job[key] for key in ('id', 'command', 'priority', 'state', 'submitted',
+                                          'started', 'finished', 'result', 'error')}
+
+    def submit(self, values, priority=0, cwd=None):
+        """Queue a job (a manifest-style dict with a 'command') and return its id.
+
+        Relative paths in the options resolve against ``cwd`` (default: the
+        server's working directory).
+        """
+        from cli import _options
+        values = dict(values)
+        command = values.pop('command', None)
+        opts = _options(command, values)
+        with self._cond:
+            if self._stopping:
+                raise RuntimeError("Server is shutting down")
+            job_id = next(self._ids)
+            self._jobs[job_id] = {'id': job_id, 'command': command, 'opts': opts, 'cwd': cwd,
+                                  'priority': priority, 'state': 'queued',
+                                  'submitted': time.time(), 'started': None, 'finished': None,
+                                  'result': None, 'error': None, 'events': [], 'dropped': 0,
+                                  'cancel': False}
+            heapq.heappush(self._queue, (-priority, job_id))
+            self._event(self._jobs[job_id], 'queued', priority=priority)
+        self._wake()
+        return job_id
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job; False when it already ended or is unknown."""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job['state'] in _FINAL:
+                return False
+            if job['state'] == 'queued':
+                self._queue.remove((-job['priority'], job_id))
+                heapq.heapify(self._queue)
+                self._event(job, 'cancelled')
+                return True
+            job['cancel'] = True
+        self._wake()
+        return True
+
+    # The scheduler thread owns the workers
+
+    def _running(self, command):
+        return sum(1 for worker in self._pool
+                   if worker.job is not None and worker.job['command'] == command)
+
+    def _dispatch(self):
+        for worker in self._pool:
+            if worker.job is not None:
+                continue
+            for entry in sorted(self._queue):
+                job = self._jobs[entry[1]]
+                limit = self.limits.get(job['command'])
+                if limit is not None and self._running(job['command']) >= limit:
+                    continue
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                worker.job = job
+                job['state'] = 'running'
+                job['started'] = time.time()
+                self._event(job, 'started', worker=worker.number)
+                worker.conn.send((job['id'], job['command'], job['opts'], job['cwd']))
+                break
+
+    def _replace(self, worker):
+        index = self._pool.index(worker)
+        self._pool[index] = _Worker(self._context, worker.number)
+
+    def _handle(self, worker):
+        try:
+            job_id, event, fields = worker.conn.recv()
+        except (EOFError, OSError):
+            return
+        job = self._jobs.get(job_id)
+        if job is None or job['state'] in _FINAL:
+            return
+        if event in _FINAL:
+            job['result'] = fields.get('result')
+            job['error'] = fields.get('error')
+            worker.job = None
+        self._event(job, event, **fields)
+
+    def _schedule(self):
+        while True:
+            conns = [worker.conn for worker in self._pool] + [self._wake_recv]
+            ready = wait(conns, timeout=1.0)
+            with self._cond:
+                if self._wake_recv in ready:
+                    while self._wake_recv.poll():
+                        self._wake_recv.recv()
+                for worker in list(self._pool):
+                    if worker.conn in ready:
+                        self._handle(worker)
+                    job = worker.job
+                    if job is not None and job['cancel']:
+                        worker.stop(terminate=True)
+                        self._event(job, 'cancelled')
+                        self._replace(worker)
+                    elif not worker.process.is_alive():
+                        if job is not None:
+                            job['error'] = f"worker exited with code {worker.process.exitcode}"
+                            self._event(job, 'failed', error=job['error'])
+                        worker.stop()
+                        self._replace(worker)
+                if self._stopping:
+                    break
+                self._dispatch()
+        for worker in self._pool:
+            worker.stop(terminate=worker.job is not None)
+
+    # Client connections
+
+    def _stream(self, wfile, job_id):
+        position = 0
+        with self._cond:
+            job = self._jobs[job_id]
+            while True:
+                position = max(position, job['dropped'])
+                events = job['events'][position - job['dropped']:]
+                position += len(events)
+                if events:
+                    self._cond.release()
+                    try:
+                        for event in events:
+                            wfile.write((json.dumps(event) + "\n").encode())
+                        wfile.flush()
+                    finally:
+                        self._cond.acquire()
+                    continue
+                if job['state'] in _FINAL:
+                    return
+                self._cond.wait()
+
+    def _respond(self, request, wfile):
+        op = request.get('op')
+        if op == 'submit':
+            job_id = self.submit(request.get('job') or {}, request.get('priority', 0),
+                                 request.get('cwd'))
+            if request.get('stream', True):
+                self._stream(wfile, job_id)
+                return None
+            return {'job': job_id, 'event': 'queued'}
+        if op == 'status':
+            with self._cond:
+                job = self._jobs.get(request.get('job'))
+                return self.summary(job) if job else {'error': "Unknown job"}
+        if op == 'jobs':
+            with self._cond:
+                return {'jobs': [self.summary(job) for job in self._jobs.values()]}
+        if op == 'cancel':
+            return {'job': request.get('job'), 'cancelled': self.cancel(request.get('job'))}
+        if op == 'shutdown':
+            threading.Thread(target=self.shutdown, daemon=True).start()
+            return {'shutdown': True}
+        return {'error': f"Unknown op '{op}'"}
+
+    def _handler(self):
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                try:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    response = server._respond(json.loads(line), self.wfile)
+                except (ValueError, RuntimeError, KeyError) as e:
+                    response = {'error': f"{type(e).__name__}: {e}"}
+                except (BrokenPipeError, ConnectionResetError):
+                    return
+                if response is not None:
+                    self.wfile.write((json.dumps(response, default=str) + "\n").encode())
+
+        return Handler
+
+    def serve_forever(self):
+        """Start the workers, listen on the socket and serve until shutdown()."""
+        if os.path.exists(self.socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+                raise RuntimeError(f"A server is already listening on {self.socket_path}")
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.remove(self.socket_path)
+            finally:
+                probe.close()
+        self._pool = [_Worker(self._context, number) for number in range(self.workers)]
+        scheduler = threading.Thread(target=self._schedule, name='anomaly-scheduler')
+        scheduler.start()
+        old_umask = os.umask(0o077)
+        try:
+            self._server = socketserver.ThreadingUnixStreamServer(self.socket_path,
+                                                                  self._handler())
+        finally:
+            os.umask(old_umask)
+        self._server.daemon_threads = True
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=self.shutdown).start())
+        print(f"Serving {self.workers} workers on {self.socket_path}")
+        try:
+            self._server.serve_forever()
+        finally:
+            with self._cond:
+                self._stopping = True
+            self._wake()
+            scheduler.join()
+            self._server.server_close()
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self.socket_path)
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+
+
+def request(message, socket_path=None):
+    """Send one request to a running server and yield its response lines as dicts."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path or default_socket_path())
+        sock.sendall((json.dumps(message) + "\n").encode())
+        with sock.makefile('rb') as responses:
+            for line in responses:
+                yield json.loads(line)
+
+
+def submit(job, priority=0, stream=True, socket_path=None):
+    """Submit a job; yields its events (or just the 'queued' reply without ``stream``).
+
+    Relative paths in the job resolve against the caller's working directory.
+    """
+    return request({'op': 'submit', 'job': job, 'priority': priority, 'stream': stream,
+                    'cwd': os.getcwd()}, socket_path)
@@ -0,0 +1,198 @@
+"""Counters, stage timers and progress reporting for the Anomaly tools.
+
+The hot paths add to the process-wide registry ``METRICS`` (bytes read
+and written, candidates evaluated, files processed) and time their stages
+with ``METRICS.stage(name)``; both cost a dict update, never terminal I/O.
+Progress lines go through a Throttle, which prints at most one line per
+interval and always the last one, so a search that improves thousands of
+times no longer spends its time printing. The registry exports as JSON or
+Prometheus text, and profiled() wraps a single run in cProfile and/or
+tracemalloc.
+"""
+
+import contextlib
+import json
+import time
+
+# Seconds between throttled progress lines (0 prints every line); read
+# whenever a Throttle is made without an explicit interval
+PROGRESS_INTERVAL = 0.5
+
+_HELP = {
+    'bytes_read': "Bytes read from input files",
+    'bytes_written': "Bytes written to output files",
+    'bytes_deduplicated': "Decoded bytes not written because an identical output existed",
+    'candidates': "XOR edit candidates evaluated",
+    'files': "Files processed",
+    'files_deduplicated': "Decoded files that repeated an earlier output",
+    'files_failed': "Files that failed to process",
+}
+
+
+class Metrics:
+    """Named counters, gauges and per-stage wall-clock timers."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.counters = {}
+        self.gauges = {}
+        self.stages = {}
+        self.started = time.perf_counter()
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def value(self, name):
+        return self.counters.get(name, 0)
+
+    def gauge(self, name, value):
+        self.gauges[name] = value
+
+    def add_time(self, name, seconds, calls=1):
+        total, count = self.stages.get(name, (0.0, 0))
+        self.stages[name] = (total + seconds, count + calls)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Add the time spent in the with-block to stage ``name``."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def to_dict(self):
+        elapsed = time.perf_counter() - self.started
+        stages = {name: {'seconds': round(total, 6), 'calls': calls}
+                  for name, (total, calls) in sorted(self.stages.items())}
+        result = {'elapsed': round(elapsed, 6), 'counters': dict(sorted(self.counters.items())),
+                  'gauges': dict(sorted(self.gauges.items())), 'stages': stages}
+        if elapsed > 0:
+            moved = self.value('bytes_read') + self.value('bytes_written')
+            result['bytes_per_sec'] = moved / elapsed
+        return result
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_prometheus(self, prefix='anomaly'):
+        """Render the registry in the Prometheus text exposition format."""
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{prefix}_{name}{labels} {value}")
+
+        for name, value in sorted(self.counters.items()):
+            metric(f"{name}_total", 'counter', _HELP.get(name, name.replace('_', ' ')),
+                   [('', value)])
+        for name, value in sorted(self.gauges.items()):
+            metric(name, 'gauge', name.replace('_', ' '), [('', value)])
+        if self.stages:
+            ordered = sorted(self.stages.items())
+            metric('stage_seconds_total', 'counter', "Wall-clock seconds spent per stage",
+                   [(f'{{stage="{name}"}}', f"{total:.6f}") for name, (total, _) in ordered])
+            metric('stage_calls_total', 'counter', "Times each stage ran",
+                   [(f'{{stage="{name}"}}', calls) for name, (_, calls) in ordered])
+        metric('elapsed_seconds', 'gauge', "Seconds since the registry was reset",
+               [('', f"{time.perf_counter() - self.started:.6f}")])
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+
+
+def count(name, amount=1):
+    """Add to a counter of the process-wide registry."""
+    METRICS.count(name, amount)
+
+
+def stage(name):
+    """Time a with-block as stage ``name`` of the process-wide registry."""
+    return METRICS.stage(name)
+
+
+def write_metrics(path, fmt='json', metrics=None):
+    """Write a registry (default: METRICS) to path as 'json' or 'prometheus'."""
+    metrics = METRICS if metrics is None else metrics
+    if fmt not in ('json', 'prometheus'):
+        raise ValueError(f"Unknown metrics format '{fmt}' (choose json or prometheus)")
+    text = metrics.to_json() + "\n" if fmt == 'json' else metrics.to_prometheus()
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+class Throttle:
+    """Forward calls to func at most once per ``interval`` seconds.
+
+    The first call always goes through; later calls inside the interval
+    only remember their arguments, and flush() delivers the last of those,
+    so the final state is never lost. ``interval=0`` forwards every call.
+    """
+
+    def __init__(self, func, interval=None):
+        self.func = func
+        self.interval = PROGRESS_INTERVAL if interval is None else interval
+        self._next = None
+        self._pending = None
+
+    def __call__(self, *args):
+        now = time.monotonic()
+        if self._next is None or now >= self._next:
+            self._pending = None
+            self._next = now + self.interval
+            self.func(*args)
+        else:
+            self._pending = args
+
+    def flush(self):
+        if self._pending is not None:
+            args, self._pending = self._pending, None
+            self.func(*args)
+
+
+def progress_reporter(progress, default, interval=None):
+    """Return the callback for a ``progress`` argument.
+
+    A callable ``progress`` receives every event unthrottled; None uses
+    ``default`` (normally a print) through a Throttle of ``interval``
+    seconds (default PROGRESS_INTERVAL). Call ``.flush()`` on the result
+    when the run ends.
+    """
+    if progress is None:
+        return Throttle(default, interval)
+    return Throttle(progress, 0)
+
+
+@contextlib.contextmanager
+def profiled(profile_path=None, trace_memory=False, metrics=None):
+    """Profile the with-block with cProfile and/or tracemalloc.
+
+    With ``profile_path`` the cProfile statistics are dumped there (read
+    them with ``pstats``); with ``trace_memory`` the peak traced allocation
+    is recorded as the ``peak_traced_bytes`` gauge. Both slow the run down,
+    so they are meant for a single diagnostic run.
+    """
+    metrics = METRICS if metrics is None else metrics
+    profiler = None
+    if profile_path:
+        import cProfile
+        profiler = cProfile.Profile()
+    if trace_memory:
+        import tracemalloc
+        tracemalloc.start()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield metrics
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+        if trace_memory:
+            metrics.gauge('peak_traced_bytes', tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
@@ -0,0 +1,29 @@
+"""Bounded, order-preserving process-pool helpers."""
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+
+def ordered_map(func, items, workers=1, max_pending=None):
+    """Yield ``func(item)`` for every item, in input order.
+
+    With ``workers > 1`` the calls run on a process pool. At most
+    ``max_pending`` calls (default ``4 * workers``) are in flight at any
+    time, so items are pulled from the iterable lazily and a slow consumer
+    throttles submission instead of queueing the whole input. ``func`` must
+    be a module-level function so that it can be pickled.
+    """
+    if not workers or workers <= 1:
+        for item in items:
+            yield func(item)
+        return
+
+    max_pending = max(1, max_pending or workers * 4)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(func, item))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
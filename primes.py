@@ -0,0 +1,138 @@
+"""Prime tests and nearest-prime search for file size reporting.
+
+``is_prime`` is a deterministic Miller-Rabin test (exact for every 64-bit
+value and far beyond). ``nearest_prime`` scans a window around n with a
+segmented sieve: small windows are sieved by a fixed table of base primes
+and only the survivors go through Miller-Rabin, so a multi-GB half-size
+costs a few dozen modular exponentiations instead of trial division.
+
+Both are memoised. ``nearest_prime`` keeps the tie rule of the original
+Anomaly_6 search: at each offset ``n - offset`` is tried before
+``n + offset``, and anything below 2 resolves to 2.
+"""
+
+import fnmatch
+import os
+from functools import lru_cache
+from math import isqrt
+
+# Base primes used to pre-sieve a window; windows whose upper end is below
+# SIEVE_LIMIT ** 2 are sieved exactly and need no Miller-Rabin at all.
+SIEVE_LIMIT = 1 << 12
+INITIAL_RADIUS = 64
+
+# First 12 primes: deterministic for n < 3.3 * 10**24, which covers 64 bits
+_MR_BASES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37)
+
+
+@lru_cache(maxsize=None)
+def _base_primes(limit):
+    """Primes up to and including limit (plain sieve of Eratosthenes)."""
+    flags = bytearray(b'\x01') * (limit + 1)
+    flags[:2] = b'\x00\x00'
+    for p in range(2, isqrt(limit) + 1):
+        if flags[p]:
+            flags[p * p::p] = bytes(len(range(p * p, limit + 1, p)))
+    return tuple(p for p in range(limit + 1) if flags[p])
+
+
+@lru_cache(maxsize=65536)
+def is_prime(n):
+    """Deterministic Miller-Rabin primality test."""
+    if n < 2:
+        return False
+    for p in _MR_BASES:
+        if n % p == 0:
+            return n == p
+    d = n - 1
+    s = 0
+    while d % 2 == 0:
+        d //= 2
+        s += 1
+    for a in _MR_BASES:
+        x = pow(a, d, n)
+        if x == 1 or x == n - 1:
+            continue
+        for _ in range(s - 1):
+            x = x * x % n
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+
+def sieve_window(lo, hi):
+    """Segmented sieve of [lo, hi): return (flags, exact).
+
+    ``flags[i]`` is 0 when ``lo + i`` is certainly composite (or below 2).
+    When ``exact`` is True every set flag is a prime; otherwise set flags
+    are only candidates with no small factor.
+    """
+    lo = max(lo, 0)
+    size = max(hi - lo, 0)
+    flags = bytearray(b'\x01') * size
+    for i in range(min(size, max(0, 2 - lo))):
+        flags[i] = 0
+    root = isqrt(hi - 1) if hi > 1 else 0
+    limit = min(root, SIEVE_LIMIT)
+    for p in _base_primes(limit):
+        start = max(p * p, -(-lo // p) * p)
+        if start >= hi:
+            continue
+        flags[start - lo::p] = bytes(len(range(start - lo, size, p)))
+    return flags, root <= SIEVE_LIMIT
+
+
+def primes_between(lo, hi):
+    """List the primes in [lo, hi)."""
+    flags, exact = sieve_window(lo, hi)
+    lo = max(lo, 0)
+    return [lo + i for i, flag in enumerate(flags)
+            if flag and (exact or is_prime(lo + i))]
+
+
+@lru_cache(maxsize=4096)
+def nearest_prime(n):
+    """Closest prime to n; at equal distance the smaller one (n - offset) wins."""
+    if n < 2:
+        return 2
+    radius = INITIAL_RADIUS
+    checked = -1
+    while True:
+        lo = max(n - radius, 0)
+        flags, exact = sieve_window(lo, n + radius + 1)
+
+        def prime_at(m):
+            return m >= lo and flags[m - lo] and (exact or is_prime(m))
+
+        for offset in range(checked + 1, radius + 1):
+            if prime_at(n - offset):
+                return n - offset
+            if prime_at(n + offset):
+                return n + offset
+        checked = radius
+        radius *= 2
+
+
+def nearest_primes(values):
+    """Batch nearest_prime: return {n: nearest prime} for an iterable of ints."""
+    return {n: nearest_prime(n) for n in sorted(set(values))}
+
+
+def half_size_report(paths):
+    """Size, half size and the prime nearest that half for each file."""
+    rows = []
+    for path in paths:
+        size = os.path.getsize(path)
+        rows.append({'path': path, 'size': size, 'half_size': size // 2})
+    primes = nearest_primes(row['half_size'] for row in rows)
+    for row in rows:
+        row['nearest_prime'] = primes[row['half_size']]
+    return rows
+
+
+def enc_files(directory, pattern='*.enc'):
+    """Sorted paths of the files in directory matching pattern."""
+    return sorted(entry.path for entry in os.scandir(directory)
+                  if entry.is_file() and fnmatch.fnmatch(entry.name, pattern))
@@ -0,0 +1,182 @@
+"""Content-addressed on-disk cache of variation search results.
+
+Searches store only their small winning descriptors (xor keys, positions,
+scores) keyed by the SHA-256 of the input plus the search type and its
+parameters, so a repeat run on the same input skips straight to the final
+transform and write.
+
+Entries are JSON files written to a temporary name and moved into place
+with ``os.replace``, so concurrent processes never see a partial entry.
+Reads refresh an entry's mtime and eviction removes the least recently
+used entries once the cache grows past its size cap.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+DEFAULT_MAX_BYTES = 64 << 20
+
+
+def default_cache_dir():
+    return os.environ.get('ANOMALY_CACHE_DIR') or \
+        os.path.join(os.path.expanduser('~'), '.cache', 'anomaly')
+
+
+def content_hash(data=None, path=None, block_size=1 << 20):
+    """SHA-256 hex digest of a buffer or, streamed, of a file."""
+    digest = hashlib.sha256()
+    if path is None:
+        digest.update(data)
+    else:
+        with open(path, 'rb') as f:
+            while True:
+                block = f.read(block_size)
+                if not block:
+                    break
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def atomic_write_json(path, value):
+    """Write value as JSON to a temporary file beside path, then rename it over path."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(value, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _size_or_zero(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+class ResultCache:
+    """LRU-evicted directory of JSON search results."""
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory or default_cache_dir()
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Running size of the cache, counted by one walk on the first put
+        self._bytes = None
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(digest, search, **params):
+        """Cache key for a content digest, search type and search parameters."""
+        material = json.dumps([digest, search, sorted(params.items())], default=str)
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.json')
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss."""
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                value = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Atomically store a JSON-serialisable value, evicting once over the size cap.
+
+        The directory is only walked on the first put and when the running
+        total passes max_bytes, so entries written by other processes are
+        counted at the next eviction.
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if self._bytes is None:
+            self._bytes = sum(size for _, size, _ in self._entries())
+        old_size = _size_or_zero(path)
+        atomic_write_json(path, value)
+        self._bytes += _size_or_zero(path) - old_size
+        if self._bytes > self.max_bytes:
+            self.evict()
+
+    def _entries(self):
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits max_bytes."""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                self.evictions += 1
+            except FileNotFoundError:
+                pass  # evicted by another process
+            total -= size
+        self._bytes = total
+
+    def clear(self):
+        for _, _, path in self._entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self._bytes = 0
+
+    def stats(self):
+        entries = self._entries()
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(entries), 'bytes': sum(size for _, size, _ in entries),
+                'max_bytes': self.max_bytes}
+
+
+def cached_result(cache, search, compute, data=None, path=None, store_if=None, **params):
+    """Return compute() through cache, keyed on the content of data or path.
+
+    With no cache this is just compute(). A computed result is only stored
+    when ``store_if(result)`` is true (always without store_if). Values
+    round-trip through JSON, so tuples come back as lists.
+    """
+    if cache is None:
+        return compute()
+    key = cache.make_key(content_hash(data, path), search, **params)
+    entry = cache.get(key)
+    if entry is not None:
+        print(f"Using cached {search} result")
+        return entry['result']
+    result = compute()
+    if store_if is None or store_if(result):
+        cache.put(key, {'result': result})
+    return result
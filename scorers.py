@@ -0,0 +1,171 @@
+"""Compression-aware scorers for ranking XOR variation candidates.
+
+The searches rank candidates by bit imbalance, which is only a proxy for
+the size after compression. The scorers here estimate that size instead:
+order-0 entropy, order-1 (previous byte) context entropy, or the real
+compressed size with one of the registered backends. All of them return a
+cost in bits or bytes, so lower is better.
+
+They are too expensive to run on every candidate, so the searches first
+build a shortlist by imbalance (see delta_search.top_candidates) and only
+rescore that. With ``sample_size`` a scorer sees a window of that many
+bytes around each edit instead of the whole buffer.
+"""
+
+import math
+from collections import Counter
+
+from compressors import get_backend
+from delta_search import apply_edit, top_candidates
+from xor_transform import transform_buffer
+
+SCORERS = ('imbalance', 'entropy0', 'entropy1', 'compressed')
+
+
+def _entropy_bits(counts, total):
+    if not total:
+        return 0.0
+    return -sum(c * math.log2(c / total) for c in counts if c)
+
+
+def order0_entropy(data):
+    """Estimated size in bits of data under an order-0 (byte frequency) model."""
+    counts = Counter(bytes(data))
+    return _entropy_bits(counts.values(), len(data))
+
+
+def order1_entropy(data):
+    """Estimated size in bits of data when each byte is coded given the previous one."""
+    data = bytes(data)
+    if len(data) < 2:
+        return order0_entropy(data)
+    pairs = Counter(zip(data, data[1:]))
+    contexts = Counter(data[:-1])
+    bits = 8.0  # first byte, no context
+    for (prev, _), count in pairs.items():
+        bits -= count * math.log2(count / contexts[prev])
+    return bits
+
+
+def compressed_size(data, backend='zlib', level=None):
+    """Real compressed size in bytes with one of the registered backends."""
+    return len(get_backend(backend).compress(bytes(data), level))
+
+
+def scoring_backend(backend):
+    """Backend for the 'compressed' scorer: the job's own, unless it stores raw."""
+    return 'zlib' if backend == 'none' else backend
+
+
+def make_scorer(name, backend='zlib', level=None):
+    """Return the cost function (lower is better) for a scorer name."""
+    if name == 'entropy0':
+        return order0_entropy
+    if name == 'entropy1':
+        return order1_entropy
+    if name == 'compressed':
+        return lambda data: compressed_size(data, backend, level)
+    raise ValueError(f"Unknown scorer '{name}' (choose from {', '.join(SCORERS[1:])})")
+
+
+def _window(data, pos, width, sample_size):
+    """Bounds of the ``sample_size`` window centred on an edit."""
+    start = max(0, min(pos + width // 2 - sample_size // 2, len(data) - sample_size))
+    return start, min(len(data), start + sample_size)
+
+
+def rank_edits(data, candidates, scorer, width=1, sample_size=None, backend='zlib', level=None):
+    """Rescore ``(pos, xor_val, score)`` edits and return them cheapest first.
+
+    Each entry of the result is ``(cost, pos, xor_val, score)``. Without a
+    sample the cost is that of the whole edited buffer; with one it is the
+    cost change inside a ``sample_size`` window around the edit. Ties keep
+    the shortlist order.
+    """
+    cost_of = make_scorer(scorer, backend, level)
+    ranked = []
+    for order, (pos, xor_val, score) in enumerate(candidates):
+        if sample_size:
+            start, stop = _window(data, pos, width, sample_size)
+            window = data[start:stop]
+            edited = apply_edit(window, pos - start, xor_val, width)
+            cost = cost_of(edited) - cost_of(window)
+        else:
+            cost = cost_of(apply_edit(data, pos, xor_val, width))
+        ranked.append((cost, order, pos, xor_val, score))
+    ranked.sort()
+    return [(cost, pos, xor_val, score) for cost, _, pos, xor_val, score in ranked]
+
+
+def choose_edits(data, width, top=1, scorer='imbalance', shortlist=16, sample_size=None,
+                 backend='zlib', level=None):
+    """The ``top`` best ``(pos, xor_val, score)`` edits of data under a scorer, best first.
+
+    'imbalance' is the searches' native score; the other scorers rescore an
+    imbalance shortlist of ``max(shortlist, top)`` candidates. Only these
+    small descriptors are kept, never edited copies of the data.
+    """
+    if scorer == 'imbalance':
+        return top_candidates(data, width, top)
+    candidates = top_candidates(data, width, max(shortlist, top))
+    ranked = rank_edits(data, candidates, scorer, width, sample_size, backend, level)
+    return [(pos, xor_val, score) for _, pos, xor_val, score in ranked[:top]]
+
+
+def choose_edit(data, width, scorer='imbalance', shortlist=16, sample_size=None,
+                backend='zlib', level=None):
+    """Pick the best ``(pos, xor_val, score)`` edit of data under a scorer.
+
+    Returns None when the data has no candidate (see choose_edits).
+    """
+    edits = choose_edits(data, width, 1, scorer, shortlist, sample_size, backend, level)
+    return edits[0] if edits else None
+
+
+def sample_blocks(data, sample_size, blocks=8):
+    """Concatenate ``blocks`` evenly spaced slices totalling about sample_size bytes."""
+    if not sample_size or len(data) <= sample_size:
+        return bytes(data)
+    block = max(1, sample_size // blocks)
+    step = (len(data) - block) / max(1, blocks - 1)
+    return b''.join(bytes(data[int(i * step):int(i * step) + block]) for i in range(blocks))
+
+
+def rank_keys(data, keys, scorer, chunk_size=255, sample_size=None, backend='zlib', level=None):
+    """Order single-byte XOR keys by the cost of the transformed (sampled) data.
+
+    Ties keep the order of ``keys``.
+    """
+    cost_of = make_scorer(scorer, backend, level)
+    sample = sample_blocks(data, sample_size)
+    costs = [cost_of(transform_buffer(sample, chunk_size, key)) for key in keys]
+    return [key for _, _, key in sorted(zip(costs, range(len(keys)), keys))]
+
+
+def scorer_report(data, width=1, scorers=SCORERS, shortlist=16, sample_size=None,
+                  backend='zlib', level=None):
+    """Compare each scorer's chosen edit with its real compressed size.
+
+    Returns a list of dicts (scorer, pos, xor, imbalance score, compressed
+    size with ``backend``), plus the unedited size as the 'original' row.
+    """
+    rows = [{'scorer': 'original', 'pos': None, 'xor': None, 'score': None,
+             'compressed_size': compressed_size(data, backend, level)}]
+    for scorer in scorers:
+        choice = choose_edit(data, width, scorer, shortlist, sample_size, backend, level)
+        if choice is None:
+            continue
+        pos, xor_val, score = choice
+        size = compressed_size(apply_edit(data, pos, xor_val, width), backend, level)
+        rows.append({'scorer': scorer, 'pos': pos, 'xor': xor_val, 'score': score,
+                     'compressed_size': size})
+    return rows
+
+
+def print_scorer_report(rows, backend='zlib'):
+    print(f"\n{'Scorer':<12}{'Position':>10}{'XOR':>8}{'Imbalance':>12}{backend + ' size':>14}")
+    for row in rows:
+        pos = '-' if row['pos'] is None else row['pos']
+        xor_val = '-' if row['xor'] is None else row['xor']
+        score = '-' if row['score'] is None else row['score']
+        print(f"{row['scorer']:<12}{pos:>10}{xor_val:>8}{score:>12}{row['compressed_size']:>14}")
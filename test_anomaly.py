@@ -0,0 +1,117 @@
+"""Checks that the fast paths give the same results as the code they replaced.
+
+Run with ``python -m unittest test_anomaly`` (or pytest).
+"""
+
+import contextlib
+import io
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from collections import Counter
+from operator import itemgetter
+
+import Anomaly_1
+import delta_search
+import xor_transform
+
+
+def per_byte_transform(data, chunk_size=4, xor_value=0xFF):
+    """The original per-chunk, per-byte transform_with_pattern loop."""
+    transformed = bytearray()
+    for i in range(0, len(data), chunk_size):
+        chunk = data[i:i + chunk_size]
+        transformed.extend([b ^ xor_value & 0xFF for b in chunk])
+    return transformed
+
+
+def skewed_bytes(rng, size):
+    """Random bytes with frequent repeats, so chunk keys have real ties."""
+    return bytes(rng.choice((0x41, 0x41, 0x00, 0xFF, rng.randrange(256))) for _ in range(size))
+
+
+class XorTransformTest(unittest.TestCase):
+
+    def test_transform_matches_per_byte_loop(self):
+        rng = random.Random(1)
+        for size in (0, 1, 3, 255, 1000, 4097):
+            data = skewed_bytes(rng, size)
+            for chunk_size in (1, 4, 255):
+                for xor_value in (0x00, 0xA5, 0xFF, 0x1FF):
+                    self.assertEqual(xor_transform.transform_buffer(data, chunk_size, xor_value),
+                                     per_byte_transform(data, chunk_size, xor_value))
+
+    def test_chunk_keys_match_per_chunk_counts(self):
+        rng = random.Random(2)
+        for size in (0, 1, 100, 4097):
+            data = skewed_bytes(rng, size)
+            for chunk_size in (1, 3, 4, 64, 65, 255):
+                keys = bytearray()
+                zeros = 0
+                for start in range(0, size, chunk_size):
+                    key, count = max(Counter(data[start:start + chunk_size]).items(),
+                                     key=itemgetter(1))
+                    keys.append(key)
+                    zeros += count
+                self.assertEqual(xor_transform.chunk_keys(data, chunk_size), (bytes(keys), zeros))
+
+    def test_keyed_transform_matches_per_byte_loop(self):
+        rng = random.Random(3)
+        for size in (0, 1, 100, 4097):
+            data = skewed_bytes(rng, size)
+            for chunk_size in (1, 4, 255, 5000):
+                keys = bytes(rng.randrange(256) for _ in range(-(-size // chunk_size)))
+                expected = bytearray(b ^ keys[i // chunk_size] for i, b in enumerate(data))
+                self.assertEqual(xor_transform.transform_with_keys(data, chunk_size, keys),
+                                 expected)
+
+
+class RunSearchTest(unittest.TestCase):
+
+    def test_sharded_search_matches_serial(self):
+        rng = random.Random(4)
+        for size in (1, 2, 50, 3000):
+            data = skewed_bytes(rng, size)
+            for width in (1, 2):
+                serial = delta_search.run_search(data, width)
+                self.assertEqual(delta_search.run_search(data, width, workers=3), serial)
+                self.assertEqual(serial[0], delta_search.search_window(data, width))
+
+
+class DecodeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='test_anomaly_')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def decoded(self, output_dir):
+        results = os.path.join(output_dir, 'decoded_results')
+        files = {}
+        for name in os.listdir(results):
+            with open(os.path.join(results, name), 'rb') as f:
+                files[name] = f.read()
+        return files
+
+    def test_parallel_decode_matches_serial(self):
+        rng = random.Random(5)
+        encoded = os.path.join(self.tmp, 'encoded')
+        with contextlib.redirect_stdout(io.StringIO()):
+            for i in range(3):
+                path = os.path.join(self.tmp, f'input{i}.jpg')
+                with open(path, 'wb') as f:
+                    f.write(skewed_bytes(rng, 5000 * (i + 1)))
+                Anomaly_1.encode_to_variations(path, encoded)
+            Anomaly_1.process_all_variation_folders(encoded, os.path.join(self.tmp, 'serial'))
+            Anomaly_1.process_all_variation_folders(encoded, os.path.join(self.tmp, 'parallel'),
+                                                    workers=3)
+        serial = self.decoded(os.path.join(self.tmp, 'serial'))
+        self.assertTrue(serial)
+        self.assertEqual(self.decoded(os.path.join(self.tmp, 'parallel')), serial)
+
+
+if __name__ == '__main__':
+    unittest.main()
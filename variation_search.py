@@ -0,0 +1,210 @@
+"""Shared driver behind the Anomaly_2-5 search scripts.
+
+Anomaly_2/4 (single byte) and Anomaly_3/5 (byte pair) are thin wrappers
+around create_best_variation, which also handles wider windows (4 or 8
+bytes) and several edits per variation through delta_search.search_edits.
+Each width keeps the folder names, file names and messages its script has
+always used.
+"""
+
+import os
+import time
+from pathlib import Path
+
+from compressors import load_backend, make_header, pack_to_file
+from delta_search import edits_pieces, run_search, search_edits
+from framed import pack_framed_to_file
+from metrics import count, progress_reporter, stage
+from result_cache import cached_result
+from scorers import choose_edits, scoring_backend
+
+_STYLES = {
+    1: {'folder': "{base}_most_zeros_ones",
+        'intro': "Evaluating XOR variations for each byte to find best compressible pattern...",
+        'improved': "Improved: byte {pos}, xor {xor} → 0s: {zeros}, 1s: {ones}, score: {score}",
+        'picked': "Scorer {scorer} picked byte {pos}, xor {xor} (score: {score})",
+        'name': "{base}_byte{pos:04d}_xor{xor:03d}{suffix}.bin",
+        'saved': "\nSaved best variation (compressed, {backend}): {path}",
+        'none': None},
+    2: {'folder': "{base}_best_2byte_variation",
+        'intro': "Evaluating 2-byte XOR variations (0 to 65535)...",
+        'improved': "Improved at pos {pos}, xor {xor}: 0s={zeros}, 1s={ones}, score={score}",
+        'picked': "Scorer {scorer} picked pos {pos}, xor {xor} (score: {score})",
+        'name': "{base}_pos{pos:04d}_xor{xor:05d}{suffix}.bin",
+        'saved': "\nBest variation saved (compressed, {backend}): {path}",
+        'none': "No improvement found."},
+}
+_MULTI_STYLE = {
+    'folder': "{base}_best_{width}byte_{edits}edit_variation",
+    'intro': "Evaluating {width}-byte XOR edits ({edits} edit(s), beam {beam})...",
+    'saved': "\nBest variation saved (compressed, {backend}): {path}",
+    'none': "No improvement found.",
+}
+
+
+def _search_params(scorer, shortlist, sample_size, backend, level, top):
+    """Parameters that decide a search's winners, for the result cache key."""
+    if scorer == 'imbalance':
+        return {'scorer': scorer, 'top': top}
+    params = {'scorer': scorer, 'shortlist': shortlist, 'sample_size': sample_size, 'top': top}
+    if scorer == 'compressed':
+        params.update(backend=scoring_backend(backend), level=level)
+    return params
+
+
+def _multi_name(base, width, edits, suffix):
+    parts = ''.join(f"_pos{pos:04d}_x{xor_val:0{2 * width}x}" for pos, xor_val in edits)
+    return f"{base}_w{width}{parts}{suffix}.bin"
+
+
+def _write_compressed(out_path, pieces, backend, level, frame_size, workers):
+    """Compress pieces to a temporary file beside out_path, then rename it over out_path.
+
+    A failed write removes the temporary file, so out_path is either
+    complete or untouched. Returns the number of bytes written.
+    """
+    directory, name = os.path.split(out_path)
+    tmp_path = os.path.join(directory, f".{name}.{os.getpid()}.part")
+    try:
+        with open(tmp_path, 'wb') as f:
+            if frame_size:
+                written = pack_framed_to_file(f, pieces, backend, level, frame_size, workers)
+            else:
+                written = pack_to_file(f, pieces, backend, level)
+        os.replace(tmp_path, out_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return written
+
+
+def create_best_variation(input_file, output_dir, width=1, edits=1, beam=1, workers=1,
+                          backend='none', level=None, scorer='imbalance', shortlist=16,
+                          sample_size=None, cache=None, deadline=None, checkpoint=None, top=1,
+                          progress=None, progress_interval=None, frame_size=None):
+    """Save the best XOR-edited variation(s) of input_file, compressed with backend.
+
+    A single edit of a 1- or 2-byte window runs the exhaustive-order
+    search of the original scripts. Other widths, or ``edits > 1``, use the
+    closed-form search_edits with ``beam`` partial sets and the imbalance
+    score only. Returns the number of files saved.
+
+    ``scorer`` is 'imbalance' (zero/one bit imbalance, searched on
+    ``workers`` processes) or one of the compression-aware scorers in
+    scorers.py, which rescore a shortlist of the ``shortlist`` most
+    imbalanced edits, optionally on a ``sample_size`` window around each.
+    A result_cache.ResultCache as ``cache`` skips the search for content it
+    has already seen.
+
+    The imbalance search stops after ``deadline`` seconds and saves the best
+    edit so far under a '_partial' name; with a ``checkpoint`` file its
+    progress is saved periodically and a rerun resumes from it. With
+    ``top > 1`` the ``top`` best edits are each saved (deadline and
+    checkpoint then do not apply). Only ``(pos, xor_val, score)``
+    descriptors are kept during the search; each saved file is streamed
+    from the input with its edit spliced in, so no edited copy is made.
+
+    Improvements go to ``progress(pos, xor_val, zeros, ones, score)`` when
+    given, otherwise they are printed at most once per
+    ``progress_interval`` seconds (default metrics.PROGRESS_INTERVAL; the
+    final one is always printed).
+
+    With a ``frame_size`` each file is written in the framed format (see
+    framed.py): independent frames compressed on ``workers`` processes,
+    extractable in parallel or by byte range.
+    """
+    try:
+        load_backend(backend)
+    except (ImportError, ValueError) as e:
+        print(f"Error: compression backend '{backend}' is not available: {e}")
+        return 0
+    try:
+        make_header(backend, level)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 0
+
+    with stage('read'), open(input_file, 'rb') as f:
+        original_data = f.read()
+    count('bytes_read', len(original_data))
+
+    exhaustive = width in _STYLES and edits == 1
+    style = _STYLES[width] if exhaustive else _MULTI_STYLE
+    base_name = Path(input_file).stem
+    save_dir = os.path.join(output_dir, style['folder'].format(base=base_name, width=width,
+                                                               edits=edits))
+
+    if not exhaustive and (scorer != 'imbalance' or top != 1):
+        print("Error: multi-edit and wide-window searches support only the imbalance "
+              "scorer and a single result.")
+        return 0
+    if os.path.isfile(save_dir):
+        print(f"Error: '{save_dir}' is a file, not a directory.")
+        return 0
+    os.makedirs(save_dir, exist_ok=True)
+
+    print(style['intro'].format(width=width, edits=edits, beam=beam))
+
+    def print_improved(pos, xor_val, zeros, ones, score):
+        print(style['improved'].format(pos=pos, xor=xor_val, zeros=zeros, ones=ones, score=score))
+
+    report = progress_reporter(progress, print_improved, progress_interval)
+
+    stop_at = None if deadline is None else time.monotonic() + deadline
+    partial = False
+
+    # Scores come from the popcount delta of the edited window; only the
+    # winners are materialised, streamed out with their edit spliced in.
+    def search():
+        nonlocal partial
+        if scorer == 'imbalance' and top == 1:
+            best, partial = run_search(original_data, width, workers, report, stop_at, checkpoint)
+            return [] if best is None else [best]
+        found = choose_edits(original_data, width, top, scorer, shortlist, sample_size,
+                             scoring_backend(backend), level)
+        if scorer != 'imbalance':
+            for pos, xor_val, score in found:
+                print(style['picked'].format(scorer=scorer, pos=pos, xor=xor_val, score=score))
+        return found
+
+    with stage('search'):
+        if exhaustive:
+            search_name = 'search_single_byte' if width == 1 else 'search_two_byte'
+            found = cached_result(cache, search_name, search, original_data,
+                                  store_if=lambda result: not partial,
+                                  **_search_params(scorer, shortlist, sample_size, backend,
+                                                   level, top))
+            variations = [([(pos, xor_val)], score) for pos, xor_val, score in found]
+        else:
+            result = cached_result(cache, f'search_edits_w{width}',
+                                   lambda: search_edits(original_data, width, edits, beam),
+                                   original_data, edits=edits, beam=beam)
+            variations = [] if result is None else [result]
+    report.flush()
+    if partial:
+        print("Deadline reached: keeping the best variation found so far (partial).")
+
+    saved = 0
+    suffix = "_partial" if partial else ""
+    for variation_edits, _ in variations:
+        if exhaustive:
+            (pos, xor_val), = variation_edits
+            best_file_name = style['name'].format(base=base_name, pos=pos, xor=xor_val,
+                                                  suffix=suffix)
+        else:
+            best_file_name = _multi_name(base_name, width, variation_edits, suffix)
+        out_path = os.path.join(save_dir, best_file_name)
+        pieces = edits_pieces(original_data, variation_edits, width)
+        with stage('write'):
+            written = _write_compressed(out_path, pieces, backend, level, frame_size, workers)
+        count('bytes_written', written)
+        count('files')
+        if saved:
+            print(f"Saved candidate {saved + 1} (compressed, {backend}): {out_path}")
+        else:
+            print(style['saved'].format(backend=backend, path=out_path))
+        saved += 1
+    if not saved and style['none']:
+        print(style['none'])
+    return saved
@@ -0,0 +1,154 @@
+"""Checksums recorded while encoding and checked while decoding.
+
+A plain variation file does not say what it decodes to, so encoding
+records a sidecar (discovery.CHECKSUM_FILE) in each variation folder with
+the length and CRC-32 of the original and the CRC-32 of every variation
+file. Containers carry the original's checksum in their header already.
+Both sides are checksummed while the data streams through the transform,
+so recording and checking cost no extra pass over the files (except for
+clone and in-place decodes, whose output is read back once).
+
+The sidecar also records a content hash (CONTENT_HASH) of each original,
+which lets a decode recognise variations of an original it has already
+produced without reading them (see Anomaly_1.process_all_variation_folders).
+"""
+
+import hashlib
+import json
+import os
+import zlib
+
+import container
+from discovery import CHECKSUM_FILE
+from result_cache import atomic_write_json
+from xor_transform import DEFAULT_BLOCK_SIZE, aligned_block_size, iter_blocks, xor_table
+
+SIDECAR_VERSION = 1
+# hashlib name of the content hash; SHA-256 runs at CRC-like speed on CPUs
+# with SHA extensions and, unlike a CRC, can identify content on its own
+CONTENT_HASH = 'sha256'
+
+
+def crc_transform(src, dst, chunk_size, xor_value, block_size=DEFAULT_BLOCK_SIZE,
+                  src_hash=None, dst_hash=None):
+    """XOR-transform file object src into dst, checksumming both sides.
+
+    ``dst=None`` discards the output (it is only checksummed). The hashlib
+    objects ``src_hash``/``dst_hash``, when given, are updated with the
+    input/output as well. Returns ``(length, src_crc, dst_crc)``.
+    """
+    if chunk_size <= 0:
+        raise ValueError("chunk_size must be positive")
+    table = xor_table(xor_value)
+    length = src_crc = dst_crc = 0
+    for block in iter_blocks(src, aligned_block_size(block_size, chunk_size)):
+        src_crc = zlib.crc32(block, src_crc)
+        if src_hash is not None:
+            src_hash.update(block)
+        out = block.tobytes().translate(table)
+        dst_crc = zlib.crc32(out, dst_crc)
+        if dst_hash is not None:
+            dst_hash.update(out)
+        if dst is not None:
+            dst.write(out)
+        length += len(out)
+    return length, src_crc, dst_crc
+
+
+def file_digest(path, block_size=DEFAULT_BLOCK_SIZE):
+    """Hex CONTENT_HASH digest of a file, read block by block."""
+    digest = hashlib.new(CONTENT_HASH)
+    with open(path, 'rb') as f:
+        for block in iter_blocks(f, block_size):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_checksums(path, block_size=DEFAULT_BLOCK_SIZE, digest=False):
+    """CRC-32 of a file and, with ``digest``, its hex CONTENT_HASH digest (else None).
+
+    For outputs written without passing through Python (clone and in-place
+    decodes), which are read back once to be verified.
+    """
+    crc = 0
+    content = hashlib.new(CONTENT_HASH) if digest else None
+    with open(path, 'rb') as f:
+        for block in iter_blocks(f, block_size):
+            crc = zlib.crc32(block, crc)
+            if content is not None:
+                content.update(block)
+    return crc, content.hexdigest() if digest else None
+
+
+def load_checksums(folder):
+    """Return a folder's checksum sidecar, or None when it has none."""
+    try:
+        with open(os.path.join(folder, CHECKSUM_FILE)) as f:
+            sidecar = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(sidecar, dict) or sidecar.get('version') != SIDECAR_VERSION:
+        return None
+    return sidecar
+
+
+def record_checksums(folder, original_name, length, crc, files, digest=None):
+    """Add an original and its ``{variation_name: variation_crc}`` to a folder's sidecar.
+
+    ``digest`` is the original's hex CONTENT_HASH digest, when known.
+    """
+    sidecar = load_checksums(folder) or {'version': SIDECAR_VERSION, 'originals': {},
+                                         'files': {}}
+    sidecar['originals'][original_name] = {'length': length, 'crc32': crc}
+    if digest is not None:
+        sidecar['originals'][original_name][CONTENT_HASH] = digest
+    for name, variation_crc in files.items():
+        sidecar['files'][name] = {'original': original_name, 'crc32': variation_crc}
+    atomic_write_json(os.path.join(folder, CHECKSUM_FILE), sidecar)
+
+
+def expected_checksum(sidecar, variation_name):
+    """Return ``(length, crc, variation_crc)`` recorded for a variation, or None."""
+    if sidecar is None:
+        return None
+    entry = sidecar['files'].get(variation_name)
+    if entry is None or entry['original'] not in sidecar['originals']:
+        return None
+    original = sidecar['originals'][entry['original']]
+    return original['length'], original['crc32'], entry['crc32']
+
+
+def expected_content(sidecar, variation_name):
+    """Return ``(length, digest)`` of the original recorded for a variation, or None."""
+    if sidecar is None:
+        return None
+    entry = sidecar['files'].get(variation_name)
+    original = entry and sidecar['originals'].get(entry['original'])
+    if not original or CONTENT_HASH not in original:
+        return None
+    return original['length'], original[CONTENT_HASH]
+
+
+def audit_file(path, chunk_size, xor_value, expected, block_size=DEFAULT_BLOCK_SIZE):
+    """Decode one variation file without writing it and check it.
+
+    Containers are checked against their header (every variation in them);
+    plain files against ``expected`` from expected_checksum, using the
+    ``chunk_size``/``xor_value`` decoded from their name. Returns
+    ``(status, length)`` where status is 'ok', 'mismatch' (the decode
+    differs from the original), 'damaged' (the variation file changed
+    since it was recorded) or 'unknown' (nothing recorded).
+    """
+    if container.is_container(path):
+        results = container.verify(path, block_size)
+        length = sum(result[1] for result in results)
+        return ('ok' if all(result[3] for result in results) else 'mismatch'), length
+    with open(path, 'rb') as src:
+        length, variation_crc, crc = crc_transform(src, None, chunk_size, xor_value, block_size)
+    if expected is None:
+        return 'unknown', length
+    if variation_crc != expected[2]:
+        return 'damaged', length
+    if (length, crc) != tuple(expected[:2]):
+        return 'mismatch', length
+    return 'ok', length
@@ -0,0 +1,298 @@
+"""Buffer-level XOR transform engine shared by the Anomaly scripts."""
+
+import mmap
+import os
+import shutil
+import tempfile
+from collections import Counter
+from functools import lru_cache
+from operator import itemgetter
+
+
+@lru_cache(maxsize=256)
+def xor_table(xor_value):
+    """Return the 256-entry translate table for a single-byte XOR key."""
+    key = xor_value & 0xFF
+    return bytes(b ^ key for b in range(256))
+
+
+def transform_buffer(data, chunk_size=4, xor_value=0xFF, out=None):
+    """XOR a whole buffer with one key at C speed.
+
+    Every chunk uses the same key, so ``chunk_size`` only changes the result
+    in the same degenerate cases as the original per-chunk loop: zero raises
+    ValueError and a negative size yields an empty result. When ``out`` is
+    given the result is written into it (a writable buffer of the same
+    length) and ``out`` is returned; otherwise a new bytearray is returned.
+    """
+    if chunk_size == 0:
+        raise ValueError("chunk_size must not be zero")
+    if chunk_size < 0:
+        data = b''
+    if not isinstance(data, (bytes, bytearray)):
+        data = bytes(data)
+    translated = data.translate(xor_table(xor_value))
+    if out is None:
+        return bytearray(translated)
+    view = memoryview(out).cast('B')
+    if len(view) != len(translated):
+        raise ValueError("Output buffer length does not match input length")
+    view[:] = translated
+    return out
+
+
+# Largest chunk whose keys chunk_keys finds by comparing byte lanes; the
+# comparisons grow with the square of the chunk size, so longer chunks are
+# counted one by one, where the per-chunk overhead is already amortised
+LANE_CHUNK_LIMIT = 64
+
+
+def _lane_keys(data, chunk_size):
+    """chunk_keys of whole chunks by comparing byte lanes as big integers.
+
+    Lane j holds byte j of every chunk, packed one byte per chunk in an
+    integer, so each step below handles all chunks at once (SWAR): the
+    pairwise lane equalities add up, per chunk, how often each position's
+    byte occurs, and the first position with the highest count gives the
+    key. Counts stay below 128, so no byte field ever carries into the next.
+    """
+    chunks = len(data) // chunk_size
+    ones = int.from_bytes(b'\x01' * chunks, 'big')
+    low7 = ones * 0x7F
+    all_bits = (1 << (8 * chunks)) - 1
+    lanes = [int.from_bytes(data[j::chunk_size], 'big') for j in range(chunk_size)]
+    counts = [ones] * chunk_size
+    for j in range(chunk_size):
+        for k in range(j + 1, chunk_size):
+            diff = lanes[j] ^ lanes[k]
+            # 1 in every byte field where the two lanes are equal
+            equal = ((((diff & low7) + low7) | diff | low7) ^ all_bits) >> 7 & ones
+            counts[j] += equal
+            counts[k] += equal
+    best_key, best_count = lanes[0], counts[0]
+    for j in range(1, chunk_size):
+        # 0xFF in every byte field where counts[j] beats the best so far
+        better = ((counts[j] + low7 - best_count) >> 7 & ones) * 0xFF
+        best_key ^= (best_key ^ lanes[j]) & better
+        best_count ^= (best_count ^ counts[j]) & better
+    return best_key.to_bytes(chunks, 'big'), sum(best_count.to_bytes(chunks, 'big'))
+
+
+def chunk_keys(data, chunk_size):
+    """Pick a key per chunk: its most frequent byte, which XOR turns into zeros.
+
+    Chunks of up to LANE_CHUNK_LIMIT bytes are keyed together, lane by lane
+    (see _lane_keys); longer ones are counted one at a time. Returns
+    ``(keys, zeros)``: one key byte per chunk (ties go to the byte seen
+    first in the chunk) and the number of zero bytes the adaptive transform
+    will produce.
+    """
+    if chunk_size <= 0:
+        raise ValueError("chunk_size must be positive")
+    if not isinstance(data, (bytes, bytearray)):
+        data = bytes(data)
+    keys = bytearray()
+    zeros = 0
+    start = 0
+    whole = len(data) - len(data) % chunk_size
+    if chunk_size <= LANE_CHUNK_LIMIT and whole:
+        keys, zeros = _lane_keys(data[:whole], chunk_size)
+        keys = bytearray(keys)
+        start = whole
+    for start in range(start, len(data), chunk_size):
+        key, count = max(Counter(data[start:start + chunk_size]).items(), key=itemgetter(1))
+        keys.append(key)
+        zeros += count
+    return bytes(keys), zeros
+
+
+def transform_with_keys(data, chunk_size, keys, out=None):
+    """XOR each chunk of data with its own key from ``keys``.
+
+    The keys are spread into a keystream as long as data (lane by lane, or
+    chunk by chunk when there are fewer chunks than bytes per chunk), which
+    is XORed with data in one big-integer operation. The transform
+    is its own inverse, so the same key table decodes. ``out`` behaves as
+    in transform_buffer.
+    """
+    if chunk_size <= 0:
+        raise ValueError("chunk_size must be positive")
+    if not isinstance(data, (bytes, bytearray)):
+        data = bytes(data)
+    length = len(data)
+    chunks = -(-length // chunk_size)
+    if len(keys) < chunks:
+        raise ValueError("Key table is shorter than the number of chunks")
+    keys = bytes(keys[:chunks])
+    if chunk_size <= chunks:
+        stream = bytearray(length)
+        for j in range(chunk_size):
+            stream[j::chunk_size] = keys[:len(range(j, length, chunk_size))]
+    else:
+        stream = b''.join(bytes((key,)) * chunk_size for key in keys)[:length]
+    translated = (int.from_bytes(data, 'big') ^ int.from_bytes(stream, 'big')).to_bytes(
+        length, 'big')
+    if out is None:
+        return bytearray(translated)
+    view = memoryview(out).cast('B')
+    if len(view) != len(translated):
+        raise ValueError("Output buffer length does not match input length")
+    view[:] = translated
+    return out
+
+
+# Default block size for the streaming (constant-memory) mode
+DEFAULT_BLOCK_SIZE = 1 << 20
+
+
+def aligned_block_size(block_size, chunk_size):
+    """Round block_size down to a whole number of chunks (at least one)."""
+    if chunk_size <= 0:
+        return max(1, block_size)
+    return max(chunk_size, block_size - block_size % chunk_size)
+
+
+def iter_blocks(src, block_size):
+    """Yield successive blocks of a binary file object through one buffer.
+
+    The yielded memoryview is only valid until the next block is read.
+    """
+    buf = bytearray(block_size)
+    view = memoryview(buf)
+    while True:
+        # Fill the whole block so short reads never shift chunk alignment
+        n = 0
+        while n < block_size:
+            got = src.readinto(view[n:])
+            if not got:
+                break
+            n += got
+        if not n:
+            break
+        yield view[:n]
+        if n < block_size:
+            break
+
+
+def transformed_blocks(src, chunk_size=4, xor_value=0xFF, block_size=DEFAULT_BLOCK_SIZE):
+    """Yield the XOR-transformed contents of a file object in chunk-aligned blocks."""
+    if chunk_size == 0:
+        raise ValueError("chunk_size must not be zero")
+    if chunk_size < 0:
+        return
+    table = xor_table(xor_value)
+    for block in iter_blocks(src, aligned_block_size(block_size, chunk_size)):
+        yield block.tobytes().translate(table)
+
+
+def stream_chunk_keys(src, chunk_size, block_size=DEFAULT_BLOCK_SIZE):
+    """chunk_keys over a file object, read in chunk-aligned blocks."""
+    keys = bytearray()
+    zeros = 0
+    for block in iter_blocks(src, aligned_block_size(block_size, chunk_size)):
+        block_keys, block_zeros = chunk_keys(block, chunk_size)
+        keys += block_keys
+        zeros += block_zeros
+    return bytes(keys), zeros
+
+
+def keyed_blocks(src, chunk_size, keys, block_size=DEFAULT_BLOCK_SIZE):
+    """Yield a file object transformed with a per-chunk key table, block by block."""
+    aligned = aligned_block_size(block_size, chunk_size)
+    first = 0
+    for block in iter_blocks(src, aligned):
+        yield transform_with_keys(block, chunk_size, keys[first:first + aligned // chunk_size])
+        first += aligned // chunk_size
+
+
+def transform_stream(src, dst, chunk_size=4, xor_value=0xFF, block_size=DEFAULT_BLOCK_SIZE):
+    """XOR-transform a file object into another in chunk-aligned blocks.
+
+    Peak memory is about two blocks regardless of input size, and because
+    blocks hold whole chunks the output is byte-identical to transforming
+    the whole buffer at once. Returns the number of bytes written.
+    """
+    written = 0
+    for block in transformed_blocks(src, chunk_size, xor_value, block_size):
+        written += dst.write(block)
+    return written
+
+
+def transform_file(input_path, output_path, chunk_size=4, xor_value=0xFF,
+                   block_size=DEFAULT_BLOCK_SIZE):
+    """Stream input_path through the XOR transform into output_path."""
+    with open(input_path, 'rb') as src, open(output_path, 'wb') as dst:
+        return transform_stream(src, dst, chunk_size, xor_value, block_size)
+
+
+def transform_file_in_place(path, chunk_size=4, xor_value=0xFF, block_size=DEFAULT_BLOCK_SIZE):
+    """XOR a file with one key directly in its mapped pages, block by block.
+
+    The transform keeps the length and is its own inverse, so no second
+    buffer or output file is needed and every byte is written once. The
+    file is only consistent once this returns; an interrupted run leaves
+    the blocks done so far transformed (running it again over them
+    restores them). Returns the file length.
+    """
+    if chunk_size <= 0:
+        raise ValueError("chunk_size must be positive for an in-place transform")
+    length = os.path.getsize(path)
+    if not length or xor_value & 0xFF == 0:
+        return length
+    table = xor_table(xor_value)
+    step = aligned_block_size(block_size, mmap.ALLOCATIONGRANULARITY)
+    with open(path, 'r+b') as f, mmap.mmap(f.fileno(), 0) as mm:
+        for start in range(0, length, step):
+            mm[start:start + step] = mm[start:start + step].translate(table)
+        mm.flush()
+    return length
+
+
+# ioctl request that shares a file's extents with another (Linux FICLONE)
+FICLONE = 0x40049409
+
+
+def clone_file(src_path, dst_path):
+    """Copy src_path to dst_path as a reflink where the filesystem allows it.
+
+    A reflink (btrfs, XFS, ...) shares the source's blocks copy-on-write,
+    so the copy itself writes no data. Elsewhere the kernel copy
+    (shutil.copyfile) is used. Returns 'reflink' or 'copy'.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        fcntl = None
+    if fcntl is not None:
+        with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+            try:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                return 'reflink'
+            except OSError:
+                pass
+    shutil.copyfile(src_path, dst_path)
+    return 'copy'
+
+
+def transform_file_cloned(input_path, output_path, chunk_size=4, xor_value=0xFF,
+                          block_size=DEFAULT_BLOCK_SIZE):
+    """transform_file through a clone of the input, transformed in place.
+
+    The clone is made under a temporary name next to output_path and only
+    renamed over it once transformed, so output_path never holds a
+    half-written file. Returns ``(length, method)`` with method as in
+    clone_file.
+    """
+    directory = os.path.dirname(os.path.abspath(output_path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.xor_', suffix='.tmp')
+    os.close(fd)
+    try:
+        method = clone_file(input_path, tmp_path)
+        shutil.copymode(input_path, tmp_path)
+        length = transform_file_in_place(tmp_path, chunk_size, xor_value, block_size)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return length, method